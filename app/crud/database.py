@@ -1,11 +1,14 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, insert, and_, or_, tuple_, case
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
-from app.models.db_entry import Bank, BankItem, PriceSnapshot
+from app.models.db_entry import Bank, BankItem, BankValuation, PriceRun, ItemPrice, BankPriceRun, PriceSnapshot
+from app.models.db_entry import ItemPriceBucket, PriceBucketWatermark, BankAlias, BankVersion, BankVersionItem
+from app.utils.compaction import reclaim_space
 
 
-def create_bank(db: Session, name: str, created_at):
-    bank = Bank(name=name, created_at=created_at)
+def create_bank(db: Session, name: str, created_at, content_hash: str = None, item_set_hash: str = None):
+    bank = Bank(name=name, created_at=created_at, content_hash=content_hash, item_set_hash=item_set_hash)
     db.add(bank)
     db.flush()
     return bank
@@ -36,34 +39,201 @@ def create_bank_item(
     return bank_item
 
 
-def create_price_snapshot(
+def bulk_create_bank_items(db: Session, bank_id: int, items: list[dict]):
+    """
+    Inserts every item of a bank in one executemany INSERT ... RETURNING instead of one flush per item.
+    :param db: Session
+    :param bank_id: id of the Bank the items belong to
+    :param items: list of dicts keyed by BankItem column names (item_id, name, quantity, ...)
+    :return: List of new BankItem ids in the same order as items
+    """
+    if not items:
+        return []
+
+    result = db.execute(
+        insert(BankItem).returning(BankItem.id, sort_by_parameter_order=True),
+        [{**item, "bank_id": bank_id} for item in items],
+    )
+    return result.scalars().all()
+
+
+def get_or_create_price_run(db: Session, fetched_at):
+    """
+    Returns the PriceRun of a price fetch, creating it the first time any bank is valued against that fetch.
+    :param db: Session
+    :param fetched_at: datetime the prices were fetched from the api
+    :return: PriceRun
+    """
+    price_run = db.query(PriceRun).filter_by(fetched_at=fetched_at).first()
+    if price_run:
+        return price_run
+
+    price_run = PriceRun(fetched_at=fetched_at)
+    db.add(price_run)
+    db.flush()
+    return price_run
+
+
+def bulk_create_item_prices(db: Session, run_id: int, unit_prices: dict):
+    """
+    Inserts the unit prices of a run in one executemany INSERT. Prices already stored for the run by another bank
+    are skipped, so N banks refreshed from one fetch only write each item price once.
+    :param db: Session
+    :param run_id: id of the PriceRun
+    :param unit_prices: Dict -> {item_id: (high, low)}
+    :return: Number of prices passed in
+    """
+    if unit_prices:
+        db.execute(
+            sqlite_insert(ItemPrice).on_conflict_do_nothing(),
+            [
+                {"run_id": run_id, "item_id": item_id, "high": high, "low": low}
+                for item_id, (high, low) in unit_prices.items()
+            ],
+        )
+
+    return len(unit_prices)
+
+
+def create_bank_price_run(db: Session, bank_id: int, run_id: int, timestamp, version: int = 1):
+    bank_price_run = BankPriceRun(bank_id=bank_id, run_id=run_id, timestamp=timestamp, version=version)
+    db.add(bank_price_run)
+    return bank_price_run
+
+
+def create_bank_valuation(
         db: Session,
-        bank_item_id: int,
-        item_name: str,
+        bank_id: int,
         timestamp,
-        high_value: int,
         low_value: int,
         mean_value: float,
+        high_value: int,
+        item_count: int,
 ):
 
-    snapshot = PriceSnapshot(
-        bank_item_id=bank_item_id,
-        item_name=item_name,
+    valuation = BankValuation(
+        bank_id=bank_id,
         timestamp=timestamp,
-        high_value_estimate=high_value,
-        low_value_estimate=low_value,
-        mean_value_estimate=mean_value,
+        low_value_total=low_value,
+        mean_value_total=mean_value,
+        high_value_total=high_value,
+        item_count=item_count,
     )
-    db.add(snapshot)
-    return snapshot
+    db.add(valuation)
+    return valuation
+
+
+# BankItems a bank holds now, rows retired by a later holdings version only back the snapshots taken before it
+HELD_NOW = BankItem.until_version.is_(None)
 
 
 def read_all_items(db: Session):
-    return db.query(BankItem).all()
+    return db.query(BankItem).filter(HELD_NOW).all()
 
 
 def read_all_items_by_bank_id(db: Session, bank_id: int):
-    return db.query(BankItem).filter_by(bank_id=bank_id).all()
+    return db.query(BankItem).filter(BankItem.bank_id == bank_id, HELD_NOW).all()
+
+
+def read_all_items_by_bank_ids(db: Session, bank_ids: list):
+    """
+    Reads the items of several banks with one query.
+    :return: Dict -> {bank_id: [BankItem]}
+    """
+    items_by_bank = {bank_id: [] for bank_id in bank_ids}
+    if not bank_ids:
+        return items_by_bank
+
+    for item in db.query(BankItem).filter(BankItem.bank_id.in_(bank_ids), HELD_NOW):
+        items_by_bank[item.bank_id].append(item)
+
+    return items_by_bank
+
+
+# Columns the bank item browser sorts by, each has a (bank_id, column) index
+BANK_ITEM_SORT_COLUMNS = {"name": BankItem.name, "quantity": BankItem.quantity, "item_id": BankItem.item_id}
+
+
+def query_bank_items(
+        db: Session,
+        bank_id: int,
+        is_tradeable: bool = None,
+        has_uncharged_id: bool = None,
+        has_ornament_kit_equipped: bool = None,
+        name_prefix: str = None,
+):
+    """
+    Items a bank holds now, filtered in SQL. Filters left at None match every item, see read_bank_items_page.
+    :return: Query of BankItem
+    """
+    query = db.query(BankItem).filter(BankItem.bank_id == bank_id, HELD_NOW)
+    if is_tradeable is not None:
+        query = query.filter(BankItem.is_tradeable.is_(is_tradeable))
+    if has_uncharged_id is not None:
+        query = query.filter(BankItem.uncharged_id.is_not(None) if has_uncharged_id else BankItem.uncharged_id.is_(None))
+    if has_ornament_kit_equipped is not None:
+        query = query.filter(BankItem.has_ornament_kit_equipped.is_(has_ornament_kit_equipped))
+    if name_prefix:
+        query = query.filter(BankItem.name.istartswith(name_prefix, autoescape=True))
+
+    return query
+
+
+def count_bank_items(db: Session, bank_id: int, **filters):
+    """
+    :param filters: is_tradeable, has_uncharged_id, has_ornament_kit_equipped and name_prefix, see query_bank_items
+    :return: Int -> items of the bank matching the filters
+    """
+    return query_bank_items(db=db, bank_id=bank_id, **filters).order_by(None).count()
+
+
+def read_bank_items_page(
+        db: Session,
+        bank_id: int,
+        sort: str = "name",
+        descending: bool = False,
+        after: tuple = None,
+        page_size: int = 50,
+        total: int = None,
+        **filters,
+):
+    """
+    One page of a bank's items, filtered and sorted in SQL. Pages are keyset paginated on (sort column, id), so any
+    page is one range scan of a (bank_id, sort column) index instead of an OFFSET reading every skipped row. Counting
+    the matching items reads all of them -> pass the total counted for the first page and later pages only seek.
+    :param db: Session
+    :param bank_id: id of the Bank
+    :param sort: key of BANK_ITEM_SORT_COLUMNS
+    :param descending: sort from highest to lowest
+    :param after: (sort value, id) of the last item of the previous page -> default the first page
+    :param page_size: items per page
+    :param total: count_bank_items of the same filters -> default counted here
+    :param filters: is_tradeable, has_uncharged_id, has_ornament_kit_equipped and name_prefix, see query_bank_items
+    :return: Tuple -> (List of BankItem, items matching the filters, after key of the next page or None on the last)
+    """
+    if sort not in BANK_ITEM_SORT_COLUMNS:
+        raise ValueError(f"Unknown sort column '{sort}', choose one of {list(BANK_ITEM_SORT_COLUMNS)}")
+
+    sort_column = BANK_ITEM_SORT_COLUMNS[sort]
+    query = query_bank_items(db=db, bank_id=bank_id, **filters)
+
+    if total is None:
+        total = query.order_by(None).count()
+
+    if after is not None:
+        keyset = tuple_(sort_column, BankItem.id)
+        query = query.filter(keyset < tuple_(*after) if descending else keyset > tuple_(*after))
+
+    order = [sort_column.desc(), BankItem.id.desc()] if descending else [sort_column, BankItem.id]
+    # One row past the page tells whether another page follows
+    items = query.order_by(*order).limit(page_size + 1).all()
+
+    next_after = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        next_after = (getattr(items[-1], sort), items[-1].id)
+
+    return items, total, next_after
 
 
 def read_item_quantity_by_bank_item_id(db: Session, bank_item_id):
@@ -73,11 +243,15 @@ def read_item_quantity_by_bank_item_id(db: Session, bank_item_id):
 
 def get_bank_id_by_name(db: Session, bank_name: str):
     bank = db.query(Bank).filter_by(name=bank_name).first()
-    return bank.id if bank else None
+    if bank:
+        return bank.id
+
+    # Names linked to an identical bank resolve to it
+    return db.query(BankAlias.bank_id).filter_by(name=bank_name).scalar()
 
 
 def get_all_tradeable_if_uncharged_items(db: Session):
-    return db.query(BankItem).filter(BankItem.uncharged_id.is_not(None)).all()
+    return db.query(BankItem).filter(BankItem.uncharged_id.is_not(None), HELD_NOW).all()
 
 
 def get_all_banks(db: Session):
@@ -90,50 +264,192 @@ def get_bank_by_name(db: Session, name: str):
 
 
 def bank_name_is_unique(db: Session, bank_name: str):
-    return not db.query(Bank).filter(Bank.name.ilike(bank_name)).first()
+    return (
+        not db.query(Bank).filter(Bank.name.ilike(bank_name)).first()
+        and not db.query(BankAlias).filter(BankAlias.name.ilike(bank_name)).first()
+    )
+
+
+def get_bank_by_content_hash(db: Session, content_hash: str):
+    """:return: Bank imported with exactly the same items and quantities, the oldest if several, else None"""
+    return db.query(Bank).filter_by(content_hash=content_hash).order_by(Bank.id).first()
+
+
+def get_bank_by_item_set_hash(db: Session, item_set_hash: str):
+    """:return: Bank holding the same item ids, the latest if several, else None"""
+    return db.query(Bank).filter_by(item_set_hash=item_set_hash).order_by(Bank.id.desc()).first()
+
+
+def create_bank_alias(db: Session, name: str, bank_id: int, created_at):
+    bank_alias = BankAlias(name=name, bank_id=bank_id, created_at=created_at)
+    db.add(bank_alias)
+    db.flush()
+    return bank_alias
+
+
+def read_bank_alias_names(db: Session, bank_id: int):
+    """:return: List of names linked to the bank, oldest first"""
+    return [name for name, in db.query(BankAlias.name).filter_by(bank_id=bank_id).order_by(BankAlias.id)]
+
+
+def bank_names_are_unique(db: Session, bank_names: list):
+    """
+    bank_name_is_unique for many names in one query, names are compared case insensitive.
+    :return: Dict -> {bank_name: True if no bank has that name yet}
+    """
+    lowered = {bank_name: bank_name.lower() for bank_name in bank_names}
+    taken = set()
+    if lowered:
+        names = set(lowered.values())
+        query = (
+            db.query(func.lower(Bank.name)).filter(func.lower(Bank.name).in_(names))
+            .union(db.query(func.lower(BankAlias.name)).filter(func.lower(BankAlias.name).in_(names)))
+        )
+        taken = {name for name, in query}
+
+    return {bank_name: lowered_name not in taken for bank_name, lowered_name in lowered.items()}
+
+
+def query_price_snapshots(db: Session):
+    """
+    Price snapshots are not stored per bank item, they are BankItem.quantity x the ItemPrice of every run the bank
+    was valued against. Each run joins the BankItems held at its holdings version, which are never updated, so a
+    snapshot keeps the value it was written with whatever the bank holds later. Rows carry the same fields the old
+    PriceSnapshot table had.
+    :param db: Session
+    :return: Query of rows -> bank_item_id, item_name, timestamp, high/low/mean_value_estimate
+    """
+    return (
+        db.query(
+            BankItem.id.label("bank_item_id"),
+            BankItem.name.label("item_name"),
+            BankPriceRun.timestamp.label("timestamp"),
+            (ItemPrice.high * BankItem.quantity).label("high_value_estimate"),
+            (ItemPrice.low * BankItem.quantity).label("low_value_estimate"),
+            ((ItemPrice.high + ItemPrice.low) * BankItem.quantity / 2.0).label("mean_value_estimate"),
+        )
+        .select_from(BankPriceRun)
+        .join(BankItem, and_(
+            BankItem.bank_id == BankPriceRun.bank_id,
+            BankItem.since_version <= BankPriceRun.version,
+            or_(BankItem.until_version.is_(None), BankItem.until_version > BankPriceRun.version),
+        ))
+        .join(ItemPrice, and_(ItemPrice.run_id == BankPriceRun.run_id, ItemPrice.item_id == BankItem.item_id))
+    )
 
 
 def read_all_price_snapshots(db: Session):
-    return db.query(PriceSnapshot).all()
+    return query_price_snapshots(db).all()
 
 
 def read_latest_item_snapshot(db: Session, item_name: str, bank_name: str):
+    bank_id = get_bank_id_by_name(db=db, bank_name=bank_name)
     latest_snapshot = (
-        db.query(PriceSnapshot)
-        .join(PriceSnapshot.bank_item)
-        .join(BankItem.bank)
+        query_price_snapshots(db)
         .filter(
-            Bank.name == bank_name,
-            PriceSnapshot.item_name == item_name
+            BankPriceRun.bank_id == bank_id,
+            BankItem.name == item_name
         )
-        .order_by(PriceSnapshot.timestamp.desc())
+        .order_by(BankPriceRun.timestamp.desc())
         .first()
     )
 
     return latest_snapshot
 
 
+def read_latest_bank_snapshots(db: Session, bank_name: str):
+    """
+    Reads the latest price snapshot of every item a bank holds now with a single windowed query.
+    :param db: Session
+    :param bank_name: Name of bank within DB
+    :return: Dict -> {bank_item_id: snapshot row}
+    """
+    bank_id = get_bank_id_by_name(db=db, bank_name=bank_name)
+    ranked = (
+        query_price_snapshots(db)
+        .add_columns(
+            func.row_number().over(
+                partition_by=BankItem.id,
+                order_by=BankPriceRun.timestamp.desc(),
+            ).label("row_number"),
+        )
+        .filter(BankPriceRun.bank_id == bank_id, HELD_NOW)
+        .subquery()
+    )
+
+    latest_snapshots = (
+        db.query(
+            ranked.c.bank_item_id,
+            ranked.c.item_name,
+            ranked.c.timestamp,
+            ranked.c.high_value_estimate,
+            ranked.c.low_value_estimate,
+            ranked.c.mean_value_estimate,
+        )
+        .filter(ranked.c.row_number == 1)
+        .all()
+    )
+
+    return {snapshot.bank_item_id: snapshot for snapshot in latest_snapshots}
+
+
 def read_single_item_snapshots(db: Session, item_name: str, bank_name: str):
+    bank_id = get_bank_id_by_name(db=db, bank_name=bank_name)
     snapshots = (
-        db.query(PriceSnapshot)
-        .join(PriceSnapshot.bank_item)
-        .join(BankItem.bank)
+        query_price_snapshots(db)
         .filter(
-            Bank.name == bank_name,
-            PriceSnapshot.item_name == item_name
+            BankPriceRun.bank_id == bank_id,
+            BankItem.name == item_name
         )
+        .order_by(BankPriceRun.timestamp)
         .all()
     )
 
     return snapshots
 
 
+def query_bank_price_history(db: Session, bank_id: int, since=None, item_name: str = None):
+    """
+    Price snapshots of one bank with the columns needed to rebuild history outside the DB.
+    :param db: Session
+    :param bank_id: id of the Bank
+    :param since: only snapshots after this timestamp
+    :param item_name: only snapshots of this item
+    :return: Query ordered by timestamp
+    """
+    query = (
+        query_price_snapshots(db)
+        .add_columns(BankPriceRun.bank_id, BankItem.item_id, BankItem.quantity)
+        .filter(BankPriceRun.bank_id == bank_id)
+    )
+
+    if since is not None:
+        query = query.filter(BankPriceRun.timestamp > since)
+
+    if item_name is not None:
+        query = query.filter(BankItem.name == item_name)
+
+    return query.order_by(BankPriceRun.timestamp)
+
+
+def read_latest_bank_valuation(db: Session, bank_name: str):
+    bank_id = get_bank_id_by_name(db=db, bank_name=bank_name)
+    latest_valuation = (
+        db.query(BankValuation)
+        .filter(BankValuation.bank_id == bank_id)
+        .order_by(BankValuation.timestamp.desc())
+        .first()
+    )
+
+    return latest_valuation
+
+
 def get_similar_item_snapshots(db: Session, user_entry: str, bank_name: str):
+    bank_id = get_bank_id_by_name(db=db, bank_name=bank_name)
     similar_items = (
         db.query(BankItem.name)
-        .join(Bank)
         .filter(
-            Bank.name == bank_name,
+            BankItem.bank_id == bank_id,
             BankItem.name.ilike(f"%{user_entry}%"))
         .distinct()
         .limit(10)
@@ -145,21 +461,385 @@ def get_similar_item_snapshots(db: Session, user_entry: str, bank_name: str):
 
 def get_latest_snapshot_time(db: Session, passed_bank_id: int):
     last_snapshot_timestamp = (
-        db.query(func.max(PriceSnapshot.timestamp))
-        .join(PriceSnapshot.bank_item)
-        .filter(BankItem.bank_id == passed_bank_id)
+        db.query(func.max(BankPriceRun.timestamp))
+        .filter(BankPriceRun.bank_id == passed_bank_id)
         .scalar()
     )
     return last_snapshot_timestamp
 
 
-def delete_bank(db: Session, bank_name: str):
-    bank = db.query(Bank).filter_by(name=bank_name).first()
+def get_latest_snapshot_times(db: Session):
+    """
+    Latest snapshot timestamp of every bank with one grouped query.
+    :return: Dict -> {bank_id: timestamp}, banks without snapshots are left out
+    """
+    rows = (
+        db.query(BankPriceRun.bank_id, func.max(BankPriceRun.timestamp))
+        .group_by(BankPriceRun.bank_id)
+        .all()
+    )
+    return {bank_id: timestamp for bank_id, timestamp in rows}
+
+
+def read_bank_holdings(db: Session, bank_ids: list = None):
+    """
+    Every item of the banks as plain rows, no ORM objects -> input of the valuation engine.
+    :param db: Session
+    :param bank_ids: only these banks -> default every bank
+    :return: List of (bank_id, bank_item_id, item_id, name, quantity) ordered by bank_id
+    """
+    query = db.query(BankItem.bank_id, BankItem.id, BankItem.item_id, BankItem.name, BankItem.quantity).filter(HELD_NOW)
+    if bank_ids is not None:
+        query = query.filter(BankItem.bank_id.in_(bank_ids))
+
+    return query.order_by(BankItem.bank_id, BankItem.id).all()
+
+
+def read_price_run_times(db: Session, since=None, until=None, run_ids: list = None):
+    """
+    :param run_ids: only these runs
+    :param since: only runs fetched at or after this time (UTC)
+    :param until: only runs fetched at or before this time (UTC)
+    :return: List of (run_id, fetched_at) ordered by fetched_at
+    """
+    query = db.query(PriceRun.id, PriceRun.fetched_at)
+    if since is not None:
+        query = query.filter(PriceRun.fetched_at >= since)
+    if until is not None:
+        query = query.filter(PriceRun.fetched_at <= until)
+    if run_ids is not None:
+        query = query.filter(PriceRun.id.in_(run_ids))
+
+    return query.order_by(PriceRun.fetched_at).all()
+
+
+def read_item_prices_of_runs(db: Session, run_ids: list):
+    """
+    :return: List of (run_id, item_id, high, low) of every ItemPrice in the runs
+    """
+    if not run_ids:
+        return []
+
+    return (
+        db.query(ItemPrice.run_id, ItemPrice.item_id, ItemPrice.high, ItemPrice.low)
+        .filter(ItemPrice.run_id.in_(run_ids))
+        .all()
+    )
+
+
+def get_latest_price_run_ids(db: Session, bank_ids: list):
+    """
+    :return: Dict -> {bank_id: id of the PriceRun of the bank's latest snapshot}, banks without snapshots left out
+    """
+    latest = (
+        db.query(BankPriceRun.bank_id, func.max(BankPriceRun.timestamp).label("timestamp"))
+        .filter(BankPriceRun.bank_id.in_(bank_ids))
+        .group_by(BankPriceRun.bank_id)
+        .subquery()
+    )
+    rows = (
+        db.query(BankPriceRun.bank_id, BankPriceRun.run_id)
+        .join(latest, and_(
+            BankPriceRun.bank_id == latest.c.bank_id,
+            BankPriceRun.timestamp == latest.c.timestamp,
+        ))
+        .all()
+    )
+    return {bank_id: run_id for bank_id, run_id in rows}
+
+
+def get_holdings_versions(db: Session, bank_ids: list):
+    """
+    :return: Dict -> {bank_id: latest BankVersion.version}, banks that were never versioned hold version 1 and are
+             left out
+    """
+    if not bank_ids:
+        return {}
 
-    if not bank:
+    rows = (
+        db.query(BankVersion.bank_id, func.max(BankVersion.version))
+        .filter(BankVersion.bank_id.in_(bank_ids))
+        .group_by(BankVersion.bank_id)
+        .all()
+    )
+    return {bank_id: version for bank_id, version in rows}
+
+
+def retire_bank_items(db: Session, bank_id: int, item_ids: list, version: int):
+    """
+    Ends the holdings of item_ids at version -> the rows keep backing the snapshots taken before it.
+    :return: Int -> BankItems retired
+    """
+    if not item_ids:
+        return 0
+
+    return (
+        db.query(BankItem)
+        .filter(BankItem.bank_id == bank_id, BankItem.item_id.in_(item_ids), HELD_NOW)
+        .update({BankItem.until_version: version}, synchronize_session=False)
+    )
+
+
+def create_bank_version(
+        db: Session,
+        bank_id: int,
+        version: int,
+        parent_id,
+        created_at,
+        content_hash: str,
+        item_count: int,
+        change_count: int,
+):
+    bank_version = BankVersion(
+        bank_id=bank_id,
+        version=version,
+        parent_id=parent_id,
+        created_at=created_at,
+        content_hash=content_hash,
+        item_count=item_count,
+        change_count=change_count,
+    )
+    db.add(bank_version)
+    db.flush()
+    return bank_version
+
+
+def bulk_create_bank_version_items(db: Session, bank_id: int, version: int, items: list[dict]):
+    """
+    :param items: list of dicts -> {"item_id", "name", "quantity"}, quantity 0 for a removed item
+    :return: Int -> rows inserted
+    """
+    if not items:
+        return 0
+
+    db.connection().execute(
+        insert(BankVersionItem),
+        [{**item, "bank_id": bank_id, "version": version} for item in items],
+    )
+    return len(items)
+
+
+def read_bank_versions(db: Session, bank_id: int):
+    """:return: List of BankVersion ordered by version"""
+    return db.query(BankVersion).filter_by(bank_id=bank_id).order_by(BankVersion.version).all()
+
+
+def get_versioned_banks(db: Session):
+    """:return: List of (bank_id, name, latest version) of banks with at least two versions"""
+    return (
+        db.query(Bank.id, Bank.name, func.max(BankVersion.version))
+        .join(BankVersion, BankVersion.bank_id == Bank.id)
+        .group_by(Bank.id)
+        .having(func.count(BankVersion.id) >= 2)
+        .order_by(Bank.name)
+        .all()
+    )
+
+
+def get_latest_bank_version(db: Session, bank_id: int):
+    return db.query(BankVersion).filter_by(bank_id=bank_id).order_by(BankVersion.version.desc()).first()
+
+
+def materialize_bank_version(db: Session, bank_id: int, version: int, item_ids: list = None):
+    """
+    Items of a bank as of a version -> for every item the newest delta at or before version, removed items left out.
+    One range scan of the (bank_id, item_id, version) primary key, however many versions the bank has.
+    :param db: Session
+    :param bank_id: id of the Bank
+    :param version: version number to materialize
+    :param item_ids: only these items -> default every item
+    :return: List of (item_id, name, quantity) ordered by item_id
+    """
+    latest = (
+        db.query(BankVersionItem.item_id, func.max(BankVersionItem.version).label("version"))
+        .filter(BankVersionItem.bank_id == bank_id, BankVersionItem.version <= version)
+    )
+    if item_ids is not None:
+        latest = latest.filter(BankVersionItem.item_id.in_(item_ids))
+    latest = latest.group_by(BankVersionItem.item_id).subquery()
+
+    return (
+        db.query(BankVersionItem.item_id, BankVersionItem.name, BankVersionItem.quantity)
+        .join(latest, and_(
+            BankVersionItem.bank_id == bank_id,
+            BankVersionItem.item_id == latest.c.item_id,
+            BankVersionItem.version == latest.c.version,
+        ))
+        .filter(BankVersionItem.quantity > 0)
+        .order_by(BankVersionItem.item_id)
+        .all()
+    )
+
+
+def read_changed_item_ids(db: Session, bank_id: int, after_version: int, until_version: int):
+    """:return: Set of item ids with a delta in versions after_version + 1 .. until_version"""
+    rows = (
+        db.query(BankVersionItem.item_id)
+        .filter(
+            BankVersionItem.bank_id == bank_id,
+            BankVersionItem.version > after_version,
+            BankVersionItem.version <= until_version,
+        )
+        .distinct()
+    )
+    return {item_id for item_id, in rows}
+
+
+def get_tracked_item_ids(db: Session):
+    """
+    Item ids whose prices some bank needs -> every tradeable BankItem.item_id plus the uncharged ids charged items
+    are priced by. Coins are always worth 1 and left out.
+    :return: Set of item ids
+    """
+    item_ids = db.query(BankItem.item_id).filter(BankItem.is_tradeable, BankItem.item_id != 995, HELD_NOW).union(
+        db.query(BankItem.uncharged_id).filter(BankItem.uncharged_id.isnot(None), HELD_NOW)
+    )
+    return {item_id for item_id, in item_ids}
+
+
+def get_price_bucket_watermark(db: Session, timestep: int):
+    """:return: Int -> start of the newest ingested bucket of timestep, None if nothing was ingested yet"""
+    return db.query(PriceBucketWatermark.bucket_ts).filter_by(timestep=timestep).scalar()
+
+
+def set_price_bucket_watermark(db: Session, timestep: int, bucket_ts: int):
+    db.merge(PriceBucketWatermark(timestep=timestep, bucket_ts=bucket_ts))
+
+
+def bulk_create_item_price_buckets(db: Session, rows: list[dict]):
+    """
+    Inserts price buckets in one executemany INSERT, buckets already stored are skipped.
+    :param db: Session
+    :param rows: list of dicts keyed by ItemPriceBucket column names
+    :return: Int -> rows inserted
+    """
+    if not rows:
+        return 0
+
+    # Core execute on the session's connection -> a plain executemany whose rowcount counts the inserted rows
+    return db.connection().execute(sqlite_insert(ItemPriceBucket).on_conflict_do_nothing(), rows).rowcount
+
+
+def get_item_ids_with_price_buckets(db: Session, timestep: int):
+    """:return: Set of item ids that have at least one bucket of timestep"""
+    item_ids = db.query(ItemPriceBucket.item_id).filter_by(timestep=timestep).distinct()
+    return {item_id for item_id, in item_ids}
+
+
+def read_item_price_buckets(db: Session, item_id: int, timestep: int, since: int = None):
+    """
+    :param since: only buckets starting at or after this unix time
+    :return: List of ItemPriceBucket ordered by bucket_ts
+    """
+    query = db.query(ItemPriceBucket).filter_by(item_id=item_id, timestep=timestep)
+    if since is not None:
+        query = query.filter(ItemPriceBucket.bucket_ts >= since)
+
+    return query.order_by(ItemPriceBucket.bucket_ts).all()
+
+
+def read_item_price_bucket_series(db: Session, item_id: int, timestep: int, points: int, since: int = None):
+    """
+    Price buckets of an item averaged down to at most points in SQL -> buckets are grouped into equal time slots
+    spanning the stored range and each slot's prices are weighted by trade volume.
+    :param timestep: bucket length in seconds of the stored series, 300 or 3600
+    :param points: most slots returned
+    :param since: only buckets starting at or after this unix time
+    :return: List of (slot start unix time, avg_high, avg_low) ordered by time, prices None where nothing traded
+    """
+    bounds = db.query(func.min(ItemPriceBucket.bucket_ts), func.max(ItemPriceBucket.bucket_ts)).filter(
+        ItemPriceBucket.item_id == item_id,
+        ItemPriceBucket.timestep == timestep,
+    )
+    if since is not None:
+        bounds = bounds.filter(ItemPriceBucket.bucket_ts >= since)
+    first, last = bounds.one()
+    if first is None:
+        return []
+
+    # Whole buckets per slot, ceil so the range fits in points slots
+    width = timestep * max(1, -(-(last - first + timestep) // (timestep * points)))
+    slot = (ItemPriceBucket.bucket_ts - first) // width
+
+    def volume_weighted(price, volume):
+        return func.coalesce(
+            func.sum(price * volume) * 1.0 / func.nullif(func.sum(case((price.is_not(None), volume), else_=0)), 0),
+            func.avg(price),
+        )
+
+    return (
+        db.query(
+            first + slot * width,
+            volume_weighted(ItemPriceBucket.avg_high, ItemPriceBucket.high_volume),
+            volume_weighted(ItemPriceBucket.avg_low, ItemPriceBucket.low_volume),
+        )
+        .filter(
+            ItemPriceBucket.item_id == item_id,
+            ItemPriceBucket.timestep == timestep,
+            ItemPriceBucket.bucket_ts >= first,
+        )
+        .group_by(slot)
+        .order_by(slot)
+        .all()
+    )
+
+
+def delete_bank(db: Session, bank_name: str, vacuum: str = None):
+    """
+    Deletes a bank with set based DELETEs instead of loading its items and history into the session. Every table is
+    cleared by its own DELETE so the rows removed are the counts SQLite reports, price runs are only removed when the
+    deleted bank was the last one valued against them.
+    :param db: Session
+    :param bank_name: Name of bank within DB
+    :param vacuum: "incremental", "full" or None, see compaction.reclaim_space -> freed pages are returned after commit
+    :return: Dict -> rows removed per table and bytes_reclaimed when vacuum is set, False if no bank has bank_name
+    """
+    bank_id = get_bank_id_by_name(db=db, bank_name=bank_name)
+
+    if bank_id is None:
         return False
 
-    db.delete(bank)
+    # Collected before the bank's links are gone -> only these runs can have lost their last bank
+    run_ids = [run_id for run_id, in db.query(BankPriceRun.run_id).filter(BankPriceRun.bank_id == bank_id)]
+    item_ids = db.query(BankItem.id).filter(BankItem.bank_id == bank_id)
+
+    rows_removed = {
+        "price_snapshots": (
+            db.query(PriceSnapshot)
+            .filter(PriceSnapshot.bank_item_id.in_(item_ids))
+            .delete(synchronize_session=False)
+        ),
+    }
+    # A version's parent cascades to it and cascaded rows are not in a DELETE's rowcount -> unlink the chain first
+    db.query(BankVersion).filter(BankVersion.bank_id == bank_id).update(
+        {BankVersion.parent_id: None}, synchronize_session=False
+    )
+    for table in (BankVersionItem, BankVersion, BankAlias, BankValuation, BankPriceRun, BankItem, Bank):
+        bank_column = table.id if table is Bank else table.bank_id
+        rows_removed[table.__tablename__] = (
+            db.query(table)
+            .filter(bank_column == bank_id)
+            .delete(synchronize_session=False)
+        )
+
+    unused_run_ids = [
+        run_id for run_id, in db.query(PriceRun.id).filter(PriceRun.id.in_(run_ids), ~PriceRun.bank_runs.any())
+    ]
+    rows_removed["item_prices"] = (
+        db.query(ItemPrice)
+        .filter(ItemPrice.run_id.in_(unused_run_ids))
+        .delete(synchronize_session=False)
+    )
+    rows_removed["price_runs"] = (
+        db.query(PriceRun)
+        .filter(PriceRun.id.in_(unused_run_ids))
+        .delete(synchronize_session=False)
+    )
+
     db.commit()
 
-    return True
+    if vacuum:
+        size_before, size_after = reclaim_space(vacuum=vacuum, db_engine=db.get_bind())
+        rows_removed["bytes_reclaimed"] = size_before - size_after
+
+    return rows_removed
@@ -1,20 +1,159 @@
 from sqlalchemy import create_engine, event
 from sqlalchemy.orm import declarative_base, sessionmaker
+import os
 import sqlite3
+import threading
+
+from app.migrations import run_migrations
 
 Base = declarative_base()
 
-engine = create_engine("sqlite:///Bank_Data.db", echo=True)
+DATABASE_URL = "sqlite:///Bank_Data.db"
+
+# Select with env var OBVA_DB_PROFILE -> interactive(default), bulk-import, read-only
+# journal_mode=WAL lets other Streamlit sessions keep reading while a price refresh writes
+ENGINE_PROFILES = {
+    "interactive": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -16_000,  # negative -> KiB, ~16MB
+        "mmap_size": 64 * 1024 * 1024,
+        "temp_store": "MEMORY",
+    },
+    "bulk-import": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",  # fastest, a crash mid import can lose the import but not corrupt older data
+        "cache_size": -64_000,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+    },
+    "read-only": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -32_000,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "query_only": "ON",  # must stay last, journal_mode can not be changed once query_only is on
+    },
+}
+
+DB_PROFILE = os.environ.get("OBVA_DB_PROFILE", "interactive")
+# SQL statement logging is opt-in for debugging -> OBVA_SQL_ECHO=1
+SQL_ECHO = os.environ.get("OBVA_SQL_ECHO", "").lower() in ("1", "true", "yes", "on")
+
+
+def create_db_engine(profile: str = DB_PROFILE, url: str = DATABASE_URL, echo: bool = SQL_ECHO):
+    """
+    Creates a SQLite engine whose connections get foreign keys and the PRAGMAs of the selected profile on connect.
+    :param profile: key of ENGINE_PROFILES
+    :param url: SQLAlchemy database url
+    :param echo: log every SQL statement to stdout
+    :return: Engine
+    """
+    if profile not in ENGINE_PROFILES:
+        raise ValueError(f"Unknown database profile '{profile}', choose one of {list(ENGINE_PROFILES)}")
+
+    pragmas = ENGINE_PROFILES[profile]
+    db_engine = create_engine(url, echo=echo)
+
+    @event.listens_for(db_engine, "connect")
+    def configure_sqlite_connection(dbapi_connection, connection_record):
+        if isinstance(dbapi_connection, sqlite3.Connection):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA foreign_keys=ON")
+            for pragma, value in pragmas.items():
+                cursor.execute(f"PRAGMA {pragma}={value}")
+            cursor.close()
+
+    return db_engine
+
+
+engine = create_db_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=True, bind=engine)
 
+# Generation of the database -> the single row of db_generation, bumped in the same transaction as every write
+# committed through SessionLocal. UI reads are cached per generation, and any process sharing the file sees a new one
+BUMP_DB_GENERATION = (
+    "INSERT INTO db_generation (id, generation) VALUES (1, 1) "
+    "ON CONFLICT (id) DO UPDATE SET generation = generation + 1 RETURNING generation"
+)
+# Newest generation this process has read or written, kept so its own writes are seen before the next read
+_db_generation = 0
+_db_generation_lock = threading.Lock()
+
+
+def _remember_db_generation(generation: int) -> int:
+    global _db_generation
+    with _db_generation_lock:
+        _db_generation = max(_db_generation, generation)
+        return _db_generation
+
+
+def get_db_generation() -> int:
+    """:return: Int -> newest generation this process knows of, see read_db_generation"""
+    return _db_generation
+
+
+def read_db_generation() -> int:
+    """
+    Reads the generation from the database -> picks up writes committed by other processes, e.g. a scheduled price
+    refresh or compaction run from a script.
+    :return: Int -> the newest generation known to this process
+    """
+    with engine.connect() as connection:
+        generation = connection.exec_driver_sql("SELECT generation FROM db_generation WHERE id = 1").scalar()
+    return _remember_db_generation(generation or 0)
+
+
+def bump_db_generation(connection=None) -> int:
+    """
+    Marks cached UI reads stale. Writes through SessionLocal bump it on commit by themselves, call it directly only
+    after changing what the UI reads outside the database, e.g. the price history archive.
+    :param connection: Connection whose transaction the bump commits with -> default its own transaction
+    :return: Int -> the new generation, known to get_db_generation once the transaction has committed
+    """
+    if connection is None:
+        with engine.begin() as connection:
+            generation = bump_db_generation(connection=connection)
+        return _remember_db_generation(generation)
+
+    return connection.exec_driver_sql(BUMP_DB_GENERATION).scalar()
+
+
+def _total_changes(connection) -> int:
+    """Rows inserted, updated or deleted over the lifetime of the sqlite3 connection"""
+    return connection.connection.dbapi_connection.total_changes
+
+
+@event.listens_for(SessionLocal, "after_begin")
+def remember_total_changes(session, transaction, connection):
+    session.info["total_changes"] = _total_changes(connection)
+
+
+@event.listens_for(SessionLocal, "after_transaction_end")
+def forget_total_changes(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("total_changes", None)
+        session.info.pop("db_generation", None)
+
+
+@event.listens_for(SessionLocal, "before_commit")
+def bump_db_generation_on_write(session):
+    """Bumps the generation inside the committing transaction if it changed any row, whatever wrote them"""
+    if session.new or session.dirty or session.deleted:
+        session.flush()
+
+    total_changes = session.info.pop("total_changes", None)
+    if total_changes is not None and _total_changes(session.connection()) != total_changes:
+        session.info["db_generation"] = bump_db_generation(connection=session.connection())
+
 
-@event.listens_for(engine, "connect")
-def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
-    if isinstance(dbapi_connection, sqlite3.Connection):
-        cursor = dbapi_connection.cursor()
-        cursor.execute("PRAGMA foreign_keys=ON")
-        cursor.close()
+@event.listens_for(SessionLocal, "after_commit")
+def remember_committed_db_generation(session):
+    if "db_generation" in session.info:
+        _remember_db_generation(session.info.pop("db_generation"))
 
 
 def init_db():
     Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
@@ -0,0 +1,196 @@
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from app.utils.file_io import bank_content_hashes
+
+# Schema version is stored in SQLite's PRAGMA user_version of Bank_Data.db.
+# Base.metadata.create_all only creates missing tables, it never alters existing ones, so every change to an existing
+# table (and every data backfill) goes here as a new numbered migration. init_db always runs create_all first, so new
+# tables already exist when migrations run. Migrations also run on brand-new databases, so each one must be safe to
+# run against a schema that already has the change (IF NOT EXISTS, INSERT OR IGNORE etc).
+MIGRATIONS = []
+
+
+def migration(version: int, description: str):
+    """
+    Registers the decorated function as the upgrade step for schema version.
+    :param version: schema version the database is at once the function has run
+    :param description: short summary printed when the migration is applied
+    :return: decorator
+    """
+    def register(upgrade):
+        MIGRATIONS.append((version, description, upgrade))
+        return upgrade
+
+    return register
+
+
+def get_schema_version(connection: Connection) -> int:
+    return connection.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def set_schema_version(connection: Connection, version: int):
+    connection.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+
+
+def add_column_if_missing(connection: Connection, table: str, column: str, column_type: str):
+    columns = [row[1] for row in connection.exec_driver_sql(f"PRAGMA table_info({table})")]
+    if column not in columns:
+        connection.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+
+def run_migrations(engine: Engine) -> int:
+    """
+    Applies every registered migration newer than the database's schema version, each in its own transaction.
+    :param engine: Engine bound to the SQLite database to upgrade
+    :return: Int -> schema version after upgrading
+    """
+    with engine.connect() as connection:
+        current_version = get_schema_version(connection)
+
+    for version, description, upgrade in sorted(MIGRATIONS, key=lambda entry: entry[0]):
+        if version <= current_version:
+            continue
+
+        with engine.begin() as connection:
+            upgrade(connection)
+            set_schema_version(connection, version)
+
+        print(f"Applied migration {version}: {description}")
+        current_version = version
+
+    return current_version
+
+
+@migration(1, "composite indexes for price history queries")
+def add_price_snapshot_indexes(connection: Connection):
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_price_snapshots_bank_item_id_timestamp "
+        "ON price_snapshots (bank_item_id, timestamp)"
+    ))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_price_snapshots_item_name_timestamp "
+        "ON price_snapshots (item_name, timestamp)"
+    ))
+
+
+@migration(2, "backfill bank_valuations from existing price snapshots")
+def backfill_bank_valuations(connection: Connection):
+    connection.execute(text(
+        "INSERT OR IGNORE INTO bank_valuations "
+        "(bank_id, timestamp, low_value_total, mean_value_total, high_value_total, item_count) "
+        "SELECT bank_items.bank_id, price_snapshots.timestamp, "
+        "SUM(price_snapshots.low_value_estimate), SUM(price_snapshots.mean_value_estimate), "
+        "SUM(price_snapshots.high_value_estimate), COUNT(*) "
+        "FROM price_snapshots JOIN bank_items ON bank_items.id = price_snapshots.bank_item_id "
+        "GROUP BY bank_items.bank_id, price_snapshots.timestamp"
+    ))
+
+
+@migration(3, "convert price_snapshots into shared price runs with unit prices")
+def convert_price_snapshots_to_price_runs(connection: Connection):
+    # Legacy snapshots stored price x quantity per bank item -> one run per snapshot timestamp holding unit prices
+    connection.execute(text(
+        "INSERT OR IGNORE INTO price_runs (fetched_at) "
+        "SELECT DISTINCT timestamp FROM price_snapshots WHERE timestamp IS NOT NULL"
+    ))
+    connection.execute(text(
+        "INSERT OR IGNORE INTO item_prices (run_id, item_id, high, low) "
+        "SELECT price_runs.id, bank_items.item_id, "
+        "price_snapshots.high_value_estimate / bank_items.quantity, "
+        "price_snapshots.low_value_estimate / bank_items.quantity "
+        "FROM price_snapshots "
+        "JOIN bank_items ON bank_items.id = price_snapshots.bank_item_id "
+        "JOIN price_runs ON price_runs.fetched_at = price_snapshots.timestamp "
+        "WHERE bank_items.quantity > 0"
+    ))
+    connection.execute(text(
+        "INSERT OR IGNORE INTO bank_price_runs (bank_id, run_id, timestamp) "
+        "SELECT DISTINCT bank_items.bank_id, price_runs.id, price_snapshots.timestamp "
+        "FROM price_snapshots "
+        "JOIN bank_items ON bank_items.id = price_snapshots.bank_item_id "
+        "JOIN price_runs ON price_runs.fetched_at = price_snapshots.timestamp"
+    ))
+    connection.execute(text("DELETE FROM price_snapshots"))
+
+
+@migration(4, "price run compaction columns")
+def add_price_run_compaction_columns(connection: Connection):
+    add_column_if_missing(connection, "price_runs", "sample_count", "INTEGER NOT NULL DEFAULT 1")
+    add_column_if_missing(connection, "price_runs", "period_end", "DATETIME")
+    for column in ["high_min", "high_max", "low_min", "low_max"]:
+        add_column_if_missing(connection, "item_prices", column, "INTEGER")
+
+
+@migration(5, "content hashes of imported banks")
+def add_bank_content_hashes(connection: Connection):
+    add_column_if_missing(connection, "banks", "content_hash", "VARCHAR")
+    add_column_if_missing(connection, "banks", "item_set_hash", "VARCHAR")
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_banks_content_hash ON banks (content_hash)"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_banks_item_set_hash ON banks (item_set_hash)"))
+
+    # sha256 has no SQLite function -> hash the items of every existing bank here
+    items_by_bank = {}
+    for bank_id, item_id, quantity in connection.execute(text("SELECT bank_id, item_id, quantity FROM bank_items")):
+        items_by_bank.setdefault(bank_id, []).append({"item_id": item_id, "quantity": quantity})
+
+    for bank_id, items in items_by_bank.items():
+        content_hash, item_set_hash = bank_content_hashes(items)
+        connection.execute(
+            text("UPDATE banks SET content_hash = :content_hash, item_set_hash = :item_set_hash WHERE id = :bank_id"),
+            {"content_hash": content_hash, "item_set_hash": item_set_hash, "bank_id": bank_id},
+        )
+
+
+@migration(6, "bank item indexes for paginated browsing")
+def add_bank_item_page_indexes(connection: Connection):
+    for column in ["name", "quantity", "item_id"]:
+        connection.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_bank_items_bank_id_{column} ON bank_items (bank_id, {column})"
+        ))
+
+
+@migration(7, "holdings version of bank items and bank price runs")
+def add_holdings_versions(connection: Connection):
+    # Every existing row belongs to version 1 and is still held -> the column defaults
+    add_column_if_missing(connection, "bank_items", "since_version", "INTEGER NOT NULL DEFAULT 1")
+    add_column_if_missing(connection, "bank_items", "until_version", "INTEGER")
+    add_column_if_missing(connection, "bank_price_runs", "version", "INTEGER NOT NULL DEFAULT 1")
+
+
+@migration(8, "holdings of banks versioned before their bank items were kept per version")
+def backfill_holdings_versions(connection: Connection):
+    # Re-imports used to replace BankItems in place -> rebuild the version ranges from the stored version deltas
+    versioned_banks = "SELECT bank_id FROM bank_versions WHERE version > 1"
+
+    # A run was valued against the latest version created by its snapshot time
+    connection.execute(text(
+        "UPDATE bank_price_runs SET version = COALESCE(("
+        "SELECT MAX(bank_versions.version) FROM bank_versions "
+        "WHERE bank_versions.bank_id = bank_price_runs.bank_id "
+        "AND bank_versions.created_at <= bank_price_runs.timestamp), 1) "
+        f"WHERE bank_id IN ({versioned_banks})"
+    ))
+    # Held rows were written by the last delta of their item
+    connection.execute(text(
+        "UPDATE bank_items SET since_version = COALESCE(("
+        "SELECT MAX(bank_version_items.version) FROM bank_version_items "
+        "WHERE bank_version_items.bank_id = bank_items.bank_id "
+        "AND bank_version_items.item_id = bank_items.item_id), 1) "
+        f"WHERE until_version IS NULL AND bank_id IN ({versioned_banks})"
+    ))
+    # Rows replaced by a later delta were deleted -> restore them, held until that delta
+    connection.execute(text(
+        "INSERT INTO bank_items (bank_id, item_id, name, quantity, is_tradeable, uncharged_id, "
+        "has_ornament_kit_equipped, since_version, until_version) "
+        "SELECT deltas.bank_id, deltas.item_id, deltas.name, deltas.quantity, COALESCE(flags.is_tradeable, 0), "
+        "flags.uncharged_id, COALESCE(flags.has_ornament_kit_equipped, 0), deltas.version, deltas.next_version "
+        "FROM (SELECT bank_id, item_id, name, quantity, version, "
+        "LEAD(version) OVER (PARTITION BY bank_id, item_id ORDER BY version) AS next_version "
+        "FROM bank_version_items) AS deltas "
+        # Tradeability and charges depend on the item alone -> taken from any row of the item
+        "LEFT JOIN (SELECT item_id, MAX(is_tradeable) AS is_tradeable, MAX(uncharged_id) AS uncharged_id, "
+        "MAX(has_ornament_kit_equipped) AS has_ornament_kit_equipped FROM bank_items GROUP BY item_id) AS flags "
+        "ON flags.item_id = deltas.item_id "
+        f"WHERE deltas.quantity > 0 AND deltas.next_version IS NOT NULL AND deltas.bank_id IN ({versioned_banks})"
+    ))
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Float, ForeignKey, UniqueConstraint
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Float, ForeignKey, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime, timezone
 
@@ -11,6 +11,9 @@ class Bank(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False, unique=True)
     created_at = Column(DateTime, default=datetime.now(timezone.utc))
+    # Hashes of the imported item set, see bank_content_hashes -> re-imports are found with an index lookup
+    content_hash = Column(String, nullable=True, index=True)
+    item_set_hash = Column(String, nullable=True, index=True)
 
     items = relationship(
         "BankItem",
@@ -18,10 +21,107 @@ class Bank(Base):
         cascade="all, delete-orphan",
         passive_deletes=True,
     )
+    valuations = relationship(
+        "BankValuation",
+        back_populates="bank",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+    price_runs = relationship(
+        "BankPriceRun",
+        back_populates="bank",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+    aliases = relationship(
+        "BankAlias",
+        back_populates="bank",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+    versions = relationship(
+        "BankVersion",
+        back_populates="bank",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+
+
+class BankAlias(Base):
+    """Another name an identical export was imported under, linked to the bank instead of copying its items."""
+    __tablename__ = "bank_aliases"
+
+    id = Column(Integer, primary_key=True)
+    bank_id = Column(
+        Integer,
+        ForeignKey("banks.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+    name = Column(String, nullable=False, unique=True)
+    created_at = Column(DateTime, default=datetime.now(timezone.utc))
+
+    bank = relationship("Bank", back_populates="aliases")
+
+
+class BankVersion(Base):
+    """
+    One export of a bank. Version 1 holds every item, later versions only hold the items added, removed or changed
+    since their parent in bank_version_items, so re-importing a bank stores what changed instead of a full copy.
+    """
+    __tablename__ = "bank_versions"
+    __table_args__ = (
+        UniqueConstraint("bank_id", "version", name="uq_bank_versions_bank_id_version"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    bank_id = Column(
+        Integer,
+        ForeignKey("banks.id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    version = Column(Integer, nullable=False)
+    parent_id = Column(Integer, ForeignKey("bank_versions.id", ondelete="CASCADE"), nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    content_hash = Column(String, nullable=True)
+    item_count = Column(Integer, nullable=False, default=0)  # items of the materialized version
+    change_count = Column(Integer, nullable=False, default=0)  # rows stored in bank_version_items
+
+    bank = relationship("Bank", back_populates="versions")
+
+
+class BankVersionItem(Base):
+    """
+    Item of a version delta -> quantity of item_id from this version on, 0 once removed. Keyed by bank and item first
+    so materializing a version is one range scan of the bank.
+    """
+    __tablename__ = "bank_version_items"
+    __table_args__ = (
+        # Items changed between two versions -> diffs read only the deltas in between
+        Index("ix_bank_version_items_bank_id_version", "bank_id", "version"),
+        {"sqlite_with_rowid": False},
+    )
+
+    bank_id = Column(Integer, ForeignKey("banks.id", ondelete="CASCADE"), primary_key=True)
+    item_id = Column(Integer, primary_key=True)
+    version = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    quantity = Column(Integer, nullable=False)
 
 
 class BankItem(Base):
+    """
+    An item a bank holds from holdings version since_version until the version that replaces it. Price snapshots
+    are the quantity x ItemPrice of the BankItems held at a BankPriceRun's version, so a row is never updated once a
+    run refers to it -> a new version retires the rows it changes by setting until_version and adds new ones.
+    """
     __tablename__ = "bank_items"
+    __table_args__ = (
+        # Sorted pages of one bank's items -> the implicit trailing id makes (sort column, id) keysets index ranges
+        Index("ix_bank_items_bank_id_name", "bank_id", "name"),
+        Index("ix_bank_items_bank_id_quantity", "bank_id", "quantity"),
+        Index("ix_bank_items_bank_id_item_id", "bank_id", "item_id"),
+    )
 
     id = Column(Integer, primary_key=True)
     bank_id = Column(
@@ -35,6 +135,8 @@ class BankItem(Base):
     is_tradeable = Column(Boolean, default=False)
     uncharged_id = Column(Integer, nullable=True)
     has_ornament_kit_equipped = Column(Boolean, default=False)
+    since_version = Column(Integer, nullable=False, default=1, server_default="1")
+    until_version = Column(Integer, nullable=True)  # None while the bank still holds the item
 
     bank = relationship("Bank", back_populates="items")
     price_snapshots = relationship(
@@ -46,7 +148,15 @@ class BankItem(Base):
 
 
 class PriceSnapshot(Base):
+    """
+    Legacy storage -> one row per bank item per refresh with prices already multiplied by quantity.
+    Migration 3 converts these rows into price runs, new snapshots are only written to PriceRun/ItemPrice.
+    """
     __tablename__ = "price_snapshots"
+    __table_args__ = (
+        Index("ix_price_snapshots_bank_item_id_timestamp", "bank_item_id", "timestamp"),
+        Index("ix_price_snapshots_item_name_timestamp", "item_name", "timestamp"),
+    )
 
     id = Column(Integer, primary_key=True)
     bank_item_id = Column(
@@ -60,3 +170,128 @@ class PriceSnapshot(Base):
     mean_value_estimate = Column(Float)
 
     bank_item = relationship("BankItem", back_populates="price_snapshots")
+
+
+class PriceRun(Base):
+    """One fetch_all_item_prices result, shared by every bank refreshed from it."""
+    __tablename__ = "price_runs"
+
+    id = Column(Integer, primary_key=True)
+    fetched_at = Column(DateTime, nullable=False, unique=True)
+    # Set by price history compaction when several runs are merged into this one -> fetched_at to period_end
+    sample_count = Column(Integer, nullable=False, default=1, server_default="1")
+    period_end = Column(DateTime, nullable=True)
+
+    item_prices = relationship(
+        "ItemPrice",
+        back_populates="run",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+    bank_runs = relationship("BankPriceRun", back_populates="run", passive_deletes=True)
+
+
+class ItemPrice(Base):
+    """Resolved unit price of item_id in a run -> charged/ornament kit/coins rules already applied."""
+    __tablename__ = "item_prices"
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    run_id = Column(
+        Integer,
+        ForeignKey("price_runs.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    item_id = Column(Integer, primary_key=True)
+    high = Column(Integer, nullable=False)
+    low = Column(Integer, nullable=False)
+    # Only set on compacted runs, high/low then hold the mean of the merged runs
+    high_min = Column(Integer, nullable=True)
+    high_max = Column(Integer, nullable=True)
+    low_min = Column(Integer, nullable=True)
+    low_max = Column(Integer, nullable=True)
+
+    run = relationship("PriceRun", back_populates="item_prices")
+
+
+class BankPriceRun(Base):
+    """
+    A bank valued against a price run -> price snapshots are BankItem.quantity x ItemPrice of the run for the
+    BankItems held at version, so a snapshot keeps its value whatever the bank holds later.
+    """
+    __tablename__ = "bank_price_runs"
+    __table_args__ = (
+        UniqueConstraint("bank_id", "timestamp", name="uq_bank_price_runs_bank_id_timestamp"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    bank_id = Column(
+        Integer,
+        ForeignKey("banks.id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    run_id = Column(
+        Integer,
+        ForeignKey("price_runs.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+    timestamp = Column(DateTime, nullable=False)
+    version = Column(Integer, nullable=False, default=1, server_default="1")  # holdings version of the bank valued
+
+    bank = relationship("Bank", back_populates="price_runs")
+    run = relationship("PriceRun", back_populates="bank_runs")
+
+
+class BankValuation(Base):
+    """Bank totals of one price snapshot run, written alongside the PriceSnapshots so the UI never re-sums them."""
+    __tablename__ = "bank_valuations"
+    __table_args__ = (
+        UniqueConstraint("bank_id", "timestamp", name="uq_bank_valuations_bank_id_timestamp"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    bank_id = Column(
+        Integer,
+        ForeignKey("banks.id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    timestamp = Column(DateTime, nullable=False)
+    low_value_total = Column(Integer, nullable=False, default=0)
+    mean_value_total = Column(Float, nullable=False, default=0)
+    high_value_total = Column(Integer, nullable=False, default=0)
+    item_count = Column(Integer, nullable=False, default=0)
+
+    bank = relationship("Bank", back_populates="valuations")
+
+
+class ItemPriceBucket(Base):
+    """
+    Averaged wiki api prices of an item over one bucket -> /5m, /1h or /timeseries data. Times are unix seconds and
+    rows are keyed by item first so one item's history is a single range scan.
+    """
+    __tablename__ = "item_price_buckets"
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    item_id = Column(Integer, primary_key=True)
+    timestep = Column(Integer, primary_key=True)  # bucket length in seconds, 300 for /5m, 3600 for /1h
+    bucket_ts = Column(Integer, primary_key=True)  # start of the bucket
+    avg_high = Column(Integer, nullable=True)
+    high_volume = Column(Integer, nullable=False, default=0)
+    avg_low = Column(Integer, nullable=True)
+    low_volume = Column(Integer, nullable=False, default=0)
+
+
+class PriceBucketWatermark(Base):
+    """Newest bucket of a timestep ingested from /5m or /1h, the next ingestion continues after it."""
+    __tablename__ = "price_bucket_watermarks"
+
+    timestep = Column(Integer, primary_key=True)
+    bucket_ts = Column(Integer, nullable=False)
+
+
+class DbGeneration(Base):
+    """Single row counting commits that changed data, see app.database.read_db_generation."""
+    __tablename__ = "db_generation"
+
+    id = Column(Integer, primary_key=True)
+    generation = Column(Integer, nullable=False, default=0)
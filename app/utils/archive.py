@@ -0,0 +1,165 @@
+import json
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from app.crud.database import get_all_banks, get_bank_id_by_name, query_bank_price_history
+from app.database import SessionLocal, bump_db_generation
+from app.models.db_entry import Bank
+
+
+# Price history archive -> uncompressed Arrow IPC files so reads can memory map them without a decode step
+# Layout: archive/price_history/bank_id=<id>/month=<YYYY-MM>/part-<export time ms>.arrow
+ARCHIVE_DIR = "archive/price_history"
+WATERMARK_FILE = f"{ARCHIVE_DIR}/_watermark.json"
+
+ARCHIVE_SCHEMA = pa.schema([
+    ("bank_id", pa.int64()),
+    ("bank_item_id", pa.int64()),
+    ("item_id", pa.int64()),
+    ("item_name", pa.string()),
+    ("quantity", pa.int64()),
+    ("timestamp", pa.timestamp("us")),
+    ("high_value_estimate", pa.int64()),
+    ("low_value_estimate", pa.int64()),
+    ("mean_value_estimate", pa.float64()),
+])
+
+
+def read_watermarks():
+    """
+    Reads the last exported snapshot timestamp of every bank.
+    :return: Dict -> {bank_id: datetime}
+    """
+    if not os.path.exists(WATERMARK_FILE):
+        return {}
+
+    with open(file=WATERMARK_FILE, mode="r", encoding="utf-8") as f:
+        watermarks = json.load(f)
+
+    return {int(bank_id): datetime.fromisoformat(timestamp) for bank_id, timestamp in watermarks.items()}
+
+
+def save_watermarks(watermarks: dict):
+    temp_file = f"{WATERMARK_FILE}.tmp"
+    with open(file=temp_file, mode="w", encoding="utf-8") as f:
+        json.dump({str(bank_id): timestamp.isoformat() for bank_id, timestamp in watermarks.items()}, f, indent=2)
+
+    os.replace(temp_file, WATERMARK_FILE)
+
+
+def read_price_history_frame(db, bank_id: int, since=None, item_name: str = None):
+    """Loads price history rows straight into pandas, no ORM objects."""
+    df = pd.read_sql(
+        query_bank_price_history(db=db, bank_id=bank_id, since=since, item_name=item_name).statement,
+        db.connection(),
+    )
+    df["timestamp"] = pd.to_datetime(df["timestamp"])
+    return df.reindex(columns=ARCHIVE_SCHEMA.names)
+
+
+def write_archive_file(df, bank_id: int, month: str):
+    partition_dir = Path(ARCHIVE_DIR) / f"bank_id={bank_id}" / f"month={month}"
+    partition_dir.mkdir(parents=True, exist_ok=True)
+    path = partition_dir / f"part-{time.time_ns() // 1_000_000}.arrow"
+
+    table = pa.Table.from_pandas(df, schema=ARCHIVE_SCHEMA, preserve_index=False)
+    with pa.OSFile(str(path), "wb") as sink:
+        with pa.ipc.new_file(sink, ARCHIVE_SCHEMA) as writer:
+            writer.write_table(table)
+
+    return path
+
+
+def export_price_history():
+    """
+    Appends every price snapshot newer than each bank's watermark to the archive, one file per bank and month.
+    :return: Dict -> {"banks": banks exported, "rows": rows written, "files": files written}
+    """
+    watermarks = read_watermarks()
+    banks_exported = 0
+    rows_written = 0
+    files_written = 0
+
+    with SessionLocal() as db:
+        for bank in get_all_banks(db=db):
+            df = read_price_history_frame(db=db, bank_id=bank.id, since=watermarks.get(bank.id))
+            if df.empty:
+                continue
+
+            for month, month_df in df.groupby(df["timestamp"].dt.strftime("%Y-%m")):
+                write_archive_file(df=month_df, bank_id=bank.id, month=month)
+                files_written += 1
+
+            watermarks[bank.id] = df["timestamp"].max().to_pydatetime()
+            banks_exported += 1
+            rows_written += len(df)
+
+    if banks_exported:
+        save_watermarks(watermarks)
+        # Files only, no commit bumps the generation -> price history cached before the export is read again
+        bump_db_generation()
+
+    return {"banks": banks_exported, "rows": rows_written, "files": files_written}
+
+
+def read_archive(bank_id: int, item_name: str = None):
+    """
+    Memory maps every archive file of a bank into one Arrow table, optionally keeping only item_name rows.
+    :return: pyarrow.Table
+    """
+    tables = []
+    for path in sorted(Path(ARCHIVE_DIR).glob(f"bank_id={bank_id}/month=*/*.arrow")):
+        table = pa.ipc.open_file(pa.memory_map(str(path), "r")).read_all()
+        if item_name is not None:
+            table = table.filter(pc.equal(table["item_name"], item_name))
+        tables.append(table)
+
+    if not tables:
+        return ARCHIVE_SCHEMA.empty_table()
+
+    return pa.concat_tables(tables)
+
+
+def read_price_history(bank_name: str, item_name: str = None, since: datetime = None):
+    """
+    Price history of a bank (or one of its items) as a DataFrame. A bank's history is the archived rows plus the rows
+    written since the last export, so the result is complete whether or not the archive is up to date. One item's
+    history is read from SQLite alone -> an index range scan of its rows beats filtering every archive file of the
+    bank, runs merged by compaction are read back merged.
+    :param bank_name: Name of bank within DB
+    :param item_name: only rows of this item
+    :param since: only rows after this naive UTC time, filtered in SQL and in Arrow before anything reaches pandas
+    :return: DataFrame with ARCHIVE_SCHEMA columns ordered by timestamp
+    """
+    with SessionLocal() as db:
+        # Names linked to an identical bank read that bank's history
+        bank_id = get_bank_id_by_name(db=db, bank_name=bank_name)
+        bank = db.get(Bank, bank_id) if bank_id is not None else None
+        if not bank:
+            return ARCHIVE_SCHEMA.empty_table().to_pandas()
+
+        if item_name is not None:
+            return read_price_history_frame(db=db, bank_id=bank.id, since=since, item_name=item_name)
+
+        watermark = read_watermarks().get(bank.id)
+        live_since = max(watermark, since) if watermark and since else watermark or since
+        live_df = read_price_history_frame(db=db, bank_id=bank.id, since=live_since, item_name=item_name)
+
+        archived = read_archive(bank_id=bank.id, item_name=item_name)
+        # Ids are reused after a bank is deleted, skip archived rows from before this bank existed
+        archived = archived.filter(pc.greater_equal(archived["timestamp"], pa.scalar(bank.created_at, pa.timestamp("us"))))
+        if since is not None:
+            archived = archived.filter(pc.greater(archived["timestamp"], pa.scalar(since, pa.timestamp("us"))))
+        archived_df = archived.to_pandas()
+
+    frames = [df for df in [archived_df, live_df] if not df.empty]
+    if not frames:
+        return live_df
+
+    return pd.concat(frames, ignore_index=True).sort_values("timestamp", kind="stable", ignore_index=True)
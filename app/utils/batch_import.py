@@ -0,0 +1,122 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from app.crud.database import bank_names_are_unique
+from app.database import SessionLocal
+from app.utils.file_io import parse_bank_tsv
+from app.utils.price_providers import PriceProvider, FixedPriceProvider, LIVE_PRICES
+from app.utils.snapshot import enter_new_bank, find_duplicate_bank, link_bank_name
+
+
+def parse_bank_file(path: str):
+    """
+    Parses one saved Bank Memory export, runs in the worker processes of import_bank_directory.
+    :param path: .txt holding the TSV copied from the Bank Memory plugin
+    :return: Tuple -> (items, seconds taken)
+    """
+    start = time.perf_counter()
+    with open(file=path, mode="r", encoding="utf-8") as f:
+        items = list(parse_bank_tsv(f))
+
+    return items, time.perf_counter() - start
+
+
+def import_bank_directory(
+        directory: str,
+        pattern: str = "*.txt",
+        provider: PriceProvider = LIVE_PRICES,
+        workers: int = None,
+        duplicates: str = "link",
+):
+    """
+    Imports every Bank Memory export in a directory as a new bank named after its file. Files are parsed in a process
+    pool, prices are fetched once for the whole batch and each bank is written in its own bulk transaction, so one
+    bad file does not stop the others.
+    :param directory: directory of saved exports, e.g. "items/exports"
+    :param pattern: glob of the export files -> default "*.txt"
+    :param provider: PriceProvider the prices and snapshot time come from -> default live wiki api prices
+    :param workers: parser processes -> default os.cpu_count(), 0 parses in this process
+    :param duplicates: exports identical to a bank already imported -> "link" their name to it, "skip" them or "copy"
+                       them into a new bank
+    :return: List of dicts -> one per file, {"file", "bank_name", "items", "parse_seconds", "write_seconds",
+             "linked_to", "error"}
+    """
+    if duplicates not in ("link", "skip", "copy"):
+        raise ValueError(f"Unknown duplicates option '{duplicates}', choose one of link, skip, copy")
+
+    paths = sorted(Path(directory).glob(pattern))
+    results = {
+        path: {"file": path.name, "bank_name": path.stem, "items": 0, "parse_seconds": 0.0, "write_seconds": 0.0,
+               "linked_to": None, "error": None}
+        for path in paths
+    }
+
+    # Every name checked in one query, names repeated within the batch only import once
+    with SessionLocal() as db:
+        is_unique = bank_names_are_unique(db=db, bank_names=[path.stem for path in paths])
+
+    seen = set()
+    to_import = []
+    for path in paths:
+        if not is_unique[path.stem]:
+            results[path]["error"] = f"{path.stem} already exists"
+        elif path.stem.lower() in seen:
+            results[path]["error"] = f"{path.stem} appears more than once in the batch"
+        else:
+            seen.add(path.stem.lower())
+            to_import.append(path)
+
+    prices = FixedPriceProvider(provider=provider) if to_import else None
+
+    def write_bank(path, items):
+        start = time.perf_counter()
+        if not items:
+            results[path]["error"] = "no items found"
+            return
+
+        try:
+            with SessionLocal() as db:
+                match, bank = find_duplicate_bank(db=db, items=items) if duplicates != "copy" else (None, None)
+                if match == "exact" and duplicates == "link":
+                    link_bank_name(db=db, bank_name=path.stem, bank_id=bank.id)
+                    results[path]["linked_to"] = bank.name
+                elif match == "exact":
+                    results[path]["error"] = f"identical to {bank.name}"
+                else:
+                    results[path]["items"] = enter_new_bank(db=db, items=items, bank_name=path.stem, provider=prices)
+        except Exception as e:
+            results[path]["error"] = str(e)
+
+        results[path]["write_seconds"] = time.perf_counter() - start
+
+    if workers == 0:
+        for path in to_import:
+            try:
+                items, results[path]["parse_seconds"] = parse_bank_file(path=str(path))
+            except Exception as e:
+                results[path]["error"] = str(e)
+                continue
+
+            write_bank(path=path, items=items)
+    elif to_import:
+        # Banks are written by this process as soon as their file is parsed, SQLite takes one writer at a time anyway
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            futures = {pool.submit(parse_bank_file, str(path)): path for path in to_import}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    items, results[path]["parse_seconds"] = future.result()
+                except Exception as e:
+                    results[path]["error"] = str(e)
+                    continue
+
+                write_bank(path=path, items=items)
+
+    for result in results.values():
+        status = result["error"] or (f"linked to {result['linked_to']}" if result["linked_to"] else
+                                     f"{result['items']} items")
+        print(f"{result['file']}: {status} (parse {result['parse_seconds']:.3f}s, write {result['write_seconds']:.3f}s)")
+
+    return list(results.values())
@@ -0,0 +1,215 @@
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+
+from app import database
+from app.database import SessionLocal
+from app.models.db_entry import PriceRun, ItemPrice, BankPriceRun, BankValuation
+
+
+# (older_than, bucket) -> price runs older than older_than are merged into one run per bucket, oldest tier wins
+# Default -> keep every run for 7 days, then one per day, after 30 days one per week
+COMPACTION_TIERS = [
+    (timedelta(days=7), timedelta(days=1)),
+    (timedelta(days=30), timedelta(weeks=1)),
+]
+
+# Buckets are aligned to a Monday so weekly buckets run Monday -> Sunday
+BUCKET_EPOCH = datetime(1970, 1, 5)
+
+
+def bucket_start(timestamp: datetime, bucket: timedelta) -> datetime:
+    return BUCKET_EPOCH + ((timestamp - BUCKET_EPOCH) // bucket) * bucket
+
+
+def find_compaction_buckets(db: Session, tiers: list, now: datetime):
+    """
+    Groups price runs into the bucket of the oldest tier they are old enough for. Runs inside the newest tier are
+    left alone and buckets that already hold a single run are skipped, so repeated calls only touch new data.
+    :return: List of lists of PriceRun, earliest run first
+    """
+    tiers = sorted(tiers, key=lambda tier: tier[0], reverse=True)
+    buckets = defaultdict(list)
+
+    for price_run in db.query(PriceRun).order_by(PriceRun.fetched_at):
+        age = now - price_run.fetched_at
+        for older_than, bucket in tiers:
+            if age >= older_than:
+                buckets[(bucket, bucket_start(price_run.fetched_at, bucket))].append(price_run)
+                break
+
+    return [price_runs for price_runs in buckets.values() if len(price_runs) > 1]
+
+
+def merge_price_runs(db: Session, price_runs: list):
+    """
+    Merges price runs into the earliest one. Its item prices become the sample weighted mean of every merged run and
+    keep the min and max seen. Bank links and BankValuations inside the bucket are merged to one per bank and holdings
+    version, runs of a bank valued against different holdings stay apart so their snapshots keep adding up.
+    :param db: Session
+    :param price_runs: PriceRuns of one bucket, earliest first
+    :return: Int -> number of price runs removed
+    """
+    target, merged_runs = price_runs[0], price_runs[1:]
+    run_ids = [price_run.id for price_run in price_runs]
+    # Runs merged by an earlier pass stand for several fetches -> read before the target's count is updated
+    samples = {price_run.id: price_run.sample_count for price_run in price_runs}
+
+    aggregated_prices = (
+        db.query(
+            ItemPrice.item_id,
+            func.sum(PriceRun.sample_count),
+            func.sum(ItemPrice.high * PriceRun.sample_count),
+            func.min(func.coalesce(ItemPrice.high_min, ItemPrice.high)),
+            func.max(func.coalesce(ItemPrice.high_max, ItemPrice.high)),
+            func.sum(ItemPrice.low * PriceRun.sample_count),
+            func.min(func.coalesce(ItemPrice.low_min, ItemPrice.low)),
+            func.max(func.coalesce(ItemPrice.low_max, ItemPrice.low)),
+        )
+        .join(PriceRun, PriceRun.id == ItemPrice.run_id)
+        .filter(ItemPrice.run_id.in_(run_ids))
+        .group_by(ItemPrice.item_id)
+        .all()
+    )
+
+    db.query(ItemPrice).filter(ItemPrice.run_id.in_(run_ids)).delete(synchronize_session=False)
+    if aggregated_prices:
+        db.execute(insert(ItemPrice), [
+            {
+                "run_id": target.id,
+                "item_id": item_id,
+                "high": round(high_total / samples),
+                "high_min": high_min,
+                "high_max": high_max,
+                "low": round(low_total / samples),
+                "low_min": low_min,
+                "low_max": low_max,
+            }
+            for item_id, samples, high_total, high_min, high_max, low_total, low_min, low_max in aggregated_prices
+        ])
+
+    target.period_end = max(price_run.period_end or price_run.fetched_at for price_run in price_runs)
+    target.sample_count = sum(price_run.sample_count for price_run in price_runs)
+
+    # One link per bank and holdings version -> keep the earliest and fold the BankValuations of the others into it
+    bank_links = defaultdict(list)
+    for bank_link in (
+        db.query(BankPriceRun)
+        .filter(BankPriceRun.run_id.in_(run_ids))
+        .order_by(BankPriceRun.timestamp)
+    ):
+        bank_links[(bank_link.bank_id, bank_link.version)].append(bank_link)
+
+    for (bank_id, _), links in bank_links.items():
+        merge_bank_valuations(db=db, bank_id=bank_id, samples={link.timestamp: samples[link.run_id] for link in links})
+        kept_link = links[0]
+        kept_link.run_id = target.id
+        for link in links[1:]:
+            db.delete(link)
+
+    db.flush()
+    db.query(PriceRun).filter(
+        PriceRun.id.in_([price_run.id for price_run in merged_runs])
+    ).delete(synchronize_session=False)
+
+    return len(merged_runs)
+
+
+def merge_bank_valuations(db: Session, bank_id: int, samples: dict):
+    """
+    Merges the BankValuations of a bank into the earliest one. Totals are weighted by the sample_count of each
+    valuation's run, so a valuation already merged by an earlier pass counts once per fetch it stands for and repeated
+    passes keep the mean of every original fetch.
+    :param samples: Dict -> {BankValuation timestamp: sample_count of its PriceRun}
+    """
+    valuations = (
+        db.query(BankValuation)
+        .filter(BankValuation.bank_id == bank_id, BankValuation.timestamp.in_(list(samples)))
+        .order_by(BankValuation.timestamp)
+        .all()
+    )
+    if len(valuations) < 2:
+        return
+
+    weights = [samples[valuation.timestamp] for valuation in valuations]
+    total_weight = sum(weights)
+
+    def weighted_mean(column: str):
+        return sum(getattr(valuation, column) * weight for valuation, weight in zip(valuations, weights)) / total_weight
+
+    kept_valuation = valuations[0]
+    kept_valuation.low_value_total = round(weighted_mean("low_value_total"))
+    kept_valuation.mean_value_total = weighted_mean("mean_value_total")
+    kept_valuation.high_value_total = round(weighted_mean("high_value_total"))
+    kept_valuation.item_count = max(v.item_count for v in valuations)
+
+    for valuation in valuations[1:]:
+        db.delete(valuation)
+
+
+def database_size(connection) -> tuple[int, int]:
+    """:return: Tuple -> (file size in bytes, bytes held by free pages)"""
+    page_size = connection.exec_driver_sql("PRAGMA page_size").scalar()
+    page_count = connection.exec_driver_sql("PRAGMA page_count").scalar()
+    freelist_count = connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+    return page_count * page_size, freelist_count * page_size
+
+
+def reclaim_space(vacuum: str = "incremental", db_engine=None):
+    """
+    Returns free pages to the filesystem.
+    "incremental" -> PRAGMA incremental_vacuum once auto_vacuum=INCREMENTAL is on, else one full VACUUM that turns it
+                     on, incremental_vacuum frees nothing on a database without it
+    "full" -> VACUUM, switches the database to auto_vacuum=INCREMENTAL first so later runs can stay incremental
+    None -> only measure
+    :param db_engine: Engine of the database -> default the engine SessionLocal is bound to
+    :return: Tuple -> (bytes before, bytes after)
+    """
+    db_engine = db_engine or database.engine
+    with db_engine.connect() as connection:
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        size_before, _ = database_size(connection)
+        auto_vacuum = connection.exec_driver_sql("PRAGMA auto_vacuum").scalar()  # 0 none, 1 full, 2 incremental
+
+        # auto_vacuum=FULL already returns free pages on every commit
+        if vacuum == "full" or (vacuum == "incremental" and auto_vacuum == 0):
+            if auto_vacuum == 0:
+                connection.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+            connection.exec_driver_sql("VACUUM")
+        elif vacuum == "incremental" and auto_vacuum == 2:
+            connection.exec_driver_sql("PRAGMA incremental_vacuum")
+
+        size_after, _ = database_size(connection)
+
+    return size_before, size_after
+
+
+def compact_price_history(tiers: list = None, vacuum: str = "incremental", now: datetime = None):
+    """
+    Downsamples old price history by COMPACTION_TIERS, one bucket per transaction, then reclaims the freed pages.
+    :param tiers: list of (older_than, bucket) timedeltas -> default COMPACTION_TIERS
+    :param vacuum: "incremental", "full" or None, see reclaim_space
+    :param now: compaction reference time, naive UTC -> default current time
+    :return: Dict -> buckets compacted, price runs removed and database size before/after in bytes
+    """
+    tiers = tiers or COMPACTION_TIERS
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+
+    buckets_compacted = 0
+    runs_removed = 0
+    with SessionLocal() as db:
+        for price_runs in find_compaction_buckets(db=db, tiers=tiers, now=now):
+            runs_removed += merge_price_runs(db=db, price_runs=price_runs)
+            db.commit()
+            buckets_compacted += 1
+
+    size_before, size_after = reclaim_space(vacuum=vacuum)
+
+    return {
+        "buckets_compacted": buckets_compacted,
+        "runs_removed": runs_removed,
+        "bytes_before": size_before,
+        "bytes_after": size_after,
+        "bytes_freed": size_before - size_after,
+    }
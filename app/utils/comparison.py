@@ -0,0 +1,177 @@
+import numpy as np
+import pandas as pd
+
+from app.crud.database import get_bank_id_by_name
+from app.database import SessionLocal
+from app.utils.valuation import BankValuations, gather_item_values, value_latest_snapshots
+
+VALUATION_TYPES = ("low_value", "mean_value", "high_value")
+
+# change_<bank> of items_frame, compared to the baseline bank
+CHANGE_LABELS = ("same", "more", "fewer", "only in baseline", "not in baseline")
+
+
+class BankComparison:
+    """
+    Items of N banks side by side -> row i is item_ids[i], column b is bank_names[b]. Quantities are 0 where a bank
+    does not hold the item, values are quantity x unit price at the bank's latest snapshot and 0 where unpriced.
+    """
+
+    def __init__(self, bank_ids, bank_names, item_ids, names, quantities, low, high, priced):
+        self.bank_ids = list(bank_ids)
+        self.bank_names = list(bank_names)
+        self.item_ids = item_ids
+        self.names = names
+        self.quantities = quantities
+        self.low = low
+        self.high = high
+        self.priced = priced
+
+    @classmethod
+    def from_valuations(cls, valuations: BankValuations, bank_names: list, valuation: int = 0):
+        """
+        Pivots the holdings of a BankValuations into (items, banks) matrices with one gather and one scatter, items a
+        bank lists more than once are added up.
+        """
+        holdings = valuations.holdings
+        bank_of_item = holdings.bank_of_item()
+        high, low, priced = gather_item_values(
+            holdings=holdings,
+            prices=valuations.prices,
+            price_rows=valuations.price_rows[valuation][bank_of_item][np.newaxis],
+        )
+
+        item_ids, row = np.unique(holdings.item_ids, return_inverse=True)
+        shape = (len(item_ids), len(holdings.bank_ids))
+        cells = (row, bank_of_item)
+
+        quantities = np.zeros(shape, dtype=np.int64)
+        np.add.at(quantities, cells, holdings.quantities)
+        low_values = np.zeros(shape, dtype=np.int64)
+        np.add.at(low_values, cells, low[0])
+        high_values = np.zeros(shape, dtype=np.int64)
+        np.add.at(high_values, cells, high[0])
+        priced_cells = np.zeros(shape, dtype=bool)
+        np.logical_or.at(priced_cells, cells, priced[0])
+
+        # Reversed so the first listing of an item names it
+        names = np.empty(len(item_ids), dtype=object)
+        names[row[::-1]] = holdings.names[::-1]
+
+        return cls(
+            bank_ids=holdings.bank_ids.tolist(),
+            bank_names=bank_names,
+            item_ids=item_ids,
+            names=names,
+            quantities=quantities,
+            low=low_values,
+            high=high_values,
+            priced=priced_cells,
+        )
+
+    @property
+    def mean(self):
+        return (self.low + self.high) / 2
+
+    def values(self, valuation_type: str = "mean_value"):
+        """:return: np.ndarray -> (items, banks) values of one of VALUATION_TYPES"""
+        if valuation_type not in VALUATION_TYPES:
+            raise ValueError(f"Unknown valuation type '{valuation_type}', choose one of {list(VALUATION_TYPES)}")
+
+        return {"low_value": self.low, "mean_value": self.mean, "high_value": self.high}[valuation_type]
+
+    def totals(self, valuation_type: str = "mean_value"):
+        """:return: np.ndarray -> total value of every bank"""
+        return self.values(valuation_type=valuation_type).sum(axis=0)
+
+    def bank_index(self, bank_name: str) -> int:
+        return self.bank_names.index(bank_name)
+
+    def items_frame(self, baseline: str = None, valuation_type: str = "mean_value", priced_only: bool = True):
+        """
+        Every item next to each other in all banks, with quantity and value changes of every bank against baseline.
+        :param baseline: bank name the others are compared to -> default the first bank
+        :param valuation_type: one of VALUATION_TYPES
+        :param priced_only: leave out items no bank has a price for
+        :return: pd.DataFrame -> name, item_id, quantity_<bank> and <valuation_type>_<bank> of every bank, then
+                 quantity_diff_<bank>, <valuation_type>_diff_<bank> (bank - baseline) and change_<bank>, one of
+                 CHANGE_LABELS, for every other bank
+        """
+        base = self.bank_index(baseline) if baseline is not None else 0
+        values = self.values(valuation_type=valuation_type)
+        rows = self.priced.any(axis=1) if priced_only else np.ones(len(self.item_ids), dtype=bool)
+        quantities = self.quantities[rows]
+        values = values[rows]
+
+        columns = {"name": self.names[rows], "item_id": self.item_ids[rows]}
+        for bank, bank_name in enumerate(self.bank_names):
+            columns[f"quantity_{bank_name}"] = quantities[:, bank]
+            columns[f"{valuation_type}_{bank_name}"] = values[:, bank]
+
+        # Every bank against the baseline at once -> (items, banks) differences
+        quantity_diff = quantities - quantities[:, [base]]
+        value_diff = values - values[:, [base]]
+        held, held_by_base = quantities > 0, quantities[:, [base]] > 0
+        change = np.select(
+            [held & ~held_by_base, ~held & held_by_base, quantity_diff > 0, quantity_diff < 0],
+            [CHANGE_LABELS[4], CHANGE_LABELS[3], CHANGE_LABELS[1], CHANGE_LABELS[2]],
+            default=CHANGE_LABELS[0],
+        )
+
+        for bank, bank_name in enumerate(self.bank_names):
+            if bank == base:
+                continue
+            columns[f"quantity_diff_{bank_name}"] = quantity_diff[:, bank]
+            columns[f"{valuation_type}_diff_{bank_name}"] = value_diff[:, bank]
+            columns[f"change_{bank_name}"] = change[:, bank]
+
+        return pd.DataFrame(columns)
+
+    def pairwise_totals(self, valuation_type: str = "mean_value"):
+        """:return: pd.DataFrame -> banks x banks, cell [row, column] is total of column - total of row"""
+        totals = self.totals(valuation_type=valuation_type)
+        return pd.DataFrame(
+            totals[np.newaxis, :] - totals[:, np.newaxis],
+            index=self.bank_names,
+            columns=self.bank_names,
+        )
+
+    def top_items(self, bank_name: str, by: str = "mean_value", n: int = 10):
+        """:return: pd.DataFrame -> name, quantity and values of the n priced items of a bank highest by column by"""
+        bank = self.bank_index(bank_name)
+        rows = self.priced[:, bank]
+        frame = pd.DataFrame({
+            "name": self.names[rows],
+            "quantity": self.quantities[rows, bank],
+            "low_value": self.low[rows, bank],
+            "mean_value": self.mean[rows, bank],
+            "high_value": self.high[rows, bank],
+        })
+        return frame.nlargest(n, by)
+
+
+def compare_banks(bank_names: list):
+    """
+    Compares any number of banks, each valued at the PriceRun of its own latest snapshot, in one batched valuation
+    pass and one pivot. Names linked to another bank compare as that bank.
+    :param bank_names: banks to compare, the same bank selected twice is compared once
+    :return: BankComparison
+    """
+    bank_names = list(dict.fromkeys(bank_names))
+    with SessionLocal() as db:
+        bank_ids = [get_bank_id_by_name(db=db, bank_name=bank_name) for bank_name in bank_names]
+
+    missing = [bank_name for bank_name, bank_id in zip(bank_names, bank_ids) if bank_id is None]
+    if missing:
+        raise ValueError(f"No bank found with name {', '.join(missing)}")
+
+    valuations = value_latest_snapshots(bank_ids=bank_ids)
+    # value_latest_snapshots values a bank selected under two names once -> label its column with the first name
+    names_by_id = {}
+    for bank_name, bank_id in zip(bank_names, bank_ids):
+        names_by_id.setdefault(bank_id, bank_name)
+
+    return BankComparison.from_valuations(
+        valuations=valuations,
+        bank_names=[names_by_id[bank_id] for bank_id in valuations.holdings.bank_ids.tolist()],
+    )
@@ -1,29 +1,67 @@
+import hashlib
 import json
+import os
 from pathlib import Path
 
 
-def convert_all_items_to_json(file_name: str):
+# Keep the pasted .txt of an import in items/ for auditing instead of parsing the clipboard in memory only
+IMPORT_AUDIT = os.environ.get("OBVA_IMPORT_AUDIT", "0") == "1"
+
+
+def parse_bank_tsv(lines):
     """
-    Opens saved .txt of bank items and converts the txt formatted in TSV to a python dict and saves as .json
-    :param file_name: your_snapshot.txt copied from runelite client plugin and saved as .txt
-    :return:
+    Streams the rows of a Bank Memory TSV export -> item_id, name and quantity separated by tabs under a header line.
+    Malformed rows are printed and skipped.
+    :param lines: iterable of lines, e.g. tsv_data.splitlines() or an open .txt file
+    :return: Generator of dicts -> {"item_id", "item_name", "quantity"}, the rows of a snapshot .json
     """
-    with open(file=f"items/{file_name}.txt", mode="r", encoding="utf-8") as f:
-        lines = f.read().splitlines()
+    lines = iter(lines)
+    next(lines, None)  # skip col headers
+
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if not line.strip():
+            continue
 
-    items = []
-    for line in lines[1:]:  # skip col headers
         parts = line.split("\t")
         if len(parts) != 3:
             print(f"Malformed line: {line}")
             continue
 
         item_id, name, quantity = parts
-        items.append({
+        if not item_id.strip().isdigit() or not quantity.strip().isdigit() or not name.strip():
+            print(f"Malformed line: {line}")
+            continue
+
+        yield {
             "item_id": int(item_id),
             "item_name": name,
             "quantity": int(quantity)
-        })
+        }
+
+
+def bank_content_hashes(items):
+    """
+    Canonical hashes of an item set, independent of the order the export lists items in.
+    :param items: iterable of dicts with item_id and quantity, parse_bank_tsv rows or BankItem columns
+    :return: Tuple -> (content_hash of the sorted item_id/quantity pairs, item_set_hash of the sorted item ids),
+             equal content hashes are an identical export, equal item set hashes the same items in other amounts
+    """
+    pairs = sorted((int(item["item_id"]), int(item.get("quantity", 1))) for item in items)
+    content = "\n".join(f"{item_id}:{quantity}" for item_id, quantity in pairs)
+    item_set = "\n".join(str(item_id) for item_id in sorted({item_id for item_id, _ in pairs}))
+
+    return hashlib.sha256(content.encode()).hexdigest(), hashlib.sha256(item_set.encode()).hexdigest()
+
+
+def convert_all_items_to_json(file_name: str):
+    """
+    Opens saved .txt of bank items and converts the txt formatted in TSV to a python dict and saves as .json
+    :param file_name: your_snapshot.txt copied from runelite client plugin and saved as .txt
+    :return:
+    """
+    with open(file=f"items/{file_name}.txt", mode="r", encoding="utf-8") as f:
+        items = list(parse_bank_tsv(f))
 
     items_json = json.dumps(items, indent=2)
 
@@ -0,0 +1,149 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+from app.crud.database import read_item_price_bucket_series
+from app.database import SessionLocal
+from app.utils.archive import read_price_history
+from app.utils.timeseries import TIMESTEPS
+
+# Points drawn per series -> longer histories are downsampled to this budget
+CHART_POINTS = 400
+
+# Selectable chart windows, None is the whole history
+PRICE_HISTORY_WINDOWS = {
+    "7 days": timedelta(days=7),
+    "30 days": timedelta(days=30),
+    "90 days": timedelta(days=90),
+    "1 year": timedelta(days=365),
+    "All time": None,
+}
+
+# Wiki bucket series tried for a window, finest first -> /5m buckets only cover the days since ingestion started
+MARKET_TIMESTEPS = {"7 days": ("5m", "1h")}
+DEFAULT_MARKET_TIMESTEPS = ("1h", "5m")
+
+
+def window_start(window: str, now: datetime = None):
+    """:return: naive UTC datetime the window starts at, None for the whole history"""
+    if window not in PRICE_HISTORY_WINDOWS:
+        raise ValueError(f"Unknown window '{window}', choose one of {list(PRICE_HISTORY_WINDOWS)}")
+
+    length = PRICE_HISTORY_WINDOWS[window]
+    if length is None:
+        return None
+
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    return now - length
+
+
+def lttb_indices(x, y, points: int):
+    """
+    Largest-Triangle-Three-Buckets downsampling -> keeps the first and last sample and from every bucket in between
+    the sample forming the largest triangle with the previously kept sample and the mean of the next bucket, so
+    spikes and dips survive where plain averaging would flatten them.
+    :param x: sorted sample positions, e.g. timestamps as int64
+    :param y: sample values
+    :param points: most samples kept, at least 3
+    :return: np.ndarray -> sorted indices of the kept samples
+    """
+    if points < 3:
+        raise ValueError("LTTB keeps at least 3 points")
+
+    sample_count = len(x)
+    if sample_count <= points:
+        return np.arange(sample_count)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # points - 2 buckets between the first and last sample, bucket b is edges[b]:edges[b + 1]
+    edges = np.linspace(1, sample_count - 1, points - 1).astype(np.int64)
+    edges = np.append(edges, sample_count)
+
+    kept = np.empty(points, dtype=np.int64)
+    kept[0], kept[-1] = 0, sample_count - 1
+    previous = 0
+    for bucket in range(points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_start, next_end = edges[bucket + 1], edges[bucket + 2]
+        mean_x, mean_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+
+        # Twice the triangle areas, the constant factor does not change the argmax
+        areas = np.abs(
+            (x[previous] - mean_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (mean_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        kept[bucket + 1] = previous
+
+    return kept
+
+
+def snapshot_price_series(history: pd.DataFrame, points: int = CHART_POINTS):
+    """
+    Unit prices of an item at every bank snapshot, downsampled with LTTB on the mean price.
+    :param history: read_price_history rows of one item
+    :return: pd.DataFrame indexed by timestamp -> low_price, mean_price, high_price
+    """
+    # An item listed twice in a bank has one row per listing at the same unit price
+    history = history.drop_duplicates(subset="timestamp", keep="last")
+    quantities = history["quantity"].where(history["quantity"] > 0)
+    series = pd.DataFrame({
+        "timestamp": history["timestamp"].to_numpy(),
+        "low_price": (history["low_value_estimate"] / quantities).to_numpy(),
+        "mean_price": (history["mean_value_estimate"] / quantities).to_numpy(),
+        "high_price": (history["high_value_estimate"] / quantities).to_numpy(),
+    })
+
+    kept = lttb_indices(
+        x=series["timestamp"].to_numpy().astype("datetime64[ns]").astype(np.int64),
+        y=series["mean_price"].fillna(0).to_numpy(),
+        points=points,
+    )
+    return series.iloc[kept].set_index("timestamp")
+
+
+def market_price_series(item_id: int, window: str, since: datetime = None, points: int = CHART_POINTS):
+    """
+    Wiki api average prices of an item over the window, averaged down to points in SQL.
+    :return: pd.DataFrame indexed by timestamp -> market_avg_high, market_avg_low, empty if no buckets are stored
+    """
+    since_ts = int(since.replace(tzinfo=timezone.utc).timestamp()) if since is not None else None
+    rows = []
+    with SessionLocal() as db:
+        for timestep in MARKET_TIMESTEPS.get(window, DEFAULT_MARKET_TIMESTEPS):
+            rows = read_item_price_bucket_series(db=db, item_id=item_id, timestep=TIMESTEPS[timestep], points=points,
+                                                 since=since_ts)
+            if rows:
+                break
+
+    series = pd.DataFrame(rows, columns=["timestamp", "market_avg_high", "market_avg_low"])
+    series["timestamp"] = pd.to_datetime(series["timestamp"], unit="s")
+    return series.set_index("timestamp")
+
+
+def item_price_chart(bank_name: str, item_name: str, window: str = "All time", points: int = CHART_POINTS,
+                     now: datetime = None):
+    """
+    Price history of one item of a bank for a chart -> its unit prices at every bank snapshot in the window plus the
+    wiki api average prices of the item when their buckets are stored, each series at most points long.
+    :param bank_name: Name of bank within DB
+    :param item_name: exact item name
+    :param window: key of PRICE_HISTORY_WINDOWS
+    :param points: most points per series
+    :param now: end of the window, naive UTC -> default current time
+    :return: pd.DataFrame indexed by timestamp -> low_price, mean_price, high_price, market_avg_high,
+             market_avg_low, NaN where a series has no point at that time, empty if the item has no history
+    """
+    since = window_start(window=window, now=now)
+    history = read_price_history(bank_name=bank_name, item_name=item_name, since=since)
+    if history.empty:
+        return pd.DataFrame(columns=["low_price", "mean_price", "high_price"])
+
+    frames = [snapshot_price_series(history=history, points=points)]
+    market = market_price_series(item_id=int(history["item_id"].iloc[-1]), window=window, since=since, points=points)
+    if not market.empty:
+        frames.append(market)
+
+    return pd.concat(frames, axis=1).sort_index()
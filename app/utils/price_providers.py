@@ -0,0 +1,212 @@
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from app.utils.prices import PriceTable, fetch_price_cache, get_price_table
+
+
+class PriceProvider:
+    """
+    Where the snapshot functions get prices and the current time from. The live provider asks the wiki api, replay
+    and synthetic providers step through recorded or generated ticks with advance(), so months of price history can
+    be written to the database without the network or the wall clock.
+    """
+
+    def price_table(self) -> PriceTable:
+        """:return: PriceTable of the current tick"""
+        raise NotImplementedError
+
+    def snapshot_price_table(self) -> PriceTable:
+        """:return: PriceTable snapshots are written against -> the current tick's, see LivePriceProvider"""
+        return self.price_table()
+
+    def now(self) -> datetime:
+        """:return: datetime (UTC) snapshots taken at the current tick are stamped with"""
+        raise NotImplementedError
+
+    def advance(self) -> bool:
+        """
+        Moves to the next tick.
+        :return: Bool -> False once there are no ticks left, live prices have no ticks
+        """
+        return False
+
+
+class LivePriceProvider(PriceProvider):
+    """
+    Current wiki api prices through the shared price cache.
+    :param record_to: .jsonl file every newly fetched price cache is appended to, replayable by ReplayPriceProvider
+    """
+
+    def __init__(self, record_to: str = None):
+        self.record_to = record_to
+        self.last_recorded = None
+
+    def price_table(self) -> PriceTable:
+        """Stale while revalidate -> an expired cache is still returned while it refreshes, fine for display reads"""
+        return self.read_price_table(fresh=False)
+
+    def snapshot_price_table(self) -> PriceTable:
+        """Waits for a refresh once the cache has expired, a snapshot written from stale prices repeats an old run"""
+        return self.read_price_table(fresh=True)
+
+    def read_price_table(self, fresh: bool) -> PriceTable:
+        if self.record_to is not None:
+            cache = fetch_price_cache(fresh=fresh)
+            if cache["timestamp"] != self.last_recorded:
+                record_price_cache(path=self.record_to, cache=cache)
+                self.last_recorded = cache["timestamp"]
+
+        return get_price_table(fresh=fresh)
+
+    def now(self) -> datetime:
+        return datetime.now(timezone.utc)
+
+
+class ReplayPriceProvider(PriceProvider):
+    """
+    Replays a recording -> .jsonl file with one price cache ({"timestamp", "data"}) per line, oldest first. Lines are
+    read one tick at a time so recordings of any length replay in constant memory.
+    :param path: recording written by LivePriceProvider(record_to=...) or record_ticks
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lines = self.read_lines()
+        self.cache = None
+        self.table = None
+        if not self.advance():
+            raise ValueError(f"Price recording '{path}' holds no ticks")
+
+    def read_lines(self):
+        with open(file=self.path, mode="r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def advance(self) -> bool:
+        cache = next(self.lines, None)
+        if cache is None:
+            return False
+
+        self.cache = cache
+        self.table = None
+        return True
+
+    def price_table(self) -> PriceTable:
+        if self.table is None:
+            self.table = PriceTable(all_prices=self.cache["data"]["data"], fetched_at=self.cache["timestamp"])
+        return self.table
+
+    def now(self) -> datetime:
+        return datetime.fromtimestamp(self.cache["timestamp"], timezone.utc)
+
+
+class SyntheticPriceProvider(PriceProvider):
+    """
+    Generated prices -> every item does a seeded geometric random walk over ticks spaced interval apart.
+    :param item_ids: ids to generate prices for, default 0..item_count-1
+    :param item_count: number of items when item_ids is not given
+    :param ticks: number of ticks before advance() returns False
+    :param start: time of the first tick -> default ticks * interval before now
+    :param interval: time between ticks -> default 12 hours, the snapshot COOLDOWN
+    :param volatility: standard deviation of the log price change per tick
+    :param seed: random seed, the same seed generates the same prices
+    """
+
+    def __init__(
+            self,
+            item_ids=None,
+            item_count: int = 1000,
+            ticks: int = 100,
+            start: datetime = None,
+            interval: timedelta = timedelta(hours=12),
+            volatility: float = 0.02,
+            seed: int = 0,
+    ):
+        self.item_ids = np.asarray(item_ids if item_ids is not None else np.arange(item_count), dtype=np.int64)
+        self.ticks = ticks
+        self.interval = interval
+        self.start = start or datetime.now(timezone.utc) - ticks * interval
+        self.volatility = volatility
+        self.rng = np.random.default_rng(seed)
+
+        self.tick = 0
+        self.low = self.rng.lognormal(mean=8, sigma=2.5, size=len(self.item_ids)) + 1
+        self.spread = 1 + self.rng.uniform(0.005, 0.05, size=len(self.item_ids))
+        self.table = None
+
+    def advance(self) -> bool:
+        if self.tick + 1 >= self.ticks:
+            return False
+
+        self.tick += 1
+        self.low *= np.exp(self.rng.normal(0, self.volatility, size=len(self.item_ids)))
+        self.table = None
+        return True
+
+    def price_table(self) -> PriceTable:
+        if self.table is None:
+            low = np.maximum(np.rint(self.low), 1).astype(np.int64)
+            high = np.maximum(np.rint(self.low * self.spread), low).astype(np.int64)
+            self.table = PriceTable.from_arrays(
+                item_ids=self.item_ids,
+                high=high,
+                low=low,
+                fetched_at=self.now().timestamp(),
+            )
+        return self.table
+
+    def now(self) -> datetime:
+        return self.start + self.tick * self.interval
+
+
+class FixedPriceProvider(PriceProvider):
+    """
+    The current tick of another provider, fetched once and frozen -> a batch of banks is valued against the same
+    prices and stamped with the same time.
+    :param provider: PriceProvider to take the prices and time from
+    """
+
+    def __init__(self, provider: PriceProvider):
+        self.table = provider.snapshot_price_table()
+        self.time = provider.now()
+
+    def price_table(self) -> PriceTable:
+        return self.table
+
+    def now(self) -> datetime:
+        return self.time
+
+
+def record_price_cache(path: str, cache: dict):
+    """Appends a price cache -> {"timestamp", "data"} as one line of a .jsonl recording."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    with open(file=path, mode="a", encoding="utf-8") as f:
+        f.write(json.dumps({"timestamp": cache["timestamp"], "data": cache["data"]}) + "\n")
+
+
+def record_ticks(provider: PriceProvider, path: str):
+    """
+    Records the current and every remaining tick of provider into a .jsonl recording, e.g. to turn synthetic prices
+    into a replayable fixture.
+    :return: Int -> ticks recorded
+    """
+    ticks = 0
+    while True:
+        price_table = provider.price_table()
+        record_price_cache(
+            path=path,
+            cache={"timestamp": price_table.fetched_at, "data": {"data": price_table.to_api_data()}},
+        )
+        ticks += 1
+        if not provider.advance():
+            return ticks
+
+
+LIVE_PRICES = LivePriceProvider()
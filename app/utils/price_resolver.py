@@ -0,0 +1,252 @@
+import json
+import os
+import threading
+
+import json5
+import numpy as np
+
+from app.utils.prices import PriceTable
+
+
+# Mapping files the resolver is compiled from, a change to any of them recompiles it
+TRADEABLE_IF_UNCHARGED_FILE = "items/tradeable_if_uncharged.json"
+ITEM_PLUS_ORNAMENT_KIT_FILE = "items/item_plus_ornament_kit.json"
+COMPOSITE_ITEMS_FILE = "items/composite_items.json"
+MAPPING_FILES = [TRADEABLE_IF_UNCHARGED_FILE, ITEM_PLUS_ORNAMENT_KIT_FILE, COMPOSITE_ITEMS_FILE]
+RESOLVER_CACHE_FILE = "cache/price_resolver.npz"
+
+# Component worth exactly 1 coin -> lets rules add a fixed amount of gp, coins themselves are [(UNIT, 1)]
+UNIT = -1
+COINS_ID = 995
+
+PRICE_RESOLVER_MEMO = {"source_key": None, "resolver": None}
+PRICE_RESOLVER_LOCK = threading.Lock()
+
+
+class PriceResolver:
+    """
+    Compiled price rules -> item_id maps to a list of (component_id, multiplier) and the unit price of the item is
+    the multiplier weighted sum of its component prices. Rules are stored as CSR arrays, rows sorted by item id, so a
+    whole bank resolves with a handful of NumPy gathers however many rules there are.
+    Items without a rule, or with a price of their own, resolve to their own price.
+    """
+
+    def __init__(self, rule_items, offsets, component_ids, multipliers, uncharged_items, uncharged_ids,
+                 ornament_kit_items, source_key: str):
+        """
+        :param rule_items: sorted item ids that have a rule
+        :param offsets: rule of rule_items[i] is components offsets[i]:offsets[i + 1]
+        :param component_ids: component item ids, UNIT for a fixed 1 coin component
+        :param multipliers: amount of each component
+        :param uncharged_items: charged item ids of tradeable_if_uncharged.json, uncharged_ids in the same order
+        :param uncharged_ids: uncharged item ids
+        :param ornament_kit_items: item ids of item_plus_ornament_kit.json
+        :param source_key: mtime and size of the mapping files the rules were compiled from
+        """
+        self.rule_items = np.asarray(rule_items, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.component_ids = np.asarray(component_ids, dtype=np.int64)
+        self.multipliers = np.asarray(multipliers, dtype=np.float64)
+        self.uncharged_items = np.asarray(uncharged_items, dtype=np.int64)
+        self.uncharged_ids = np.asarray(uncharged_ids, dtype=np.int64)
+        self.ornament_kit_items = np.asarray(ornament_kit_items, dtype=np.int64)
+        self.source_key = source_key
+
+        self.uncharged_by_item = dict(zip(self.uncharged_items.tolist(), self.uncharged_ids.tolist()))
+        self.ornament_kit_set = set(self.ornament_kit_items.tolist())
+
+    @classmethod
+    def from_rules(cls, rules: dict, uncharged: dict, ornament_kit_items, source_key: str):
+        """
+        :param rules: {item_id: [(component_id, multiplier), ...]}
+        :param uncharged: {charged item_id: uncharged item_id}
+        :param ornament_kit_items: item ids with an ornament kit equipped
+        """
+        rule_items = sorted(rules)
+        offsets = np.zeros(len(rule_items) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(rules[item_id]) for item_id in rule_items])
+        components = [component for item_id in rule_items for component in rules[item_id]]
+
+        return cls(
+            rule_items=rule_items,
+            offsets=offsets,
+            component_ids=[component_id for component_id, _ in components],
+            multipliers=[multiplier for _, multiplier in components],
+            uncharged_items=list(uncharged),
+            uncharged_ids=list(uncharged.values()),
+            ornament_kit_items=sorted(ornament_kit_items),
+            source_key=source_key,
+        )
+
+    def rule(self, item_id: int):
+        """:return: List of (component_id, multiplier), None if item_id has no rule"""
+        row = np.searchsorted(self.rule_items, item_id)
+        if row == len(self.rule_items) or self.rule_items[row] != item_id:
+            return None
+
+        start, end = self.offsets[row], self.offsets[row + 1]
+        return list(zip(self.component_ids[start:end].tolist(), self.multipliers[start:end].tolist()))
+
+    def uncharged_id(self, item_id: int):
+        """:return: Int -> uncharged item id a charged item is priced by, None if item_id is not charged"""
+        return self.uncharged_by_item.get(int(item_id))
+
+    def has_ornament_kit(self, item_id: int) -> bool:
+        return int(item_id) in self.ornament_kit_set
+
+    def resolve(self, price_table: PriceTable, item_ids):
+        """
+        Unit prices of many items in one vectorized pass.
+        :param price_table: PriceTable of the prices to resolve against
+        :param item_ids: array like of item ids
+        :return: Tuple of np.ndarray -> (high, low, priced), high and low are 0 where priced is False. An item is
+                 priced if it has a high and low price of its own or every component of its rule has one.
+        """
+        item_ids = np.asarray(item_ids, dtype=np.int64)
+        own = price_table.take(item_ids)[:, :2]
+        own_priced = (own != PriceTable.MISSING).all(axis=1)
+
+        high = np.where(own_priced, own[:, 0], 0)
+        low = np.where(own_priced, own[:, 1], 0)
+        priced = own_priced.copy()
+
+        rows = np.searchsorted(self.rule_items, item_ids)
+        rows_in_range = np.minimum(rows, max(len(self.rule_items) - 1, 0))
+        has_rule = (rows < len(self.rule_items)) & ~own_priced
+        if len(self.rule_items):
+            has_rule &= self.rule_items[rows_in_range] == item_ids
+        if not has_rule.any():
+            return high, low, priced
+
+        # Flatten the components of every ruled item -> one gather of all component prices
+        rule_rows = rows[has_rule]
+        starts = self.offsets[rule_rows]
+        counts = self.offsets[rule_rows + 1] - starts
+        component_index = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        component_ids = self.component_ids[component_index]
+        multipliers = self.multipliers[component_index]
+
+        component_prices = price_table.take(component_ids)[:, :2].astype(np.float64)
+        is_unit = component_ids == UNIT
+        component_prices[is_unit] = 1
+        component_missing = (component_prices == PriceTable.MISSING).any(axis=1) & ~is_unit
+
+        rule_of_component = np.repeat(np.arange(len(rule_rows)), counts)
+        rule_count = len(rule_rows)
+        rule_high = np.bincount(rule_of_component, weights=component_prices[:, 0] * multipliers, minlength=rule_count)
+        rule_low = np.bincount(rule_of_component, weights=component_prices[:, 1] * multipliers, minlength=rule_count)
+        rule_priced = np.bincount(rule_of_component, weights=component_missing, minlength=rule_count) == 0
+
+        ruled = np.flatnonzero(has_rule)
+        high[ruled] = np.where(rule_priced, np.rint(rule_high), 0).astype(np.int64)
+        low[ruled] = np.where(rule_priced, np.rint(rule_low), 0).astype(np.int64)
+        priced[ruled] = rule_priced
+        return high, low, priced
+
+    def unit_prices(self, price_table: PriceTable, item_ids) -> dict:
+        """:return: Dict -> {item_id: (high, low)} of the priced items of item_ids"""
+        item_ids = np.asarray(item_ids, dtype=np.int64)
+        high, low, priced = self.resolve(price_table=price_table, item_ids=item_ids)
+        return dict(zip(item_ids[priced].tolist(), zip(high[priced].tolist(), low[priced].tolist())))
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_file = f"{path}.tmp.npz"
+        np.savez(
+            temp_file,
+            rule_items=self.rule_items,
+            offsets=self.offsets,
+            component_ids=self.component_ids,
+            multipliers=self.multipliers,
+            uncharged_items=self.uncharged_items,
+            uncharged_ids=self.uncharged_ids,
+            ornament_kit_items=self.ornament_kit_items,
+            source_key=np.array(self.source_key),
+        )
+        os.replace(temp_file, path)
+
+    @classmethod
+    def load(cls, path: str):
+        with np.load(path) as arrays:
+            return cls(**{name: arrays[name] for name in arrays.files if name != "source_key"},
+                       source_key=str(arrays["source_key"]))
+
+
+def mapping_source_key() -> str:
+    """:return: Str -> path, mtime and size of every mapping file, changes whenever one of them is edited"""
+    sources = []
+    for path in MAPPING_FILES:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            sources.append([path, stat.st_mtime_ns, stat.st_size])
+    return json.dumps(sources)
+
+
+def read_mapping_file(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+
+    # json5 for the inline comments of the mapping files
+    with open(file=path, mode="r", encoding="utf-8") as f:
+        return json5.load(f)
+
+
+def compile_price_resolver(source_key: str) -> PriceResolver:
+    """
+    Compiles the mapping files into rules, later sources override earlier ones:
+    coins -> [(UNIT, 1)]
+    tradeable_if_uncharged.json -> charged item: [(uncharged item, 1)]
+    item_plus_ornament_kit.json -> item (or): [(base item, 1), (ornament kit, 1)]
+    composite_items.json -> item: [(component, multiplier), ...], e.g. crystal armour -> crystal armour seeds
+    """
+    rules = {COINS_ID: [(UNIT, 1)]}
+
+    uncharged = {int(item_id): int(uncharged_id) for item_id, uncharged_id in
+                 read_mapping_file(TRADEABLE_IF_UNCHARGED_FILE).items()}
+    for item_id, uncharged_id in uncharged.items():
+        rules[item_id] = [(uncharged_id, 1)]
+
+    item_plus_ornament_kit = read_mapping_file(ITEM_PLUS_ORNAMENT_KIT_FILE)
+    ornament_kit_items = [int(item_id) for item_id in item_plus_ornament_kit if not item_id.startswith("kit_")]
+    for item_id in ornament_kit_items:
+        rules[item_id] = [
+            (int(item_plus_ornament_kit[str(item_id)]), 1),
+            (int(item_plus_ornament_kit[f"kit_{item_id}"]), 1),
+        ]
+
+    for item_id, components in read_mapping_file(COMPOSITE_ITEMS_FILE).items():
+        rules[int(item_id)] = [(int(component_id), multiplier) for component_id, multiplier in components]
+
+    return PriceResolver.from_rules(
+        rules=rules,
+        uncharged=uncharged,
+        ornament_kit_items=ornament_kit_items,
+        source_key=source_key,
+    )
+
+
+def get_price_resolver() -> PriceResolver:
+    """
+    Process wide PriceResolver. Served from memory, else from RESOLVER_CACHE_FILE, and only compiled from the json5
+    mapping files when one of them changed since the cached copy was compiled.
+    :return: PriceResolver
+    """
+    source_key = mapping_source_key()
+
+    with PRICE_RESOLVER_LOCK:
+        if PRICE_RESOLVER_MEMO["source_key"] == source_key:
+            return PRICE_RESOLVER_MEMO["resolver"]
+
+        resolver = None
+        if os.path.exists(RESOLVER_CACHE_FILE):
+            cached = PriceResolver.load(RESOLVER_CACHE_FILE)
+            if cached.source_key == source_key:
+                resolver = cached
+
+        if resolver is None:
+            resolver = compile_price_resolver(source_key=source_key)
+            resolver.save(RESOLVER_CACHE_FILE)
+
+        PRICE_RESOLVER_MEMO.update({"source_key": source_key, "resolver": resolver})
+
+    return resolver
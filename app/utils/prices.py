@@ -1,40 +1,416 @@
 import requests
 import json
 import json5
+import numpy as np
 import os
+import threading
 import time
+from collections import deque
+from requests.adapters import HTTPAdapter
 
 
 CACHE_FILE = "cache/prices_cache.json"
 CACHE_DURATION = 60 * 60 * 3  # 3 hours
 
+# Wiki prices api, OBVA_PRICES_API_URL points the app at another server (e.g. benchmarks/fake_prices_server.py)
+PRICES_API_URL = os.environ.get("OBVA_PRICES_API_URL", "https://prices.runescape.wiki/api/v1/osrs")
+REQUEST_HEADERS = {"User-Agent": "OBVA/1.0"}  # OBVA -> Orangeliquid Bank Value App
+REQUEST_TIMEOUT = (
+    float(os.environ.get("OBVA_PRICES_CONNECT_TIMEOUT", 3.05)),  # seconds to connect
+    float(os.environ.get("OBVA_PRICES_READ_TIMEOUT", 15)),  # seconds between bytes of the response
+)
+PRICES_POOL_SIZE = 4  # kept alive connections to the api host
+REQUEST_RETRIES = int(os.environ.get("OBVA_PRICES_RETRIES", 3))
+RETRY_BACKOFF = 1.0  # seconds before the first retry, doubled after every failed attempt
+# Server side failures worth another attempt, any other 4xx is raised straight away -> asking again won't change it
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Printing every request to the api is opt-in for debugging -> OBVA_PRICES_VERBOSE=1
+PRICES_VERBOSE = os.environ.get("OBVA_PRICES_VERBOSE", "").lower() in ("1", "true", "yes", "on")
 
-def fetch_all_item_prices():
+# Prices are refreshed in the background once the cache is this close to expiring, an expired cache keeps being
+# served until the refresh lands so page loads never wait on the api
+REFRESH_AHEAD = 60 * 15  # 15 minutes
+REFRESHER_INTERVAL = 60  # seconds between cache age checks of the background refresher
+
+# Parsed cache file shared by every Streamlit session of the process, reloaded when the file's mtime changes
+PRICE_CACHE_MEMO = {"mtime_ns": None, "cache": None, "price_table": None}
+PRICE_CACHE_LOCK = threading.Lock()
+# Held while a refresh is downloading prices -> single flight, only one request to the api at a time
+PRICE_REFRESH_LOCK = threading.Lock()
+PRICE_REFRESHER = {"thread": None}
+# Size and latency of the most recent requests to the prices api, newest last
+PRICE_REQUEST_METRICS = deque(maxlen=200)
+
+
+def create_prices_session():
+    """
+    requests.Session shared by every call to the prices api -> keeps connections alive between refreshes and asks
+    for gzip, the /latest payload compresses to a fraction of its size.
+    """
+    session = requests.Session()
+    session.headers.update(REQUEST_HEADERS)
+    session.headers["Accept-Encoding"] = "gzip"
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=PRICES_POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+PRICES_SESSION = create_prices_session()
+
+
+def format_request_metrics(metrics: dict) -> str:
+    return (f"GET {metrics['url']} -> {metrics['status']}, {metrics['wire_bytes'] / 1024:.1f} KB "
+            f"({metrics['body_bytes'] / 1024:.1f} KB decoded) in {metrics['seconds']:.2f}s")
+
+
+def record_request_metrics(url: str, status, wire_bytes: int, body_bytes: int, seconds: float):
+    """Appends an attempt to PRICE_REQUEST_METRICS, only printed when PRICES_VERBOSE is set"""
+    metrics = {
+        "url": url,
+        "status": status,
+        "wire_bytes": wire_bytes,
+        "body_bytes": body_bytes,
+        "seconds": seconds,
+        "at": time.time(),
+    }
+    PRICE_REQUEST_METRICS.append(metrics)
+    if PRICES_VERBOSE:
+        print(format_request_metrics(metrics))
+
+
+def print_request_metrics(last: int = 20):
+    """
+    Prints the most recent requests to the prices api, newest last.
+    :param last: number of requests to print
+    """
+    for metrics in list(PRICE_REQUEST_METRICS)[-last:]:
+        print(format_request_metrics(metrics))
+
+
+def is_retryable(error: requests.RequestException) -> bool:
+    """Connection errors, timeouts and server side failures are retried, other client errors are not"""
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code in RETRY_STATUSES
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+def request_prices_api(endpoint: str, params: dict = None, headers: dict = None, timeout=None, retries: int = None,
+                       backoff: float = None):
+    """
+    GETs an endpoint of the prices api through PRICES_SESSION, retrying connection errors, timeouts and
+    RETRY_STATUSES with exponential backoff. Any other error, e.g. a 404, is raised on the first attempt.
+    Size and latency of every attempt are recorded in PRICE_REQUEST_METRICS.
+    :param endpoint: path below PRICES_API_URL, e.g. "/latest"
+    :param params: query parameters
+    :param headers: extra request headers, e.g. conditional request validators
+    :param timeout: requests timeout, (connect, read) seconds -> default REQUEST_TIMEOUT
+    :param retries: attempts before giving up -> default REQUEST_RETRIES
+    :param backoff: seconds before the first retry -> default RETRY_BACKOFF
+    :return: requests.Response -> 2xx or 304
+    """
+    url = f"{PRICES_API_URL}{endpoint}"
+    timeout = timeout or REQUEST_TIMEOUT
+    retries = retries or REQUEST_RETRIES
+    backoff = RETRY_BACKOFF if backoff is None else backoff
+
+    for attempt in range(retries):
+        start = time.perf_counter()
+        try:
+            response = PRICES_SESSION.get(url, params=params, headers=headers, timeout=timeout)
+            # raw.tell() -> bytes pulled over the wire, before gzip decoding
+            record_request_metrics(
+                url=url,
+                status=response.status_code,
+                wire_bytes=response.raw.tell(),
+                body_bytes=len(response.content),
+                seconds=time.perf_counter() - start,
+            )
+            response.raise_for_status()
+            return response
+        except requests.RequestException as error:
+            if not isinstance(error, requests.HTTPError):
+                record_request_metrics(url=url, status=None, wire_bytes=0, body_bytes=0,
+                                       seconds=time.perf_counter() - start)
+            if attempt == retries - 1 or not is_retryable(error):
+                raise
+
+            delay = backoff * 2 ** attempt
+            print(f"Price request failed ({error}), retrying in {delay:.2f}s..")
+            time.sleep(delay)
+
+
+def request_latest_prices(cache: dict = None):
+    """
+    GETs /latest, conditional on the validators of cache when it has them.
+    :param cache: current price cache -> {"timestamp", "data", "etag", "last_modified"}
+    :return: Tuple -> (api response, ETag, Last-Modified), api response is None if the server answered 304
+    """
+    headers = {}
+    if cache is not None:
+        if cache.get("etag"):
+            headers["If-None-Match"] = cache["etag"]
+        if cache.get("last_modified"):
+            headers["If-Modified-Since"] = cache["last_modified"]
+
+    response = request_prices_api("/latest", headers=headers)
+    if response.status_code == 304:
+        return None, cache.get("etag"), cache.get("last_modified")
+
+    return response.json(), response.headers.get("ETag"), response.headers.get("Last-Modified")
+
+
+def cache_age(cache: dict) -> float:
+    """Seconds since the cache was last confirmed current -> fetched, or revalidated by a 304."""
+    return time.time() - cache.get("checked_at", cache["timestamp"])
+
+
+def load_price_cache():
+    """
+    Reads the cache file through PRICE_CACHE_MEMO, the file is only parsed again when its mtime changes.
+    :return: Dict -> {"timestamp", "data", "etag", "last_modified", "checked_at"}, None if there is no cache file yet
+    """
+    with PRICE_CACHE_LOCK:
+        if not os.path.exists(CACHE_FILE):
+            return None
+
+        mtime_ns = os.stat(CACHE_FILE).st_mtime_ns
+        if mtime_ns != PRICE_CACHE_MEMO["mtime_ns"]:
+            with open(file=CACHE_FILE, mode="r", encoding="utf-8") as f:
+                PRICE_CACHE_MEMO["cache"] = json.load(f)
+            PRICE_CACHE_MEMO["mtime_ns"] = mtime_ns
+
+        return PRICE_CACHE_MEMO["cache"]
+
+
+def refresh_price_cache(wait: bool = True):
+    """
+    Downloads fresh prices and replaces the cache file. Single flight -> a caller arriving while another refresh is
+    downloading does not send a second request.
+    :param wait: True -> wait for the refresh in flight and return its cache, False -> return None straight away
+    :return: Dict -> {"timestamp", "data"}, None if wait is False and a refresh was already running
+    """
+    if not PRICE_REFRESH_LOCK.acquire(blocking=False):
+        if not wait:
+            return None
+
+        with PRICE_REFRESH_LOCK:
+            pass
+
+        # The refresh we waited on failed -> try once ourselves so the error reaches this caller
+        cache = load_price_cache()
+        return cache if cache is not None else refresh_price_cache(wait=True)
+
+    try:
+        current = load_price_cache()
+        data, etag, last_modified = request_latest_prices(cache=current)
+        if data is None:
+            # 304 -> prices are unchanged, keep their fetch time so snapshots keep sharing one PriceRun
+            cache = {**current, "checked_at": time.time()}
+        else:
+            cache = {"timestamp": time.time(), "data": data, "etag": etag, "last_modified": last_modified}
+
+        # Write then rename so readers never see a half written cache file
+        temp_file = f"{CACHE_FILE}.tmp"
+        with open(file=temp_file, mode="w", encoding="utf-8") as f:
+            json.dump(cache, f)
+        os.replace(temp_file, CACHE_FILE)
+
+        with PRICE_CACHE_LOCK:
+            PRICE_CACHE_MEMO["cache"] = cache
+            PRICE_CACHE_MEMO["mtime_ns"] = os.stat(CACHE_FILE).st_mtime_ns
+    finally:
+        PRICE_REFRESH_LOCK.release()
+
+    print("Price cache refreshed..")
+    return cache
+
+
+def refresh_price_cache_quietly():
+    """refresh_price_cache for background threads -> never waits on another refresh, logs failures."""
+    try:
+        refresh_price_cache(wait=False)
+    except (requests.RequestException, ValueError, OSError) as error:
+        print(f"Background price refresh failed: {error}")
+
+
+def refresh_price_cache_in_background():
+    """
+    Starts a refresh in a daemon thread unless one is already in flight.
+    :return: Bool -> True if a refresh was started
+    """
+    if PRICE_REFRESH_LOCK.locked():
+        return False
+
+    threading.Thread(target=refresh_price_cache_quietly, name="price-cache-refresh", daemon=True).start()
+    return True
+
+
+def price_cache_needs_refresh(cache) -> bool:
+    return cache is None or cache_age(cache) >= CACHE_DURATION - REFRESH_AHEAD
+
+
+def run_price_refresher(interval: float):
+    while True:
+        if price_cache_needs_refresh(load_price_cache()):
+            refresh_price_cache_quietly()
+        time.sleep(interval)
+
+
+def start_price_refresher(interval: float = REFRESHER_INTERVAL):
+    """
+    Starts the process wide background refresher, a daemon thread that refreshes the price cache REFRESH_AHEAD
+    seconds before it expires. Calling it again while the refresher is running does nothing.
+    :param interval: seconds between cache age checks
+    :return: threading.Thread
+    """
+    with PRICE_CACHE_LOCK:
+        thread = PRICE_REFRESHER["thread"]
+        if thread is None or not thread.is_alive():
+            os.makedirs("cache", exist_ok=True)
+            thread = threading.Thread(target=run_price_refresher, args=(interval,), name="price-refresher", daemon=True)
+            thread.start()
+            PRICE_REFRESHER["thread"] = thread
+
+    return thread
+
+
+def fetch_price_cache(fresh: bool = False):
     """
     Fetches all tradeable OSRS item prices from runescape api, saves cached data within cache directory in .json.
-    Uses cache from last get request if called within cache duration.
+    Stale while revalidate -> a cache that is expired or about to expire is still returned right away while a
+    background refresh fetches new prices. Only the very first call, with no cache file yet, waits on the api.
+    :param fresh: True -> an expired cache is refreshed before it is returned, for callers that write snapshots. A
+                  snapshot is stamped with the fetch time of its prices, so it must never be written from stale ones
+    :return: Dict -> {"timestamp": unix time the prices were fetched, "data": api response, "etag", "last_modified",
+                      "checked_at": unix time of the last 304 confirming the prices}
     """
     # Create cache dir if missing
     os.makedirs("cache", exist_ok=True)
 
-    # Check if cache exist and is recent
-    if os.path.exists(CACHE_FILE):
-        with open(file=CACHE_FILE, mode="r", encoding="utf-8") as f:
-            cache = json.load(f)
+    cache = load_price_cache()
+    if cache is None:
+        print("No cached prices, fetching..")
+        return refresh_price_cache(wait=True)
 
-            if time.time() - cache["timestamp"] < CACHE_DURATION:
-                print("Using cached prices..")
-                return cache["data"]
+    if fresh and cache_age(cache) >= CACHE_DURATION:
+        print("Cached prices expired, refreshing before the snapshot..")
+        return refresh_price_cache(wait=True)
 
-    # Else fetch new data
-    url = "https://prices.runescape.wiki/api/v1/osrs/latest"
-    response = requests.get(url, headers={"User-Agent": "OBVA/1.0"})  # OBVA -> Orangeliquid Bank Value App
-    data = response.json()
+    if price_cache_needs_refresh(cache):
+        refresh_price_cache_in_background()
 
-    with open(file=CACHE_FILE, mode="w", encoding="utf-8") as f:
-        json.dump({"timestamp": time.time(), "data": data}, f)
+    if cache_age(cache) < CACHE_DURATION:
+        print("Using cached prices..")
+    else:
+        print("Using stale cached prices while they refresh..")
 
-    return data
+    return cache
+
+
+def fetch_all_item_prices(fresh: bool = False):
+    """
+    Fetches all tradeable OSRS item prices, see fetch_price_cache.
+    :param fresh: True -> never expired prices, see fetch_price_cache
+    :return: Dict -> api response, prices keyed by item id under "data"
+    """
+    return fetch_price_cache(fresh=fresh)["data"]
+
+
+class PriceTable:
+    """
+    /latest prices as item id indexed arrays -> high, low, highTime, lowTime. Missing prices are MISSING.
+    """
+    MISSING = -1
+    FIELDS = ("high", "low", "highTime", "lowTime")
+
+    def __init__(self, all_prices: dict, fetched_at: float):
+        """
+        :param all_prices: "data" of the /latest api response -> {"item_id": {"high": .., "low": .., ..}}
+        :param fetched_at: unix time the prices were fetched
+        """
+        self.fetched_at = fetched_at
+
+        size = max((int(item_id) for item_id in all_prices), default=-1) + 1
+        self.prices = np.full((size, len(self.FIELDS)), self.MISSING, dtype=np.int64)
+        self.found = np.zeros(size, dtype=bool)
+
+        for item_id, price_data in all_prices.items():
+            row = int(item_id)
+            self.found[row] = True
+            for column, field in enumerate(self.FIELDS):
+                if price_data.get(field) is not None:
+                    self.prices[row, column] = price_data[field]
+
+    @classmethod
+    def from_arrays(cls, item_ids, high, low, fetched_at: float):
+        """
+        Builds a PriceTable straight from arrays, without an api shaped dict -> used by generated prices.
+        :param item_ids: array like of item ids
+        :param high: array like of high prices, same order as item_ids
+        :param low: array like of low prices, same order as item_ids
+        :param fetched_at: unix time of the prices, also used as highTime and lowTime
+        """
+        item_ids = np.asarray(item_ids, dtype=np.int64)
+        price_table = cls(all_prices={}, fetched_at=fetched_at)
+
+        size = int(item_ids.max()) + 1 if len(item_ids) else 0
+        price_table.prices = np.full((size, len(cls.FIELDS)), cls.MISSING, dtype=np.int64)
+        times = np.full(len(item_ids), int(fetched_at), dtype=np.int64)
+        price_table.prices[item_ids] = np.column_stack([high, low, times, times])
+        price_table.found = np.zeros(size, dtype=bool)
+        price_table.found[item_ids] = True
+        return price_table
+
+    def to_api_data(self) -> dict:
+        """:return: Dict -> "data" of a /latest api response holding every price of the table"""
+        return {str(item_id): self.get(item_id) for item_id in np.flatnonzero(self.found)}
+
+    def __contains__(self, item_id) -> bool:
+        item_id = int(item_id)
+        return 0 <= item_id < len(self.found) and bool(self.found[item_id])
+
+    def get(self, item_id):
+        """
+        :return: Dict shaped like the api entry -> {"high", "low", "highTime", "lowTime"}, None if item_id has no price
+        """
+        if item_id not in self:
+            return None
+
+        return {
+            field: None if value == self.MISSING else int(value)
+            for field, value in zip(self.FIELDS, self.prices[int(item_id)])
+        }
+
+    def take(self, item_ids):
+        """
+        Vectorized lookup of many items.
+        :param item_ids: array like of item ids
+        :return: np.ndarray shape (len(item_ids), 4) -> high, low, highTime, lowTime, MISSING where there is no price
+        """
+        item_ids = np.asarray(item_ids, dtype=np.int64)
+        in_range = (item_ids >= 0) & (item_ids < len(self.found))
+
+        result = np.full((len(item_ids), len(self.FIELDS)), self.MISSING, dtype=np.int64)
+        result[in_range] = self.prices[item_ids[in_range]]
+        return result
+
+
+def get_price_table(fresh: bool = False):
+    """
+    Process wide PriceTable of the current price cache, rebuilt only when the cache is refreshed.
+    :param fresh: True -> never expired prices, see fetch_price_cache
+    :return: PriceTable
+    """
+    cache = fetch_price_cache(fresh=fresh)
+
+    with PRICE_CACHE_LOCK:
+        price_table = PRICE_CACHE_MEMO["price_table"]
+        if price_table is None or price_table.fetched_at != cache["timestamp"]:
+            price_table = PriceTable(all_prices=cache["data"]["data"], fetched_at=cache["timestamp"])
+            PRICE_CACHE_MEMO["price_table"] = price_table
+
+    return price_table
 
 
 # json5 for inline comment handling for tradeable_if_uncharged.json and item_plus_ornament_kit.json
@@ -1,109 +1,175 @@
 from datetime import datetime, timezone, timedelta
 from sqlalchemy.orm import Session
 
-from app.crud.database import create_bank, create_bank_item, create_price_snapshot, get_bank_id_by_name
-from app.crud.database import read_all_items_by_bank_id, get_latest_snapshot_time
+from app.crud.database import create_bank, create_bank_valuation, get_bank_id_by_name
+from app.crud.database import bulk_create_bank_items, get_or_create_price_run, bulk_create_item_prices
+from app.crud.database import create_bank_price_run, read_all_items_by_bank_id, get_latest_snapshot_time
+from app.crud.database import get_all_banks, get_latest_snapshot_times, read_all_items_by_bank_ids
+from app.crud.database import get_bank_by_content_hash, get_bank_by_item_set_hash, create_bank_alias
+from app.crud.database import get_holdings_versions
 from app.database import SessionLocal
-from app.utils.file_io import read_snapshot_json
+from app.utils.file_io import read_snapshot_json, parse_bank_tsv, enter_tsv_into_db, IMPORT_AUDIT
+from app.utils.file_io import bank_content_hashes
 from app.utils.prices import fetch_all_item_prices, read_tradeable_if_uncharged, read_item_plus_ornament_kit
+from app.utils.prices import PriceTable
+from app.utils.price_providers import PriceProvider, LIVE_PRICES
+from app.utils.price_resolver import PriceResolver, get_price_resolver, COINS_ID
 
 
 # Used in enter_all_items_current_price -> change to 0 for unlimited calls to the function
 COOLDOWN = timedelta(hours=12)
 
 
-def initial_enter_all_items_current_price(db: Session, file_name: str, bank_name: str = "Original_Bank"):
+def initial_enter_all_items_current_price(
+        db: Session,
+        file_name: str,
+        bank_name: str = "Original_Bank",
+        provider: PriceProvider = LIVE_PRICES,
+):
     """
-    Parse first_snapshot.json and use fetch_all_item_prices to create SqlAlchemy objects to enter into database.
-    If ID of item found in all_prices, pricing data is entered for item entry. If ID not found in all_prices,
-    ID will be checked in all_tradeable_if_uncharged. If not found, ID will be checked in all_item_plus_ornament_kit.
-    Last, Item will be deemed untradeable and prices will not be added.
+    Parse first_snapshot.json and enter its items as a new bank, see enter_new_bank.
     :param db: Session
     :param file_name: name of your .json file to write to
     :param bank_name: Title of your bank snapshot -> default = "Original_Bank
-    :return: Dict -> {"summary": summary, "items": all_items}
+    :param provider: PriceProvider the prices and snapshot time come from -> default live wiki api prices
+    :return: Int -> number of items entered
     """
+    return enter_new_bank(db=db, items=read_snapshot_json(name=file_name), bank_name=bank_name, provider=provider)
 
-    snapshot_time = datetime.now(timezone.utc)
-    all_prices = fetch_all_item_prices()["data"]
-    all_items = read_snapshot_json(name=file_name)
-    all_tradeable_if_uncharged = read_tradeable_if_uncharged()
-    all_item_plus_ornament_kit = read_item_plus_ornament_kit()
 
-    # Create Bank entry
-    bank = create_bank(db, name=bank_name, created_at=snapshot_time)
+def enter_bank_tsv(
+        db: Session,
+        tsv_data: str,
+        bank_name: str,
+        provider: PriceProvider = LIVE_PRICES,
+        audit: bool = IMPORT_AUDIT,
+):
+    """
+    Streams a pasted Bank Memory TSV straight into the database, rows are parsed and validated one line at a time
+    and never written to disk.
+    :param db: Session
+    :param tsv_data: clipboard contents copied from the Bank Memory plugin
+    :param bank_name: Title of the new bank
+    :param provider: PriceProvider the prices and snapshot time come from -> default live wiki api prices
+    :param audit: also keep the pasted data as items/<bank_name>.txt -> default OBVA_IMPORT_AUDIT
+    :return: Int -> number of items entered
+    """
+    if audit:
+        enter_tsv_into_db(tsv_data=tsv_data, file_name=bank_name)
 
-    for item in all_items:
-        item_id = str(item["item_id"])
-        quantity = item.get("quantity", 1)
+    return enter_new_bank(db=db, items=parse_bank_tsv(tsv_data.splitlines()), bank_name=bank_name, provider=provider)
 
-        bank_item = create_bank_item(
-            db=db,
-            bank_id=bank.id,
-            item_id=item["item_id"],
-            name=item["item_name"],
-            quantity=quantity,
-            is_tradeable=item_id in all_prices or int(item_id) == 995,
-            uncharged_id=int(all_tradeable_if_uncharged[item_id]) if item_id in all_tradeable_if_uncharged else None,
-            has_ornament_kit_equipped=item_id in all_item_plus_ornament_kit
-        )
 
-        # 1. Item is tradeable
-        if item_id in all_prices:
-            price_data = all_prices[item_id]
-            high = price_data["high"] * quantity
-            low = price_data["low"] * quantity
+def enter_new_bank(db: Session, items, bank_name: str, provider: PriceProvider = LIVE_PRICES):
+    """
+    Use the provider's prices to create SqlAlchemy objects of a new bank to enter into database.
+    Unit prices come from the compiled PriceResolver -> an item's own price, else the price of its uncharged version,
+    base item plus ornament kit, coins or another composite rule. Items without any price are deemed untradeable
+    and prices will not be added.
+    :param db: Session
+    :param items: iterable of dicts -> {"item_id", "item_name", "quantity"}, parse_bank_tsv or a snapshot .json
+    :param bank_name: Title of the new bank
+    :param provider: PriceProvider the prices and snapshot time come from -> default live wiki api prices
+    :return: Int -> number of items entered
+    """
 
-        # 2. Item is Charged thus untradeable
-        elif item_id in all_tradeable_if_uncharged:
-            uncharged_id = all_tradeable_if_uncharged[item_id]
-            price_data = all_prices[str(uncharged_id)]
-            high = price_data["high"] * quantity
-            low = price_data["low"] * quantity
+    snapshot_time = provider.now()
+    price_table = provider.snapshot_price_table()
+    resolver = get_price_resolver()
 
-        # 3. Item is untradeable because it has an ornament kit equipped
-        elif item_id in all_item_plus_ornament_kit:
-            base_item = all_item_plus_ornament_kit[item_id]
-            ornament_kit = all_item_plus_ornament_kit[f"kit_{item_id}"]
+    bank_items = build_bank_items(items=items, price_table=price_table, resolver=resolver)
 
-            high = (all_prices[base_item]["high"] + all_prices[ornament_kit]["high"]) * quantity
-            low = (all_prices[base_item]["low"] + all_prices[ornament_kit]["low"]) * quantity
+    # Create Bank entry
+    content_hash, item_set_hash = bank_content_hashes(bank_items)
+    bank = create_bank(
+        db,
+        name=bank_name,
+        created_at=snapshot_time,
+        content_hash=content_hash,
+        item_set_hash=item_set_hash,
+    )
+
+    # item_id -> (high, low) for a single item, untradeable items are left out
+    unit_prices = resolver.unit_prices(price_table=price_table, item_ids=[item["item_id"] for item in bank_items])
+
+    # Every BankItem in one INSERT, then the run's unit prices in a second one
+    bulk_create_bank_items(db=db, bank_id=bank.id, items=bank_items)
+    enter_price_run(
+        db=db,
+        bank_id=bank.id,
+        snapshot_time=snapshot_time,
+        fetched_at=price_table.fetched_at,
+        unit_prices=unit_prices,
+        bank_items=bank_items,
+    )
 
-        # 4. Special Case -> Gold Coins/GP/Coins -> Named Coins
-        elif int(item_id) == 995:
-            high = quantity
-            low = quantity
+    db.commit()
+    return len(bank_items)
 
-        # 5. Item is untradeable, no need to get price info for snapshot
-        else:
-            continue
 
-        # Create PriceSnapshot
-        mean_value = (high + low) / 2
+def build_bank_items(items, price_table: PriceTable, resolver: PriceResolver):
+    """
+    :param items: iterable of dicts -> {"item_id", "item_name", "quantity"}
+    :return: List of dicts keyed by BankItem column names, ready for bulk_create_bank_items
+    """
+    return [
+        {
+            "item_id": item["item_id"],
+            "name": item["item_name"],
+            "quantity": item.get("quantity", 1),
+            "is_tradeable": item["item_id"] in price_table or int(item["item_id"]) == COINS_ID,
+            "uncharged_id": resolver.uncharged_id(item["item_id"]),
+            "has_ornament_kit_equipped": resolver.has_ornament_kit(item["item_id"]),
+        }
+        for item in items
+    ]
+
 
-        create_price_snapshot(
-            db=db,
-            bank_item_id=bank_item.id,
-            item_name=bank_item.name,
-            timestamp=snapshot_time,
-            high_value=high,
-            low_value=low,
-            mean_value=mean_value
-        )
+def find_duplicate_bank(db: Session, items: list):
+    """
+    Looks up a bank imported from the same export before any rows of a new import are written.
+    :param db: Session
+    :param items: parsed rows of the new import -> dicts with item_id and quantity
+    :return: Tuple -> ("exact", Bank) same items and quantities, ("near", Bank) same items in other quantities,
+             (None, None) if no bank matches
+    """
+    content_hash, item_set_hash = bank_content_hashes(items)
+
+    bank = get_bank_by_content_hash(db=db, content_hash=content_hash)
+    if bank:
+        return "exact", bank
+
+    bank = get_bank_by_item_set_hash(db=db, item_set_hash=item_set_hash)
+    if bank:
+        return "near", bank
+
+    return None, None
 
+
+def link_bank_name(db: Session, bank_name: str, bank_id: int):
+    """
+    Registers bank_name as another name of an existing bank instead of copying its items and history.
+    :param db: Session
+    :param bank_name: name the export was imported under
+    :param bank_id: id of the identical Bank
+    :return: BankAlias
+    """
+    bank_alias = create_bank_alias(db=db, name=bank_name, bank_id=bank_id, created_at=datetime.now(timezone.utc))
     db.commit()
+    return bank_alias
 
 
-def enter_all_items_current_price(bank_name: str):
+def enter_all_items_current_price(bank_name: str, provider: PriceProvider = LIVE_PRICES):
     """
-    Uses bank_name param to determine bank_id, then reads all items associated with bank_id and creates more
-    PriceSnapshots of item with current price for later comparison. Enters PriceSnapshot of item into db.
+    Uses bank_name param to determine bank_id, then reads all items associated with bank_id and values them against
+    the current prices for later comparison. Enters the price run of the bank into db.
     :param bank_name: Name of bank within DB
+    :param provider: PriceProvider the prices and snapshot time come from -> default live wiki api prices
     :return: None
     """
-    snapshot_time = datetime.now(timezone.utc)
-    all_prices = fetch_all_item_prices()["data"]
-    all_item_plus_ornament_kit = read_item_plus_ornament_kit()
+    snapshot_time = provider.now()
+    price_table = provider.snapshot_price_table()
+    resolver = get_price_resolver()
 
     # get bank.id from bank_name and then read all items matching bank.id
     with SessionLocal() as db:
@@ -113,70 +179,159 @@ def enter_all_items_current_price(bank_name: str):
             return
 
         last_snapshot_time = get_latest_snapshot_time(db=db, passed_bank_id=bank_id)
+        remaining = remaining_cooldown(last_snapshot_time=last_snapshot_time, snapshot_time=snapshot_time)
+        if remaining:
+            return False, remaining
 
-        if last_snapshot_time:
-            if last_snapshot_time.tzinfo is None:
-                last_snapshot_time = last_snapshot_time.replace(tzinfo=timezone.utc)
+        items = read_all_items_by_bank_id(db=db, bank_id=bank_id)
 
-            if (snapshot_time - last_snapshot_time) < COOLDOWN:
-                remaining = COOLDOWN - (snapshot_time - last_snapshot_time)
-                return False, remaining
+        enter_price_run(
+            db=db,
+            bank_id=bank_id,
+            version=get_holdings_versions(db=db, bank_ids=[bank_id]).get(bank_id, 1),
+            snapshot_time=snapshot_time,
+            fetched_at=price_table.fetched_at,
+            unit_prices=resolve_bank_item_prices(
+                items=items,
+                price_table=price_table,
+                resolver=resolver,
+            ),
+            bank_items=[{"item_id": item.item_id, "quantity": item.quantity} for item in items],
+        )
 
-        items = read_all_items_by_bank_id(db=db, bank_id=bank_id)
+        db.commit()
 
-        for item in items:
-            # print(item)
-            item_id = str(item.item_id)
-
-            if item.is_tradeable and item_id != '995':
-                price_data = all_prices[item_id]
-                if not price_data:
-                    continue
-                high = price_data["high"] * item.quantity
-                low = price_data["low"] * item.quantity
-
-            elif item.uncharged_id:
-                uncharged_id = str(item.uncharged_id)
-                price_data = all_prices[str(uncharged_id)]
-                if not price_data:
-                    continue
-                high = price_data["high"] * item.quantity
-                low = price_data["low"] * item.quantity
-
-            elif item.has_ornament_kit_equipped:
-                base_item = all_item_plus_ornament_kit[item_id]
-                ornament_kit = all_item_plus_ornament_kit[f"kit_{item_id}"]
-                if not base_item or not ornament_kit:
-                    continue
-
-                high = (all_prices[base_item]["high"] + all_prices[ornament_kit]["high"]) * item.quantity
-                low = (all_prices[base_item]["low"] + all_prices[ornament_kit]["low"]) * item.quantity
-
-            # Coins ID
-            elif int(item_id) == 995:
-                high = item.quantity
-                low = item.quantity
-
-            # Item is untradeable -> no snapshot needed
-            else:
-                continue
+    return True, None
 
-            mean_value_estimate = (high + low) / 2
 
-            # print(item.id, item.name, snapshot_time, high, low, mean_value_estimate)
-            create_price_snapshot(
-                    db=db,
-                    bank_item_id=item.id,
-                    item_name=item.name,
-                    timestamp=snapshot_time,
-                    high_value=high,
-                    low_value=low,
-                    mean_value=mean_value_estimate
-                )
+def enter_all_banks_current_price(provider: PriceProvider = LIVE_PRICES):
+    """
+    Refreshes every bank whose COOLDOWN has passed from a single price fetch. Cooldowns are checked with one grouped
+    query, items of all eligible banks are read with one query and every bank's price run is written in one
+    transaction.
+    :param provider: PriceProvider the prices and snapshot time come from -> default live wiki api prices
+    :return: Dict -> {bank_name: (True, None) if refreshed else (False, remaining cooldown)}
+    """
+    snapshot_time = provider.now()
+    price_table = provider.snapshot_price_table()
+    resolver = get_price_resolver()
+
+    results = {}
+    with SessionLocal() as db:
+        last_snapshot_times = get_latest_snapshot_times(db=db)
+
+        eligible_banks = []
+        for bank in get_all_banks(db=db):
+            remaining = remaining_cooldown(
+                last_snapshot_time=last_snapshot_times.get(bank.id),
+                snapshot_time=snapshot_time,
+            )
+            if remaining:
+                results[bank.name] = (False, remaining)
+            else:
+                eligible_banks.append(bank)
+
+        items_by_bank = read_all_items_by_bank_ids(db=db, bank_ids=[bank.id for bank in eligible_banks])
+        versions = get_holdings_versions(db=db, bank_ids=[bank.id for bank in eligible_banks])
+
+        for bank in eligible_banks:
+            items = items_by_bank.get(bank.id, [])
+            enter_price_run(
+                db=db,
+                bank_id=bank.id,
+                version=versions.get(bank.id, 1),
+                snapshot_time=snapshot_time,
+                fetched_at=price_table.fetched_at,
+                unit_prices=resolve_bank_item_prices(
+                    items=items,
+                    price_table=price_table,
+                    resolver=resolver,
+                ),
+                bank_items=[{"item_id": item.item_id, "quantity": item.quantity} for item in items],
+            )
+            results[bank.name] = (True, None)
 
         db.commit()
 
-    return True, None
+    return results
+
+
+def remaining_cooldown(last_snapshot_time, snapshot_time):
+    """
+    :return: timedelta left on COOLDOWN since last_snapshot_time, None if the bank may be refreshed
+    """
+    if not last_snapshot_time:
+        return None
+
+    if last_snapshot_time.tzinfo is None:
+        last_snapshot_time = last_snapshot_time.replace(tzinfo=timezone.utc)
+
+    if (snapshot_time - last_snapshot_time) < COOLDOWN:
+        return COOLDOWN - (snapshot_time - last_snapshot_time)
+
+    return None
+
+
+def resolve_bank_item_prices(items, price_table: PriceTable, resolver: PriceResolver):
+    """
+    Resolves the unit price of stored BankItems in one vectorized pass of the compiled price rules.
+    :param items: BankItems
+    :param price_table: PriceProvider.price_table()
+    :param resolver: get_price_resolver()
+    :return: Dict -> {item_id: (high, low)}, untradeable items and items without a price are left out
+    """
+    return resolver.unit_prices(price_table=price_table, item_ids=[item.item_id for item in items])
+
+
+def enter_price_run(
+        db: Session,
+        bank_id: int,
+        snapshot_time,
+        fetched_at: float,
+        unit_prices: dict,
+        bank_items: list,
+        version: int = 1,
+):
+    """
+    Values a bank against one price fetch. The fetch is stored once as a PriceRun holding unit prices, banks
+    refreshed from the same fetch reuse it and only add prices for items the run does not have yet. The bank's
+    BankValuation totals are written in the same transaction.
+    :param db: Session
+    :param bank_id: id of the Bank being valued
+    :param snapshot_time: time of this bank snapshot
+    :param fetched_at: unix time the prices were fetched, PriceTable.fetched_at
+    :param unit_prices: Dict -> {item_id: (high, low)} for a single item
+    :param bank_items: list of dicts with item_id and quantity of every item in the bank
+    :param version: holdings version bank_items belong to, the snapshot is read back from the BankItems held at it
+    :return: BankPriceRun
+    """
+    price_run = get_or_create_price_run(db=db, fetched_at=datetime.fromtimestamp(fetched_at, timezone.utc))
+    bulk_create_item_prices(db=db, run_id=price_run.id, unit_prices=unit_prices)
+
+    low_value = 0
+    high_value = 0
+    item_count = 0
+    for bank_item in bank_items:
+        if bank_item["item_id"] not in unit_prices:
+            continue
+
+        high, low = unit_prices[bank_item["item_id"]]
+        high_value += high * bank_item["quantity"]
+        low_value += low * bank_item["quantity"]
+        item_count += 1
+
+    create_bank_valuation(
+        db=db,
+        bank_id=bank_id,
+        timestamp=snapshot_time,
+        low_value=low_value,
+        mean_value=(high_value + low_value) / 2,
+        high_value=high_value,
+        item_count=item_count,
+    )
+
+    return create_bank_price_run(db=db, bank_id=bank_id, run_id=price_run.id, timestamp=snapshot_time,
+                                 version=version)
 
 
 # Older write to current first_snapshot.json
@@ -191,7 +346,7 @@ def initial_enter_all_items_current_price_json(file_name: str, bank_name: str =
     :return: Dict -> {"summary": summary, "items": all_items}
     """
     snapshot_time = datetime.now(timezone.utc).isoformat()
-    all_prices = fetch_all_item_prices()["data"]
+    all_prices = fetch_all_item_prices(fresh=True)["data"]
     # print(all_prices)
 
     all_items = read_snapshot_json(name=file_name)
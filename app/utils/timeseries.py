@@ -0,0 +1,132 @@
+import time
+
+from app.crud.database import get_tracked_item_ids, get_price_bucket_watermark, set_price_bucket_watermark
+from app.crud.database import bulk_create_item_price_buckets, get_item_ids_with_price_buckets
+from app.database import SessionLocal
+from app.utils.prices import request_prices_api
+
+
+# Bucket length in seconds of every timestep the wiki api averages prices over
+TIMESTEPS = {"5m": 300, "1h": 3600, "6h": 21600, "24h": 86400}
+# /5m and /1h return every item for one bucket, they are ingested bucket by bucket from a watermark
+BULK_TIMESTEPS = ("5m", "1h")
+# Buckets ingested the first time a timestep runs, older history of each item comes from /timeseries
+INITIAL_BUCKETS = {"5m": 12, "1h": 24}
+MAX_BUCKETS_PER_RUN = 288  # one day of /5m buckets, a longer gap is caught up over several runs
+MAX_TIMESERIES_ITEMS_PER_RUN = 200
+# The api publishes a bucket a little after it closes, younger buckets are left for the next run
+SETTLE_DELAY = 120
+
+
+def latest_settled_bucket(step: int, now: int) -> int:
+    """:return: Int -> start of the newest bucket of step that closed at least SETTLE_DELAY seconds before now"""
+    return (now - SETTLE_DELAY) // step * step - step
+
+
+def price_bucket_row(item_id: int, step: int, bucket_ts: int, prices: dict) -> dict:
+    return {
+        "item_id": item_id,
+        "timestep": step,
+        "bucket_ts": bucket_ts,
+        "avg_high": prices.get("avgHighPrice"),
+        "high_volume": prices.get("highPriceVolume") or 0,
+        "avg_low": prices.get("avgLowPrice"),
+        "low_volume": prices.get("lowPriceVolume") or 0,
+    }
+
+
+def ingest_price_buckets(timestep: str = "5m", max_buckets: int = MAX_BUCKETS_PER_RUN, now: int = None):
+    """
+    Fetches the /5m or /1h buckets missing since the watermark of timestep, oldest first, and stores the prices of
+    tracked items. Every bucket is committed together with the watermark, so an interrupted run resumes where it
+    stopped.
+    :param timestep: "5m" or "1h"
+    :param max_buckets: most buckets fetched by this run
+    :param now: unix time -> default current time
+    :return: Dict -> {"buckets": buckets fetched, "rows": rows stored, "watermark": newest bucket ingested}
+    """
+    step = TIMESTEPS[timestep]
+    latest_bucket = latest_settled_bucket(step=step, now=int(now or time.time()))
+
+    with SessionLocal() as db:
+        item_ids = get_tracked_item_ids(db=db)
+        watermark = get_price_bucket_watermark(db=db, timestep=step)
+        if not item_ids:
+            return {"buckets": 0, "rows": 0, "watermark": watermark}
+
+        if watermark is None:
+            first_bucket = latest_bucket - (INITIAL_BUCKETS[timestep] - 1) * step
+        else:
+            first_bucket = watermark + step
+
+        buckets = range(first_bucket, latest_bucket + step, step)[:max_buckets]
+        rows_stored = 0
+        for bucket_ts in buckets:
+            response = request_prices_api(f"/{timestep}", params={"timestamp": bucket_ts}).json()
+            rows = [
+                price_bucket_row(item_id=int(item_id), step=step, bucket_ts=bucket_ts, prices=prices)
+                for item_id, prices in response["data"].items()
+                if int(item_id) in item_ids
+            ]
+            rows_stored += bulk_create_item_price_buckets(db=db, rows=rows)
+            set_price_bucket_watermark(db=db, timestep=step, bucket_ts=bucket_ts)
+            db.commit()
+            watermark = bucket_ts
+
+    return {"buckets": len(buckets), "rows": rows_stored, "watermark": watermark}
+
+
+def backfill_item_timeseries(
+        timestep: str = "1h",
+        max_items: int = MAX_TIMESERIES_ITEMS_PER_RUN,
+        now: int = None,
+):
+    """
+    Fetches /timeseries history for tracked items that have no buckets of timestep yet -> items of a newly imported
+    bank get their recent history in one request each instead of waiting for /5m or /1h to build it up.
+    :param timestep: "5m", "1h", "6h" or "24h"
+    :param max_items: most items fetched by this run, the rest are picked up by the next one
+    :param now: unix time -> default current time
+    :return: Dict -> {"items": items fetched, "rows": rows stored}
+    """
+    step = TIMESTEPS[timestep]
+    latest_bucket = latest_settled_bucket(step=step, now=int(now or time.time()))
+
+    with SessionLocal() as db:
+        missing_item_ids = get_tracked_item_ids(db=db) - get_item_ids_with_price_buckets(db=db, timestep=step)
+        missing_item_ids = sorted(missing_item_ids)[:max_items]
+
+        rows_stored = 0
+        for item_id in missing_item_ids:
+            response = request_prices_api("/timeseries", params={"id": item_id, "timestep": timestep}).json()
+            rows = [
+                price_bucket_row(item_id=item_id, step=step, bucket_ts=point["timestamp"], prices=point)
+                for point in response["data"]
+                if point["timestamp"] <= latest_bucket
+            ]
+            rows_stored += bulk_create_item_price_buckets(db=db, rows=rows)
+            db.commit()
+
+    return {"items": len(missing_item_ids), "rows": rows_stored}
+
+
+def ingest_price_history(now: int = None):
+    """
+    Brings the price bucket time series up to date -> /timeseries history for newly tracked items first, then the
+    /5m and /1h buckets missing since the last run.
+    :param now: unix time -> default current time
+    :return: Dict -> {timestep: {"items_backfilled", "buckets", "rows", "watermark"}}
+    """
+    now = int(now or time.time())
+    report = {}
+    for timestep in BULK_TIMESTEPS:
+        backfill = backfill_item_timeseries(timestep=timestep, now=now)
+        ingest = ingest_price_buckets(timestep=timestep, now=now)
+        report[timestep] = {
+            "items_backfilled": backfill["items"],
+            "buckets": ingest["buckets"],
+            "rows": backfill["rows"] + ingest["rows"],
+            "watermark": ingest["watermark"],
+        }
+
+    return report
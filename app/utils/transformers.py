@@ -2,7 +2,8 @@ import pandas as pd
 
 
 def to_dataframe(entries, column_order: list = None):
-    data = [entry.__dict__ for entry in entries]
+    # ORM objects carry their columns in __dict__, query rows (price snapshots) expose them through _asdict
+    data = [entry._asdict() if hasattr(entry, "_asdict") else dict(entry.__dict__) for entry in entries]
 
     for d in data:
         d.pop("_sa_instance_state", None)
@@ -0,0 +1,331 @@
+from datetime import datetime, timezone
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from app.crud.database import read_bank_holdings, read_price_run_times, read_item_prices_of_runs
+from app.crud.database import get_latest_price_run_ids
+from app.database import SessionLocal
+from app.utils.price_providers import PriceProvider, LIVE_PRICES
+from app.utils.price_resolver import PriceResolver, get_price_resolver
+from app.utils.prices import PriceTable
+
+# Gathered (valuation, bank item) cells per chunk -> bounds memory when thousands of price runs are valued at once
+CHUNK_CELLS = 2_000_000
+
+# Price row of a bank without prices, e.g. a bank that has no snapshot yet
+NO_PRICES = -1
+
+
+class BankHoldings:
+    """
+    Items of many banks as flat arrays, banks back to back -> the items of bank_ids[b] are offsets[b]:offsets[b + 1].
+    """
+
+    def __init__(self, bank_ids, offsets, bank_item_ids, item_ids, names, quantities):
+        self.bank_ids = np.asarray(bank_ids, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.bank_item_ids = np.asarray(bank_item_ids, dtype=np.int64)
+        self.item_ids = np.asarray(item_ids, dtype=np.int64)
+        self.names = np.asarray(names, dtype=object)
+        self.quantities = np.asarray(quantities, dtype=np.int64)
+
+    @classmethod
+    def from_rows(cls, rows, bank_ids=None):
+        """
+        :param rows: (bank_id, bank_item_id, item_id, name, quantity) rows, read_bank_holdings
+        :param bank_ids: banks in the order they are valued, banks without rows stay empty -> default banks of rows
+        """
+        rows = list(rows)
+        row_banks = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        if bank_ids is None:
+            bank_ids = np.unique(row_banks)
+        bank_ids = np.asarray(bank_ids, dtype=np.int64)
+
+        position = {bank_id: index for index, bank_id in enumerate(bank_ids.tolist())}
+        bank_of_row = np.fromiter((position[bank_id] for bank_id in row_banks.tolist()), dtype=np.int64,
+                                  count=len(rows))
+        order = np.argsort(bank_of_row, kind="stable")
+        offsets = np.zeros(len(bank_ids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(bank_of_row, minlength=len(bank_ids)))
+
+        columns = list(zip(*rows)) if rows else [[]] * 5
+        return cls(
+            bank_ids=bank_ids,
+            offsets=offsets,
+            bank_item_ids=np.asarray(columns[1], dtype=np.int64)[order],
+            item_ids=np.asarray(columns[2], dtype=np.int64)[order],
+            names=np.asarray(columns[3], dtype=object)[order],
+            quantities=np.asarray(columns[4], dtype=np.int64)[order],
+        )
+
+    @classmethod
+    def load(cls, db: Session, bank_ids=None):
+        """Holdings of bank_ids, default every bank, read with one query."""
+        return cls.from_rows(rows=read_bank_holdings(db=db, bank_ids=bank_ids), bank_ids=bank_ids)
+
+    def bank_of_item(self):
+        """:return: np.ndarray -> index into bank_ids of every item"""
+        return np.repeat(np.arange(len(self.bank_ids)), np.diff(self.offsets))
+
+    def bank_index(self, bank_id: int) -> int:
+        return int(np.flatnonzero(self.bank_ids == bank_id)[0])
+
+
+class PriceMatrix:
+    """
+    Unit prices of many price fetches -> row r holds the resolved prices at timestamps[r] of the sorted item_ids.
+    high and low are 0 where priced is False.
+    """
+
+    def __init__(self, item_ids, high, low, priced, timestamps, run_ids=None):
+        self.item_ids = np.asarray(item_ids, dtype=np.int64)
+        self.high = np.asarray(high, dtype=np.int64)
+        self.low = np.asarray(low, dtype=np.int64)
+        self.priced = np.asarray(priced, dtype=bool)
+        self.timestamps = list(timestamps)
+        self.run_ids = run_ids
+
+    @classmethod
+    def from_price_table(cls, price_table: PriceTable, item_ids, resolver: PriceResolver = None):
+        """One row -> item_ids resolved against a price fetch through the compiled price rules."""
+        item_ids = np.unique(np.asarray(item_ids, dtype=np.int64))
+        resolver = resolver or get_price_resolver()
+        high, low, priced = resolver.resolve(price_table=price_table, item_ids=item_ids)
+
+        return cls(
+            item_ids=item_ids,
+            high=high[np.newaxis],
+            low=low[np.newaxis],
+            priced=priced[np.newaxis],
+            timestamps=[datetime.fromtimestamp(price_table.fetched_at, timezone.utc)],
+        )
+
+    @classmethod
+    def from_runs(cls, db: Session, runs):
+        """
+        One row per stored PriceRun -> the ItemPrices of every run pivoted into a matrix. Run prices are already
+        resolved, items a run holds no price for are unpriced in its row.
+        :param runs: List of (run_id, fetched_at), read_price_run_times
+        """
+        run_ids = np.fromiter((run_id for run_id, _ in runs), dtype=np.int64, count=len(runs))
+        rows = read_item_prices_of_runs(db=db, run_ids=run_ids.tolist())
+        # fromiter over the flattened rows, np.array on a list of Rows converts every Row element by element
+        prices = np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=4 * len(rows)).reshape(-1, 4)
+
+        item_ids = np.unique(prices[:, 1])
+        run_order = np.argsort(run_ids)
+        rows = run_order[np.searchsorted(run_ids, prices[:, 0], sorter=run_order)]
+        columns = np.searchsorted(item_ids, prices[:, 1])
+
+        high = np.zeros((len(run_ids), len(item_ids)), dtype=np.int64)
+        low = np.zeros_like(high)
+        priced = np.zeros(high.shape, dtype=bool)
+        high[rows, columns] = prices[:, 2]
+        low[rows, columns] = prices[:, 3]
+        priced[rows, columns] = True
+
+        return cls(
+            item_ids=item_ids,
+            high=high,
+            low=low,
+            priced=priced,
+            timestamps=[fetched_at for _, fetched_at in runs],
+            run_ids=run_ids,
+        )
+
+    def columns(self, item_ids):
+        """:return: Tuple of np.ndarray -> (column of every item, found), column is 0 where found is False"""
+        item_ids = np.asarray(item_ids, dtype=np.int64)
+        columns = np.searchsorted(self.item_ids, item_ids)
+        in_range = columns < len(self.item_ids)
+        columns = np.where(in_range, columns, 0)
+        found = in_range & (self.item_ids[columns] == item_ids if len(self.item_ids) else False)
+        return columns, found
+
+
+class BankValuations:
+    """
+    Banks valued in one batched pass -> totals are (valuations, banks) arrays, valuation k values bank b at price
+    row price_rows[k, b].
+    """
+
+    def __init__(self, holdings: BankHoldings, prices: PriceMatrix, price_rows, low_total, high_total, item_count):
+        self.holdings = holdings
+        self.prices = prices
+        self.price_rows = price_rows
+        self.low_total = low_total
+        self.high_total = high_total
+        self.item_count = item_count
+
+    @property
+    def mean_total(self):
+        return (self.low_total + self.high_total) / 2
+
+    def bank_totals(self, bank_id: int, valuation: int = 0):
+        """:return: Tuple -> (low, mean, high) totals of one bank"""
+        bank = self.holdings.bank_index(bank_id)
+        return (int(self.low_total[valuation, bank]), float(self.mean_total[valuation, bank]),
+                int(self.high_total[valuation, bank]))
+
+    def items(self, bank_id: int, valuation: int = 0):
+        """
+        :return: pd.DataFrame -> bank_item_id, item_id, name, quantity, low_value, mean_value, high_value of every
+                 priced item of one bank, the same values as its price snapshots
+        """
+        bank = self.holdings.bank_index(bank_id)
+        start, end = self.holdings.offsets[bank], self.holdings.offsets[bank + 1]
+        price_rows = np.full(end - start, self.price_rows[valuation, bank])
+        high, low, priced = gather_item_values(
+            holdings=self.holdings, prices=self.prices, price_rows=price_rows[np.newaxis], items=slice(start, end),
+        )
+        priced = priced[0]
+
+        return pd.DataFrame({
+            "bank_item_id": self.holdings.bank_item_ids[start:end][priced],
+            "item_id": self.holdings.item_ids[start:end][priced],
+            "name": self.holdings.names[start:end][priced],
+            "quantity": self.holdings.quantities[start:end][priced],
+            "low_value": low[0][priced],
+            "mean_value": (high[0][priced] + low[0][priced]) / 2,
+            "high_value": high[0][priced],
+        })
+
+    def to_dataframe(self):
+        """:return: pd.DataFrame -> one row per valuation and bank, bank_id, timestamp, totals and item_count"""
+        valuations, banks = self.low_total.shape
+        # Trailing None -> NO_PRICES (-1) rows index it
+        timestamps = np.asarray(self.prices.timestamps + [None], dtype=object)
+        return pd.DataFrame({
+            "bank_id": np.tile(self.holdings.bank_ids, valuations),
+            "timestamp": timestamps[self.price_rows.ravel()],
+            "low_value_total": self.low_total.ravel(),
+            "mean_value_total": self.mean_total.ravel(),
+            "high_value_total": self.high_total.ravel(),
+            "item_count": self.item_count.ravel(),
+        })
+
+
+def gather_item_values(holdings: BankHoldings, prices: PriceMatrix, price_rows, items=slice(None)):
+    """
+    quantity x unit price of holdings items -> price_rows[k, i] is the price row item i is valued at.
+    :return: Tuple of np.ndarray -> (high, low, priced) shaped like price_rows, values are 0 where priced is False
+    """
+    quantities = holdings.quantities[items]
+    columns, found = prices.columns(holdings.item_ids[items])
+
+    if not prices.high.size:
+        zeros = np.zeros(price_rows.shape, dtype=np.int64)
+        return zeros, zeros.copy(), np.zeros(price_rows.shape, dtype=bool)
+
+    has_prices = price_rows != NO_PRICES
+    rows = np.where(has_prices, price_rows, 0)
+    priced = prices.priced[rows, columns] & found & has_prices
+    high = np.where(priced, prices.high[rows, columns], 0) * quantities
+    low = np.where(priced, prices.low[rows, columns], 0) * quantities
+    return high, low, priced
+
+
+def segment_sums(values, offsets):
+    """:return: np.ndarray -> (rows, banks) sums of values[:, offsets[b]:offsets[b + 1]], 0 for empty banks"""
+    cumulative = np.zeros((values.shape[0], values.shape[1] + 1), dtype=values.dtype)
+    np.cumsum(values, axis=1, out=cumulative[:, 1:])
+    return cumulative[:, offsets[1:]] - cumulative[:, offsets[:-1]]
+
+
+def value_banks(holdings: BankHoldings, prices: PriceMatrix, price_rows=None) -> BankValuations:
+    """
+    Values many banks against many price rows at once, every item of every bank is one gather from the matrix.
+    :param holdings: BankHoldings
+    :param prices: PriceMatrix
+    :param price_rows: (valuations, banks) price row of each bank in each valuation, NO_PRICES for none, a (banks,)
+                       array is a single valuation -> default every bank at every price row
+    :return: BankValuations
+    """
+    bank_count = len(holdings.bank_ids)
+    if price_rows is None:
+        price_rows = np.broadcast_to(np.arange(len(prices.timestamps))[:, np.newaxis],
+                                     (len(prices.timestamps), bank_count))
+    price_rows = np.atleast_2d(np.asarray(price_rows, dtype=np.int64))
+
+    valuations = price_rows.shape[0]
+    low_total = np.zeros((valuations, bank_count), dtype=np.int64)
+    high_total = np.zeros_like(low_total)
+    item_count = np.zeros_like(low_total)
+
+    bank_of_item = holdings.bank_of_item()
+    chunk = max(1, CHUNK_CELLS // max(len(bank_of_item), 1))
+    for start in range(0, valuations, chunk):
+        end = min(start + chunk, valuations)
+        high, low, priced = gather_item_values(
+            holdings=holdings, prices=prices, price_rows=price_rows[start:end][:, bank_of_item],
+        )
+        high_total[start:end] = segment_sums(high, holdings.offsets)
+        low_total[start:end] = segment_sums(low, holdings.offsets)
+        item_count[start:end] = segment_sums(priced.astype(np.int64), holdings.offsets)
+
+    return BankValuations(
+        holdings=holdings,
+        prices=prices,
+        price_rows=price_rows,
+        low_total=low_total,
+        high_total=high_total,
+        item_count=item_count,
+    )
+
+
+def value_all_banks(at: datetime = None, bank_ids: list = None, provider: PriceProvider = LIVE_PRICES):
+    """
+    Values every bank, or bank_ids, in one batched pass. Current and historical valuations share the code path, only
+    the PriceMatrix differs.
+    :param at: None -> current prices of provider resolved through the price rules, a UTC datetime -> the current
+               holdings revalued at the latest stored PriceRun fetched at or before it
+    :param bank_ids: banks to value -> default every bank
+    :param provider: PriceProvider of the current prices
+    :return: BankValuations with one valuation
+    """
+    with SessionLocal() as db:
+        holdings = BankHoldings.load(db=db, bank_ids=bank_ids)
+
+        if at is None:
+            prices = PriceMatrix.from_price_table(price_table=provider.price_table(), item_ids=holdings.item_ids)
+        else:
+            runs = read_price_run_times(db=db, until=at)
+            if not runs:
+                raise ValueError(f"No price run fetched at or before {at}")
+            prices = PriceMatrix.from_runs(db=db, runs=runs[-1:])
+
+    return value_banks(holdings=holdings, prices=prices)
+
+
+def value_price_history(bank_ids: list = None, since: datetime = None, until: datetime = None):
+    """
+    Revalues the current holdings of every bank, or bank_ids, at every stored PriceRun between since and until.
+    :return: BankValuations with one valuation per PriceRun, oldest first
+    """
+    with SessionLocal() as db:
+        holdings = BankHoldings.load(db=db, bank_ids=bank_ids)
+        prices = PriceMatrix.from_runs(db=db, runs=read_price_run_times(db=db, since=since, until=until))
+
+    return value_banks(holdings=holdings, prices=prices)
+
+
+def value_latest_snapshots(bank_ids: list):
+    """
+    Values each bank at the PriceRun of its own latest snapshot -> matches its materialized BankValuation while its
+    items are unchanged. Banks without a snapshot value at 0.
+    :return: BankValuations with one valuation
+    """
+    # The same bank selected twice is valued once
+    bank_ids = list(dict.fromkeys(bank_ids))
+    with SessionLocal() as db:
+        holdings = BankHoldings.load(db=db, bank_ids=bank_ids)
+        latest_run_ids = get_latest_price_run_ids(db=db, bank_ids=bank_ids)
+        runs = read_price_run_times(db=db, run_ids=list(set(latest_run_ids.values())))
+        prices = PriceMatrix.from_runs(db=db, runs=runs)
+
+    row_of_run = {run_id: row for row, (run_id, _) in enumerate(runs)}
+    price_rows = [row_of_run.get(latest_run_ids.get(bank_id), NO_PRICES) for bank_id in bank_ids]
+    return value_banks(holdings=holdings, prices=prices, price_rows=price_rows)
@@ -0,0 +1,229 @@
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from app.crud.database import get_latest_price_run_ids, read_price_run_times, get_latest_snapshot_time
+from app.crud.database import get_bank_id_by_name, get_latest_bank_version, read_all_items_by_bank_id
+from app.crud.database import bulk_create_bank_items, retire_bank_items, create_bank_version
+from app.crud.database import bulk_create_bank_version_items, materialize_bank_version, read_changed_item_ids
+from app.database import SessionLocal
+from app.models.db_entry import Bank
+from app.utils.file_io import bank_content_hashes
+from app.utils.price_providers import PriceProvider, LIVE_PRICES
+from app.utils.price_resolver import get_price_resolver
+from app.utils.snapshot import build_bank_items, enter_price_run, resolve_bank_item_prices, remaining_cooldown
+from app.utils.valuation import PriceMatrix
+
+
+def aggregate_items(items):
+    """
+    One entry per item id, versions are keyed by item -> quantities of an item listed more than once are added up.
+    :param items: iterable of dicts -> {"item_id", "item_name", "quantity"}, parse_bank_tsv rows
+    :return: Dict -> {item_id: {"item_id", "name", "quantity"}}
+    """
+    aggregated = {}
+    for item in items:
+        item_id = int(item["item_id"])
+        if item_id in aggregated:
+            aggregated[item_id]["quantity"] += item.get("quantity", 1)
+        else:
+            aggregated[item_id] = {"item_id": item_id, "name": item["item_name"], "quantity": item.get("quantity", 1)}
+
+    return aggregated
+
+
+def version_delta(parent: dict, items: dict):
+    """
+    :param parent: aggregate_items of the parent version
+    :param items: aggregate_items of the new export
+    :return: List of dicts -> {"item_id", "name", "quantity"} of added and changed items at their new quantity and
+             removed items at quantity 0
+    """
+    delta = [item for item_id, item in items.items() if parent.get(item_id, {}).get("quantity") != item["quantity"]]
+    delta += [{**item, "quantity": 0} for item_id, item in parent.items() if item_id not in items]
+    return sorted(delta, key=lambda item: item["item_id"])
+
+
+def ensure_base_version(db: Session, bank: Bank):
+    """
+    Version 1 of a bank imported before it was versioned -> its current BankItems as the full item set.
+    :return: BankVersion -> latest version of the bank
+    """
+    latest_version = get_latest_bank_version(db=db, bank_id=bank.id)
+    if latest_version:
+        return latest_version
+
+    items = aggregate_items(
+        {"item_id": item.item_id, "item_name": item.name, "quantity": item.quantity}
+        for item in read_all_items_by_bank_id(db=db, bank_id=bank.id)
+    )
+    bulk_create_bank_version_items(db=db, bank_id=bank.id, version=1, items=list(items.values()))
+
+    return create_bank_version(
+        db=db,
+        bank_id=bank.id,
+        version=1,
+        parent_id=None,
+        created_at=bank.created_at,
+        content_hash=bank.content_hash,
+        item_count=len(items),
+        change_count=len(items),
+    )
+
+
+def read_version_items(db: Session, bank_id: int, version: int):
+    """:return: Dict -> aggregate_items of a materialized version"""
+    return {
+        item_id: {"item_id": item_id, "name": name, "quantity": quantity}
+        for item_id, name, quantity in materialize_bank_version(db=db, bank_id=bank_id, version=version)
+    }
+
+
+def enter_bank_version(db: Session, bank_name: str, items, provider: PriceProvider = LIVE_PRICES):
+    """
+    Enters a new export of an existing bank as its next version, storing only the items added, removed or changed
+    since the latest version. BankItems of changed and removed items are retired at the new version and the new
+    quantities added as rows held from it, so snapshots taken before keep their value while refreshes value the new
+    item set. The bank is valued against the provider's prices as of the new version once its COOLDOWN has passed,
+    within it the version is only stored and valued by the next refresh.
+    :param db: Session
+    :param bank_name: Name of bank within DB
+    :param items: iterable of dicts -> {"item_id", "item_name", "quantity"}, parse_bank_tsv rows
+    :param provider: PriceProvider the prices and snapshot time come from -> default live wiki api prices
+    :return: Dict -> {"version", "added", "removed", "changed", "remaining_cooldown"}, remaining_cooldown None if
+             the version was valued, None if nothing changed since the latest version
+    """
+    bank_id = get_bank_id_by_name(db=db, bank_name=bank_name)
+    if bank_id is None:
+        raise ValueError(f"No bank found with name '{bank_name}'")
+
+    bank = db.get(Bank, bank_id)
+    latest_version = ensure_base_version(db=db, bank=bank)
+    parent = read_version_items(db=db, bank_id=bank.id, version=latest_version.version)
+    new_items = aggregate_items(items)
+
+    delta = version_delta(parent=parent, items=new_items)
+    if not delta:
+        db.commit()
+        return None
+
+    snapshot_time = provider.now()
+    remaining = remaining_cooldown(
+        last_snapshot_time=get_latest_snapshot_time(db=db, passed_bank_id=bank.id),
+        snapshot_time=snapshot_time,
+    )
+    # Prices only mark tradeable items when the version is not valued -> cached ones do
+    price_table = provider.price_table() if remaining else provider.snapshot_price_table()
+    resolver = get_price_resolver()
+
+    content_hash, item_set_hash = bank_content_hashes(new_items.values())
+    bank_version = create_bank_version(
+        db=db,
+        bank_id=bank.id,
+        version=latest_version.version + 1,
+        parent_id=latest_version.id,
+        created_at=snapshot_time,
+        content_hash=content_hash,
+        item_count=len(new_items),
+        change_count=len(delta),
+    )
+    bulk_create_bank_version_items(db=db, bank_id=bank.id, version=bank_version.version, items=delta)
+
+    # Rows of changed and removed items end at the new version, earlier price runs still read them
+    retire_bank_items(db=db, bank_id=bank.id, item_ids=[item["item_id"] for item in delta],
+                      version=bank_version.version)
+    bulk_create_bank_items(
+        db=db,
+        bank_id=bank.id,
+        items=[
+            {**bank_item, "since_version": bank_version.version}
+            for bank_item in build_bank_items(
+                items=[{**item, "item_name": item["name"]} for item in delta if item["quantity"] > 0],
+                price_table=price_table,
+                resolver=resolver,
+            )
+        ],
+    )
+    bank.content_hash, bank.item_set_hash = content_hash, item_set_hash
+
+    if not remaining:
+        bank_items = read_all_items_by_bank_id(db=db, bank_id=bank.id)
+        enter_price_run(
+            db=db,
+            bank_id=bank.id,
+            version=bank_version.version,
+            snapshot_time=snapshot_time,
+            fetched_at=price_table.fetched_at,
+            unit_prices=resolve_bank_item_prices(items=bank_items, price_table=price_table, resolver=resolver),
+            bank_items=[{"item_id": item.item_id, "quantity": item.quantity} for item in bank_items],
+        )
+
+    db.commit()
+
+    return {
+        "version": bank_version.version,
+        "added": sum(1 for item in delta if item["item_id"] not in parent),
+        "removed": sum(1 for item in delta if item["quantity"] == 0),
+        "changed": sum(1 for item in delta if item["item_id"] in parent and item["quantity"] > 0),
+        "remaining_cooldown": remaining,
+    }
+
+
+def diff_bank_versions(db: Session, bank_id: int, version_a: int, version_b: int):
+    """
+    Items that differ between two versions of a bank. Only items with a delta stored between the two versions can
+    differ, so only those are materialized.
+    :return: List of dicts -> {"item_id", "name", "quantity_a", "quantity_b"} ordered by item_id, quantity 0 where a
+             version does not hold the item
+    """
+    low_version, high_version = sorted((version_a, version_b))
+    changed_item_ids = list(read_changed_item_ids(
+        db=db,
+        bank_id=bank_id,
+        after_version=low_version,
+        until_version=high_version,
+    ))
+
+    items_a = {
+        item_id: (name, quantity) for item_id, name, quantity in
+        materialize_bank_version(db=db, bank_id=bank_id, version=version_a, item_ids=changed_item_ids)
+    }
+    items_b = {
+        item_id: (name, quantity) for item_id, name, quantity in
+        materialize_bank_version(db=db, bank_id=bank_id, version=version_b, item_ids=changed_item_ids)
+    }
+
+    diff = []
+    for item_id in sorted(set(items_a) | set(items_b)):
+        name_a, quantity_a = items_a.get(item_id, (None, 0))
+        name_b, quantity_b = items_b.get(item_id, (None, 0))
+        if quantity_a != quantity_b:
+            diff.append({"item_id": item_id, "name": name_b or name_a, "quantity_a": quantity_a,
+                         "quantity_b": quantity_b})
+
+    return diff
+
+
+def value_version_diff(bank_id: int, version_a: int, version_b: int):
+    """
+    diff_bank_versions valued at the prices of the bank's latest snapshot.
+    :return: pd.DataFrame -> item_id, name, quantity_a, quantity_b, quantity_diff and mean_value_diff (b - a), the
+             value is NaN for items the latest snapshot holds no price for
+    """
+    with SessionLocal() as db:
+        diff = diff_bank_versions(db=db, bank_id=bank_id, version_a=version_a, version_b=version_b)
+        latest_run_ids = get_latest_price_run_ids(db=db, bank_ids=[bank_id])
+        runs = read_price_run_times(db=db, run_ids=list(latest_run_ids.values()))
+        prices = PriceMatrix.from_runs(db=db, runs=runs) if runs else None
+
+    df = pd.DataFrame(diff, columns=["item_id", "name", "quantity_a", "quantity_b"])
+    df["quantity_diff"] = df["quantity_b"] - df["quantity_a"]
+
+    mean_prices = np.full(len(df), np.nan)
+    if prices is not None and len(prices.item_ids):
+        columns, found = prices.columns(df["item_id"].to_numpy())
+        priced = found & prices.priced[0, columns]
+        mean_prices[priced] = (prices.high[0, columns[priced]] + prices.low[0, columns[priced]]) / 2
+
+    df["mean_value_diff"] = df["quantity_diff"] * mean_prices
+    return df
@@ -0,0 +1,208 @@
+"""
+Benchmark -> showing one page of a bank's items. The old browser read every BankItem of the bank, built a DataFrame
+and styled all of it, read_bank_items_page filters, sorts and keyset paginates in SQL. Times the first, a middle and
+the last page against the full load and OFFSET pages, with the total counted once per filter set the way the browser
+caches it. Fails if the last page is not read faster by keyset than by OFFSET. Checks that walking every page in
+every sort order returns the same items as sorting the full bank and that pages are read from the (bank_id, sort
+column) indexes.
+
+Runs in a temporary working directory so Bank_Data.db of the app is left alone.
+Run from the repo root:
+    python -m benchmarks.bank_item_pages [--banks 20] [--items 20000] [--page-size 50]
+"""
+import argparse
+import time
+
+import numpy as np
+from sqlalchemy import insert, text
+
+from app import database
+from app.crud.database import create_bank, read_all_items_by_bank_id, read_bank_items_page, count_bank_items
+from app.crud.database import BANK_ITEM_SORT_COLUMNS
+from app.models.db_entry import BankItem
+from app.utils.transformers import to_dataframe, add_style_to_df
+from benchmarks.workdir import temporary_workdir
+
+NAMES = ["Abyssal", "Dragon", "Rune", "Adamant", "Mithril", "Bronze", "Iron", "Steel", "Black", "Granite"]
+
+
+def populate(args):
+    """:return: Int -> id of the bank the pages are read from, the others only grow bank_items around it"""
+    rng = np.random.default_rng(13)
+    with database.SessionLocal() as db:
+        for bank_number in range(args.banks):
+            bank = create_bank(db=db, name=f"bank_{bank_number}", created_at=None)
+            item_ids = rng.choice(np.arange(1, 4 * args.items), size=args.items, replace=False)
+            db.connection().execute(insert(BankItem), [
+                {
+                    "bank_id": bank.id,
+                    "item_id": int(item_id),
+                    "name": f"{NAMES[item_id % len(NAMES)]} item {item_id}",
+                    # Repeated quantities -> ties are broken by id
+                    "quantity": int(rng.integers(1, 50)),
+                    "is_tradeable": bool(item_id % 3),
+                    "uncharged_id": int(item_id + 1) if item_id % 7 == 0 else None,
+                    "has_ornament_kit_equipped": item_id % 11 == 0,
+                }
+                for item_id in item_ids.tolist()
+            ])
+        db.commit()
+
+    return 1
+
+
+def full_load(bank_id: int):
+    """The old browser -> every item of the bank read, framed and styled"""
+    with database.SessionLocal() as db:
+        df = to_dataframe(entries=read_all_items_by_bank_id(db=db, bank_id=bank_id))
+    return add_style_to_df(df=df).to_html()
+
+
+def keyset_items(bank_id: int, after, page_size: int, total: int, **filters):
+    with database.SessionLocal() as db:
+        items, _, _ = read_bank_items_page(db=db, bank_id=bank_id, after=after, page_size=page_size, total=total,
+                                           **filters)
+        return to_dataframe(entries=items)
+
+
+def offset_items(bank_id: int, offset: int, page_size: int):
+    with database.SessionLocal() as db:
+        items = (
+            db.query(BankItem).filter(BankItem.bank_id == bank_id)
+            .order_by(BankItem.name, BankItem.id).offset(offset).limit(page_size).all()
+        )
+        return to_dataframe(entries=items)
+
+
+def keyset_page(bank_id: int, after, page_size: int, total: int, **filters):
+    add_style_to_df(df=keyset_items(bank_id=bank_id, after=after, page_size=page_size, total=total,
+                                    **filters)).to_html()
+
+
+def offset_page(bank_id: int, offset: int, page_size: int):
+    add_style_to_df(df=offset_items(bank_id=bank_id, offset=offset, page_size=page_size)).to_html()
+
+
+def walk_pages(bank_id: int, page_size: int, **query):
+    """:return: Tuple -> (ids of every page in order, total counted by the first page and reused by the others)"""
+    ids, after, total = [], None, None
+    with database.SessionLocal() as db:
+        while True:
+            items, total, after = read_bank_items_page(db=db, bank_id=bank_id, after=after, page_size=page_size,
+                                                       total=total, **query)
+            ids += [item.id for item in items]
+            if after is None:
+                return ids, total
+
+
+def timed(func, repeat: int = 5):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return result, (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--banks", type=int, default=20)
+    parser.add_argument("--items", type=int, default=20000)
+    parser.add_argument("--page-size", type=int, default=50)
+    args = parser.parse_args()
+
+    with temporary_workdir():
+        database.init_db()
+        bank_id = populate(args)
+
+        with database.SessionLocal() as db:
+            full = to_dataframe(entries=read_all_items_by_bank_id(db=db, bank_id=bank_id))
+
+        # Every page of every sort order and filter matches the full bank sorted and filtered in pandas
+        filter_cases = [
+            {},
+            {"is_tradeable": True, "has_uncharged_id": False},
+            {"has_ornament_kit_equipped": True, "name_prefix": "drag"},
+            {"name_prefix": "100%_"},
+        ]
+        for filters in filter_cases:
+            expected = full
+            if "is_tradeable" in filters:
+                expected = expected[expected["is_tradeable"] == filters["is_tradeable"]]
+            if "has_uncharged_id" in filters:
+                expected = expected[expected["uncharged_id"].notna() == filters["has_uncharged_id"]]
+            if "has_ornament_kit_equipped" in filters:
+                expected = expected[expected["has_ornament_kit_equipped"] == filters["has_ornament_kit_equipped"]]
+            if "name_prefix" in filters:
+                expected = expected[expected["name"].str.lower().str.startswith(filters["name_prefix"].lower())]
+
+            for sort in BANK_ITEM_SORT_COLUMNS:
+                for descending in (False, True):
+                    ids, total = walk_pages(bank_id=bank_id, page_size=args.page_size * 7, sort=sort,
+                                            descending=descending, **filters)
+                    expected_ids = expected.sort_values([sort, "id"], ascending=not descending)["id"].tolist()
+                    assert total == len(expected), (filters, sort, total, len(expected))
+                    assert ids == expected_ids, (filters, sort, descending)
+        print("every page of every sort order and filter matches the bank sorted in pandas")
+
+        # Pages come straight off the (bank_id, sort column) index -> no temp b-tree sorting the whole bank
+        with database.engine.connect() as connection:
+            for sort in BANK_ITEM_SORT_COLUMNS:
+                plan = " | ".join(row[-1] for row in connection.execute(text(
+                    f"EXPLAIN QUERY PLAN SELECT * FROM bank_items WHERE bank_id = 1 AND ({sort}, id) > ('x', 0) "
+                    f"ORDER BY {sort}, id LIMIT 51"
+                )))
+                assert f"ix_bank_items_bank_id_{sort}" in plan and "TEMP B-TREE" not in plan, plan
+                print(f"sort by {sort}: {plan}")
+
+        last_page_key = None
+        with database.SessionLocal() as db:
+            ids, _ = walk_pages(bank_id=bank_id, page_size=args.page_size)
+            middle_item = db.get(BankItem, ids[len(ids) // 2 - 1])
+            middle_key = (middle_item.name, middle_item.id)
+            last_item = db.get(BankItem, ids[-args.page_size - 1])
+            last_page_key = (last_item.name, last_item.id)
+
+        def count(**filters):
+            with database.SessionLocal() as db:
+                return count_bank_items(db=db, bank_id=bank_id, **filters)
+
+        total = count()
+        prefix_filters = {"is_tradeable": True, "name_prefix": "rune"}
+        prefix_total = count(**prefix_filters)
+        middle_offset, last_offset = len(ids) // 2, len(ids) - args.page_size
+        timings = {
+            "full load, framed and styled": timed(lambda: full_load(bank_id=bank_id))[1],
+            "count, once per filter set": timed(count)[1],
+            "keyset page, first": timed(lambda: keyset_page(bank_id=bank_id, after=None,
+                                                            page_size=args.page_size, total=total))[1],
+            "keyset page, middle": timed(lambda: keyset_page(bank_id=bank_id, after=middle_key,
+                                                             page_size=args.page_size, total=total))[1],
+            "keyset page, last": timed(lambda: keyset_page(bank_id=bank_id, after=last_page_key,
+                                                           page_size=args.page_size, total=total))[1],
+            "keyset page, tradeable + prefix": timed(lambda: keyset_page(
+                bank_id=bank_id, after=None, page_size=args.page_size, total=prefix_total, **prefix_filters))[1],
+            "OFFSET page, middle": timed(lambda: offset_page(bank_id=bank_id, offset=middle_offset,
+                                                             page_size=args.page_size))[1],
+            "OFFSET page, last": timed(lambda: offset_page(bank_id=bank_id, offset=last_offset,
+                                                           page_size=args.page_size))[1],
+        }
+
+        print(f"\n{args.items:,} items per bank, {args.banks} banks, {args.page_size} items per page")
+        for name, seconds in timings.items():
+            print(f"{name:<34} {seconds * 1000:9.2f} ms")
+
+        # Deep pages -> OFFSET reads every skipped row, a keyset page seeks straight to its first row. Styling costs
+        # the same for both, so the win is asserted on reading the page
+        print()
+        for depth, key, offset in [("middle", middle_key, middle_offset), ("last", last_page_key, last_offset)]:
+            keyset_seconds = timed(lambda: keyset_items(bank_id=bank_id, after=key, page_size=args.page_size,
+                                                        total=total), repeat=20)[1]
+            offset_seconds = timed(lambda: offset_items(bank_id=bank_id, offset=offset, page_size=args.page_size),
+                                   repeat=20)[1]
+            print(f"{depth} page read: keyset {keyset_seconds * 1000:.2f} ms vs OFFSET {offset_seconds * 1000:.2f} ms "
+                  f"({offset_seconds / keyset_seconds:.1f}x)")
+            if depth == "last":
+                assert keyset_seconds < offset_seconds, (keyset_seconds, offset_seconds)
+
+
+if __name__ == '__main__':
+    main()
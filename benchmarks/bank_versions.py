@@ -0,0 +1,262 @@
+"""
+Benchmark -> one bank re-imported as many delta versions. Compares rows stored against a full copy per export, times
+materializing a version and diffing two versions from the deltas vs materializing both versions in full. Checks every
+materialized version and diff against the exports themselves, that BankItems follow the latest version and that
+deleting the bank clears its versions. Then checks a new version leaves the snapshots taken before it untouched, also
+for banks versioned before BankItems were kept per version once migration 8 has rebuilt their holdings, and that a
+version inside the snapshot COOLDOWN is only valued by the next refresh.
+
+Runs in a temporary working directory so Bank_Data.db of the app is left alone.
+Run from the repo root:
+    python -m benchmarks.bank_versions [--items 1500] [--versions 200] [--changes 30]
+"""
+import argparse
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import text
+
+from app import database
+from app.crud.database import materialize_bank_version, read_all_items_by_bank_id, delete_bank
+from app.crud.database import get_bank_id_by_name, query_price_snapshots
+from app.migrations import run_migrations
+from app.models.db_entry import Bank, BankItem, BankPriceRun, BankValuation, BankVersion, BankVersionItem, PriceRun
+from app.utils.price_providers import SyntheticPriceProvider
+from app.utils.snapshot import enter_new_bank, enter_all_banks_current_price
+from app.utils.versions import enter_bank_version, diff_bank_versions, value_version_diff
+from benchmarks.workdir import temporary_workdir
+
+ITEM_IDS = np.arange(1, 20001)
+
+
+def next_export(rng, export: dict, changes: int):
+    """:return: Dict -> {item_id: quantity} with changes quantities changed, changes // 4 items removed and added"""
+    export = dict(export)
+    held = np.fromiter(export, dtype=np.int64)
+    for item_id in rng.choice(held, size=changes, replace=False).tolist():
+        export[item_id] = int(rng.integers(1, 10 ** 5))
+    for item_id in rng.choice(held, size=changes // 4, replace=False).tolist():
+        export.pop(item_id, None)
+    free = np.setdiff1d(ITEM_IDS, np.fromiter(export, dtype=np.int64))
+    for item_id in rng.choice(free, size=changes // 4, replace=False).tolist():
+        export[item_id] = int(rng.integers(1, 10 ** 5))
+    return export
+
+
+def as_items(export: dict):
+    return [{"item_id": item_id, "item_name": f"Item {item_id}", "quantity": quantity}
+            for item_id, quantity in export.items()]
+
+
+def as_rows(export: dict):
+    return [(item_id, f"Item {item_id}", quantity) for item_id, quantity in sorted(export.items())]
+
+
+def timed(func, repeat: int = 5):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return result, (time.perf_counter() - start) / repeat
+
+
+def read_snapshots():
+    """:return: Dict -> {(bank name, timestamp): {item name: (quantity, mean value)}}"""
+    snapshots = defaultdict(dict)
+    with database.SessionLocal() as db:
+        rows = (query_price_snapshots(db).add_columns(Bank.name, BankItem.quantity)
+                .join(Bank, Bank.id == BankPriceRun.bank_id))
+        for row in rows:
+            snapshots[(row.name, row.timestamp)][row.item_name] = (row.quantity, row.mean_value_estimate)
+    return dict(snapshots)
+
+
+def read_valuations():
+    """:return: Dict -> {(bank name, timestamp): mean value total}"""
+    with database.SessionLocal() as db:
+        return {(name, valuation.timestamp): valuation.mean_value_total
+                for name, valuation in db.query(Bank.name, BankValuation).join(BankValuation.bank)}
+
+
+def check_earlier_snapshots():
+    """
+    Two refreshes of bank_a and bank_b sharing price runs, then a new version of bank_a -> item 1 from 10 to 1000, item
+    2 removed and item 3 added, which bank_b's runs already priced. Every earlier snapshot keeps its value.
+    """
+    provider = SyntheticPriceProvider(item_ids=ITEM_IDS[:5], ticks=4, seed=2)
+    for bank_name, export in [("bank_a", {1: 10, 2: 5}), ("bank_b", {3: 7})]:
+        with database.SessionLocal() as db:
+            enter_new_bank(db=db, items=as_items(export), bank_name=bank_name, provider=provider)
+    for _ in range(2):
+        provider.advance()
+        enter_all_banks_current_price(provider=provider)
+
+    before, valuations_before = read_snapshots(), read_valuations()
+    provider.advance()
+    with database.SessionLocal() as db:
+        assert enter_bank_version(db=db, bank_name="bank_a", items=as_items({1: 1000, 3: 4}),
+                                  provider=provider)["version"] == 2
+
+    after, valuations_after = read_snapshots(), read_valuations()
+    for key, items in before.items():
+        assert after[key] == items, (key, items, after[key])
+        assert valuations_after[key] == valuations_before[key]
+        if key[0] == "bank_a":
+            assert set(items) == {"Item 1", "Item 2"} and items["Item 1"][0] == 10, items
+    for key, items in after.items():
+        assert np.isclose(sum(value for _, value in items.values()), valuations_after[key]), key
+
+    latest = max(key for key in after if key[0] == "bank_a")
+    assert latest not in before
+    assert {name: quantity for name, (quantity, _) in after[latest].items()} == {"Item 1": 1000, "Item 3": 4}
+    return after
+
+
+def check_version_cooldown():
+    """
+    A new version inside the COOLDOWN of the bank's latest snapshot is stored without a snapshot, the next refresh
+    after the COOLDOWN values it.
+    """
+    provider = SyntheticPriceProvider(item_ids=ITEM_IDS[:5], ticks=2, seed=4)
+    with database.SessionLocal() as db:
+        enter_new_bank(db=db, items=as_items({1: 10}), bank_name="cooldown", provider=provider)
+        report = enter_bank_version(db=db, bank_name="cooldown", items=as_items({1: 20, 2: 3}), provider=provider)
+    assert report["version"] == 2 and report["remaining_cooldown"], report
+    snapshots = [items for key, items in read_snapshots().items() if key[0] == "cooldown"]
+    assert [{name: quantity for name, (quantity, _) in items.items()} for items in snapshots] == [{"Item 1": 10}]
+
+    provider.advance()
+    assert enter_all_banks_current_price(provider=provider)["cooldown"] == (True, None)
+    latest = max(key for key in read_snapshots() if key[0] == "cooldown")
+    assert {name: quantity for name, (quantity, _) in read_snapshots()[latest].items()} == {"Item 1": 20, "Item 2": 3}
+
+
+def check_legacy_holdings(expected: dict):
+    """
+    Puts the database back the way re-imports left it before BankItems were kept per version -> rows of changed items
+    deleted, every row and run at version 1. Migration 8 must rebuild the holdings every snapshot was taken with.
+    """
+    with database.engine.begin() as connection:
+        connection.execute(text("DELETE FROM bank_items WHERE until_version IS NOT NULL"))
+        connection.execute(text("UPDATE bank_items SET since_version = 1"))
+        connection.execute(text("UPDATE bank_price_runs SET version = 1"))
+        connection.exec_driver_sql("PRAGMA user_version = 7")
+
+    run_migrations(database.engine)
+    migrated = read_snapshots()
+    assert migrated == expected, set(migrated.items()) ^ set(expected.items())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=1500)
+    parser.add_argument("--versions", type=int, default=200)
+    parser.add_argument("--changes", type=int, default=30)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(8)
+    with temporary_workdir():
+        database.init_db()
+        # One price tick per export -> every version is valued at its own snapshot time
+        provider = SyntheticPriceProvider(item_ids=ITEM_IDS, ticks=args.versions + 1, seed=9)
+
+        exports = [{int(item_id): int(rng.integers(1, 10 ** 5))
+                    for item_id in rng.choice(ITEM_IDS, size=args.items, replace=False)}]
+        with database.SessionLocal() as db:
+            enter_new_bank(db=db, items=as_items(exports[0]), bank_name="versioned", provider=provider)
+
+        start = time.perf_counter()
+        for _ in range(args.versions - 1):
+            provider.advance()
+            exports.append(next_export(rng=rng, export=exports[-1], changes=args.changes))
+            with database.SessionLocal() as db:
+                report = enter_bank_version(db=db, bank_name="versioned", items=as_items(exports[-1]),
+                                            provider=provider)
+            assert report["version"] == len(exports), report
+        import_seconds = time.perf_counter() - start
+
+        with database.SessionLocal() as db:
+            bank_id = get_bank_id_by_name(db=db, bank_name="versioned")
+            # The same export again is not a new version
+            assert enter_bank_version(db=db, bank_name="versioned", items=as_items(exports[-1]),
+                                      provider=provider) is None
+
+            delta_rows = db.query(BankVersionItem).count()
+            full_rows = sum(len(export) for export in exports)
+            assert db.query(BankVersion).count() == args.versions
+
+            for version, export in enumerate(exports, start=1):
+                assert materialize_bank_version(db=db, bank_id=bank_id, version=version) == as_rows(export), version
+
+            bank_items = sorted((item.item_id, item.name, item.quantity)
+                                for item in read_all_items_by_bank_id(db=db, bank_id=bank_id))
+            assert bank_items == as_rows(exports[-1])
+
+            version_a, version_b = args.versions // 2, args.versions // 2 + 5
+            expected_diff = [
+                {"item_id": item_id, "name": f"Item {item_id}", "quantity_a": exports[version_a - 1].get(item_id, 0),
+                 "quantity_b": exports[version_b - 1].get(item_id, 0)}
+                for item_id in sorted(set(exports[version_a - 1]) | set(exports[version_b - 1]))
+                if exports[version_a - 1].get(item_id, 0) != exports[version_b - 1].get(item_id, 0)
+            ]
+            assert diff_bank_versions(db=db, bank_id=bank_id, version_a=version_a,
+                                      version_b=version_b) == expected_diff
+            assert diff_bank_versions(db=db, bank_id=bank_id, version_a=1, version_b=1) == []
+
+            _, materialize_seconds = timed(
+                lambda: materialize_bank_version(db=db, bank_id=bank_id, version=args.versions)
+            )
+            _, delta_diff_seconds = timed(
+                lambda: diff_bank_versions(db=db, bank_id=bank_id, version_a=version_a, version_b=version_b)
+            )
+
+            def full_diff():
+                items_a = {row[0]: row for row in materialize_bank_version(db=db, bank_id=bank_id, version=version_a)}
+                items_b = {row[0]: row for row in materialize_bank_version(db=db, bank_id=bank_id, version=version_b)}
+                return [item_id for item_id in items_a.keys() | items_b.keys()
+                        if items_a.get(item_id, (0, 0, 0))[2] != items_b.get(item_id, (0, 0, 0))[2]]
+
+            changed, full_diff_seconds = timed(full_diff)
+            assert len(changed) == len(expected_diff)
+
+        # Valued at the latest snapshot -> items the latest version no longer holds have no price there
+        diff_df = value_version_diff(bank_id=bank_id, version_a=version_a, version_b=version_b)
+        assert diff_df["item_id"].tolist() == [item["item_id"] for item in expected_diff]
+        held = diff_df["item_id"].isin(list(exports[-1]))
+        assert diff_df.loc[held, "mean_value_diff"].notna().all()
+
+        print(f"{args.versions} versions of {args.items} items imported in {import_seconds:.2f}s "
+              f"({import_seconds / (args.versions - 1) * 1000:.1f} ms per version)")
+        print(f"rows stored: {delta_rows:,} deltas vs {full_rows:,} full copies ({full_rows / delta_rows:.1f}x)")
+        print(f"materialize v{args.versions}: {materialize_seconds * 1000:.1f} ms")
+        print(f"diff v{version_a}..v{version_b}: {delta_diff_seconds * 1000:.1f} ms from deltas vs "
+              f"{full_diff_seconds * 1000:.1f} ms materializing both versions")
+
+        with database.SessionLocal() as db:
+            # A price run no bank is linked to was not left behind by this bank -> delete_bank must keep it
+            db.add(PriceRun(fetched_at=datetime(2000, 1, 1)))
+            db.commit()
+            bank_runs = db.query(BankPriceRun).filter(BankPriceRun.bank_id == bank_id).count()
+
+            rows_removed = delete_bank(db=db, bank_name="versioned", vacuum="incremental")
+            assert rows_removed["banks"] == 1
+            assert rows_removed["bank_versions"] == args.versions
+            assert rows_removed["bank_version_items"] == delta_rows
+            assert rows_removed["bank_price_runs"] == rows_removed["price_runs"] == bank_runs
+            assert rows_removed["bytes_reclaimed"] > 0, rows_removed
+            assert db.query(BankVersion).count() == 0 and db.query(BankVersionItem).count() == 0
+            assert db.query(PriceRun).count() == 1
+        print(f"every version, diff and BankItems match the exports, delete_bank clears the versions "
+              f"and reclaims {rows_removed['bytes_reclaimed']:,} bytes")
+
+        snapshots = check_earlier_snapshots()
+        print(f"{len(snapshots)} snapshots, the ones taken before a new version unchanged by it")
+        check_legacy_holdings(expected=snapshots)
+        print("migration 8 rebuilds the holdings of banks versioned before BankItems were kept per version")
+        check_version_cooldown()
+        print("a version inside the cooldown is stored without a snapshot and valued by the next refresh")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Benchmark -> importing a directory of Bank Memory exports, one paste-style import per file (enter_bank_tsv, prices
+fetched per bank) vs import_bank_directory parsing in this process and in a process pool. Also checks that taken
+names, names repeated within the batch and broken files are reported per file without stopping the batch.
+
+Runs in a temporary working directory so Bank_Data.db of the app is left alone.
+Run from the repo root:
+    python -m benchmarks.batch_import [--files 48] [--items 1500] [--workers 4]
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+from app import database
+from app.models.db_entry import Bank, BankItem
+from app.utils.batch_import import import_bank_directory
+from app.utils.price_providers import SyntheticPriceProvider
+from app.utils.snapshot import enter_bank_tsv
+from benchmarks.workdir import temporary_workdir
+
+ITEM_IDS = range(1, 30001)
+
+
+def write_exports(directory: str, files: int, items: int):
+    rng = np.random.default_rng(5)
+    os.makedirs(directory, exist_ok=True)
+    for file_number in range(files):
+        item_ids = rng.choice(ITEM_IDS, size=items, replace=False)
+        lines = ["Item id\tItem name\tItem quantity"]
+        lines += [f"{item_id}\tItem {item_id}\t{rng.integers(1, 10 ** 5)}" for item_id in item_ids]
+        with open(file=os.path.join(directory, f"account_{file_number:03}.txt"), mode="w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+def reset_database():
+    database.engine.dispose()
+    if os.path.exists("Bank_Data.db"):
+        os.remove("Bank_Data.db")
+    database.init_db()
+
+
+def bank_rows():
+    with database.SessionLocal() as db:
+        return db.query(Bank.name).count(), db.query(BankItem.id).count()
+
+
+def paste_each_file(directory: str, provider):
+    for file_name in sorted(os.listdir(directory)):
+        with open(file=os.path.join(directory, file_name), mode="r", encoding="utf-8") as f:
+            tsv_data = f.read()
+        with database.SessionLocal() as db:
+            enter_bank_tsv(db=db, tsv_data=tsv_data, bank_name=file_name.removesuffix(".txt"), provider=provider)
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=48)
+    parser.add_argument("--items", type=int, default=1500)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    with temporary_workdir():
+        write_exports(directory="exports", files=args.files, items=args.items)
+
+        def provider():
+            return SyntheticPriceProvider(item_ids=ITEM_IDS, ticks=1, seed=6)
+
+        timings = {}
+        reset_database()
+        _, timings["paste each file"] = timed(lambda: paste_each_file(directory="exports", provider=provider()))
+        expected = bank_rows()
+
+        for name, workers in [("import_bank_directory, workers=0", 0),
+                              (f"import_bank_directory, workers={args.workers}", args.workers)]:
+            reset_database()
+            results, timings[name] = timed(
+                lambda: import_bank_directory(directory="exports", provider=provider(), workers=workers)
+            )
+            assert not any(result["error"] for result in results)
+            assert bank_rows() == expected, (bank_rows(), expected)
+
+        print(f"{'path':<36} {'seconds':>8} {'banks/s':>8}")
+        for name, seconds in timings.items():
+            print(f"{name:<36} {seconds:>8.2f} {args.files / seconds:>8.1f}")
+
+        # Taken names, names repeated in the batch and broken files are reported per file
+        with open(file="exports/ACCOUNT_000.txt", mode="w", encoding="utf-8") as f:
+            f.write("Item id\tItem name\tItem quantity\n1\tItem 1\t1\n")
+        for file_name in ["New_Account.txt", "new_account.txt"]:
+            with open(file=f"exports/{file_name}", mode="w", encoding="utf-8") as f:
+                f.write("Item id\tItem name\tItem quantity\n4151\tAbyssal whip\t1\n")
+        with open(file="exports/empty.txt", mode="w", encoding="utf-8") as f:
+            f.write("Item id\tItem name\tItem quantity\nnot\ta\trow\n")
+        with open(file="exports/binary.txt", mode="wb") as f:
+            f.write(b"\xff\xfe\x00")
+
+        results = {result["file"]: result for result in import_bank_directory(directory="exports", provider=provider())}
+        assert "already exists" in results["account_000.txt"]["error"]
+        assert "already exists" in results["ACCOUNT_000.txt"]["error"]
+        assert results["New_Account.txt"]["error"] is None and results["New_Account.txt"]["items"] == 1
+        assert "more than once" in results["new_account.txt"]["error"]
+        assert results["empty.txt"]["error"] == "no items found"
+        assert results["binary.txt"]["error"]
+        assert bank_rows()[0] == args.files + 1
+        print("taken and repeated names, empty and unreadable files reported per file")
+
+
+if __name__ == '__main__':
+    main()
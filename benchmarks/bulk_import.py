@@ -0,0 +1,85 @@
+"""
+Benchmark -> bank import time vs bank size, legacy per-item flush path vs bulk insert + price run path.
+
+Run from the repo root:
+    python -m benchmarks.bulk_import
+"""
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.crud.database import create_bank, create_bank_item, bulk_create_bank_items
+from app.models.db_entry import PriceSnapshot
+from app.utils.snapshot import enter_price_run
+
+BANK_SIZES = [100, 400, 800, 1600]
+
+
+def make_bank(size: int):
+    return [
+        {"item_id": i, "name": f"Item {i}", "quantity": (i % 50) + 1, "is_tradeable": True}
+        for i in range(1, size + 1)
+    ]
+
+
+def per_item_import(db, items, snapshot_time):
+    bank = create_bank(db, name="bench", created_at=snapshot_time)
+    for item in items:
+        bank_item = create_bank_item(db=db, bank_id=bank.id, **item)
+        db.add(PriceSnapshot(
+            bank_item_id=bank_item.id,
+            item_name=bank_item.name,
+            timestamp=snapshot_time,
+            high_value_estimate=100 * item["quantity"],
+            low_value_estimate=90 * item["quantity"],
+            mean_value_estimate=95 * item["quantity"],
+        ))
+    db.commit()
+
+
+def bulk_import(db, items, snapshot_time):
+    bank = create_bank(db, name="bench", created_at=snapshot_time)
+    bulk_create_bank_items(db=db, bank_id=bank.id, items=items)
+    enter_price_run(
+        db=db,
+        bank_id=bank.id,
+        snapshot_time=snapshot_time,
+        fetched_at=snapshot_time.timestamp(),
+        unit_prices={item["item_id"]: (100, 90) for item in items},
+        bank_items=items,
+    )
+    db.commit()
+
+
+def time_import(import_func, items):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}")
+        Base.metadata.create_all(bind=engine)
+        session = sessionmaker(bind=engine)
+
+        with session() as db:
+            start = time.perf_counter()
+            import_func(db, items, datetime.now(timezone.utc))
+            elapsed = time.perf_counter() - start
+
+        engine.dispose()
+
+    return elapsed
+
+
+def main():
+    print(f"{'items':>6} {'per-item (s)':>13} {'bulk (s)':>10} {'speedup':>8}")
+    for size in BANK_SIZES:
+        items = make_bank(size)
+        per_item = time_import(per_item_import, items)
+        bulk = time_import(bulk_import, items)
+        print(f"{size:>6} {per_item:>13.4f} {bulk:>10.4f} {per_item / bulk:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+Check -> the DB generation UI reads are cached by. Every writer of the app runs in its own process here, the way a
+script or scheduled job writes next to a running Streamlit server, and this process must see a new generation after
+each one. Also checks that reads, rolled back writes and a commit without changes leave the generation alone and that
+writes of this process are seen without reading it again.
+
+Runs in a temporary working directory so Bank_Data.db and archive/ of the app are left alone.
+Run from the repo root:
+    python -m benchmarks.db_generation
+"""
+import multiprocessing
+import os
+from datetime import datetime, timedelta, timezone
+
+from app import database
+from app.crud.database import create_bank, get_all_banks
+from app.utils.archive import export_price_history
+from app.utils.batch_import import import_bank_directory
+from app.utils.compaction import compact_price_history
+from app.utils.price_providers import SyntheticPriceProvider
+from app.utils.snapshot import enter_all_banks_current_price
+from app.utils.timeseries import ingest_price_history
+from benchmarks.fake_prices_server import start_fake_prices_server
+from benchmarks.price_timeseries import BANK_ITEM_IDS, NOW, write_fixtures
+from benchmarks.workdir import temporary_workdir
+
+ITEM_IDS = BANK_ITEM_IDS  # items the stand-in server has /timeseries fixtures for
+
+
+def synthetic_prices():
+    return SyntheticPriceProvider(item_ids=ITEM_IDS, ticks=2, seed=3)
+
+
+def import_exports():
+    os.makedirs("exports")
+    for account in range(2):
+        lines = ["Item id\tItem name\tItem quantity"] + [
+            f"{item_id}\tItem {item_id}\t{account + item_id}" for item_id in ITEM_IDS
+        ]
+        with open(file=f"exports/account_{account}.txt", mode="w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    results = import_bank_directory(directory="exports", provider=synthetic_prices(), workers=0)
+    assert all(result["error"] is None for result in results), results
+
+
+def refresh_banks():
+    provider = synthetic_prices()
+    provider.advance()
+    assert all(refreshed for refreshed, _ in enter_all_banks_current_price(provider=provider).values())
+
+
+def ingest_buckets():
+    assert ingest_price_history(now=NOW)
+
+
+def compact_history():
+    report = compact_price_history(tiers=[(timedelta(0), timedelta(weeks=52 * 100))], vacuum=None)
+    assert report["runs_removed"] > 0, report
+
+
+def export_archive():
+    assert export_price_history()["files"] > 0
+
+
+WRITERS = {
+    "import_bank_directory": import_exports,
+    "enter_all_banks_current_price": refresh_banks,
+    "ingest_price_history": ingest_buckets,
+    "compact_price_history": compact_history,
+    "export_price_history": export_archive,
+}
+
+
+def run_writer(name: str):
+    """Runs in a fresh process -> its engine opens Bank_Data.db of the working directory it was started in"""
+    WRITERS[name]()
+
+
+def check_other_processes():
+    context = multiprocessing.get_context("spawn")
+    for name in WRITERS:
+        known = database.get_db_generation()
+        process = context.Process(target=run_writer, args=(name,))
+        process.start()
+        process.join()
+        assert process.exitcode == 0, f"{name} failed"
+
+        # Nothing told this process -> only reading the database shows the write
+        assert database.get_db_generation() == known
+        generation = database.read_db_generation()
+        assert generation > known, (name, generation, known)
+        print(f"{name:<30} in another process -> generation {known} -> {generation}")
+
+
+def check_this_process():
+    generation = database.read_db_generation()
+
+    with database.SessionLocal() as db:
+        get_all_banks(db=db)
+        db.commit()
+    with database.SessionLocal() as db:
+        create_bank(db, name="rolled_back", created_at=datetime.now(timezone.utc))
+        db.rollback()
+    with database.SessionLocal() as db:
+        db.commit()
+    assert database.read_db_generation() == generation, "reads and rolled back writes must not bump the generation"
+
+    with database.SessionLocal() as db:
+        create_bank(db, name="committed", created_at=datetime.now(timezone.utc))
+        db.commit()
+    assert database.get_db_generation() == generation + 1, "a commit of this process is known without reading"
+    assert database.read_db_generation() == generation + 1
+    print("reads, rollbacks and empty commits keep the generation, writes of this process are seen right away")
+
+
+def main():
+    with temporary_workdir() as tmp_dir:
+        database.init_db()
+        write_fixtures(os.path.join(tmp_dir, "fixtures"))
+        server = start_fake_prices_server(fixtures=os.path.join(tmp_dir, "fixtures"))
+        # Read by app.utils.prices at import -> the writer processes fetch buckets from the stand-in server
+        os.environ["OBVA_PRICES_API_URL"] = server.api_url
+
+        check_other_processes()
+        check_this_process()
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
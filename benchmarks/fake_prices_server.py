@@ -0,0 +1,219 @@
+"""
+Local stand-in for the wiki prices api -> serves /api/v1/osrs/latest with made up prices, optionally slow or failing,
+so price refreshes can be exercised without touching the real api. It keeps connections alive, gzips responses
+for clients that accept it and answers conditional requests with 304. Other endpoints (/5m, /1h, /timeseries) are
+replayed from a directory of recorded responses, see record_fixtures.
+
+Run from the repo root, then start the app with OBVA_PRICES_API_URL=http://127.0.0.1:8765/api/v1/osrs:
+    python -m benchmarks.fake_prices_server [--port 8765] [--latency 0] [--connect-latency 0] [--failures 0]
+                                            [--fixtures DIR]
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qsl
+
+from app.utils.prices import request_prices_api
+
+API_PATH = "/api/v1/osrs"
+
+
+def make_latest_prices(item_count: int = 3000, seed: int = 0):
+    """:return: Dict -> /latest shaped response with prices for item ids 0..item_count-1"""
+    now = int(time.time())
+    return {
+        "data": {
+            str(item_id): {
+                "high": 100 + (item_id * 37 + seed) % 5000,
+                "highTime": now,
+                "low": 90 + (item_id * 37 + seed) % 5000,
+                "lowTime": now,
+            }
+            for item_id in range(item_count)
+        }
+    }
+
+
+class FakePricesHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so pooled clients reuse their connection
+    disable_nagle_algorithm = True  # headers and body are separate writes, don't stall kept alive connections
+
+    def setup(self):
+        super().setup()
+        # Once per connection -> stands in for the TCP and TLS handshake round trips to the real api
+        time.sleep(self.server.connect_latency)
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.connections.add(self.client_address)
+            fail = server.failures > 0
+            if fail:
+                server.failures -= 1
+
+        time.sleep(server.latency)
+
+        path, _, query = self.path.partition("?")
+        endpoint = path.removeprefix(API_PATH)
+        if endpoint == "/latest":
+            payload = server.latest_payload
+        else:
+            payload = server.fixtures.get(fixture_name(endpoint=endpoint, params=dict(parse_qsl(query))))
+
+        with server.lock:
+            server.paths.append(self.path)
+
+        if payload is None:
+            self.send_error(404)
+            return
+        if fail:
+            self.send_error(503, "Stand-in failure")
+            return
+
+        self.send_payload(payload)
+
+    def send_payload(self, payload: dict):
+        """Answers with payload -> 304 if the client's validators match, gzip if the client accepts it."""
+        if_none_match = self.headers.get("If-None-Match")
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_none_match is not None:
+            not_modified = if_none_match == payload["etag"]
+        else:
+            not_modified = (
+                if_modified_since is not None
+                and parsedate_to_datetime(if_modified_since) >= parsedate_to_datetime(payload["last_modified"])
+            )
+
+        gzipped = "gzip" in self.headers.get("Accept-Encoding", "")
+        body = b"" if not_modified else payload["gzip"] if gzipped else payload["body"]
+        # Recorded before answering -> a client that just got its response always finds the status here
+        with self.server.lock:
+            self.server.statuses.append(304 if not_modified else 200)
+        try:
+            self.send_response(304 if not_modified else 200)
+            self.send_header("ETag", payload["etag"])
+            self.send_header("Last-Modified", payload["last_modified"])
+            if not not_modified:
+                self.send_header("Content-Type", "application/json")
+                if gzipped:
+                    self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # client timed out and hung up
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def make_payload(response: dict) -> dict:
+    """Encodes an api response once -> plain and gzip body plus the validators it is served with."""
+    body = json.dumps(response).encode("utf-8")
+    return {
+        "body": body,
+        "gzip": gzip.compress(body),
+        "etag": f'"{hashlib.sha1(body).hexdigest()}"',
+        "last_modified": formatdate(time.time(), usegmt=True),
+    }
+
+
+def fixture_name(endpoint: str, params: dict) -> str:
+    """Recorded response file name -> /timeseries?id=2&timestep=1h is stored as timeseries_id=2_timestep=1h.json"""
+    return endpoint.strip("/") + "".join(f"_{key}={value}" for key, value in sorted(params.items())) + ".json"
+
+
+def record_fixtures(directory: str, requests_to_record: list):
+    """
+    Records real api responses as fixtures the server can replay.
+    :param directory: fixture directory
+    :param requests_to_record: list of (endpoint, params), e.g. [("/timeseries", {"id": 4151, "timestep": "1h"})]
+    """
+    os.makedirs(directory, exist_ok=True)
+    for endpoint, params in requests_to_record:
+        response = request_prices_api(endpoint, params=params)
+        path = os.path.join(directory, fixture_name(endpoint=endpoint, params=params))
+        with open(file=path, mode="w", encoding="utf-8") as f:
+            json.dump(response.json(), f)
+
+
+class FakePricesServer(ThreadingHTTPServer):
+    """
+    :param latency: seconds every response is delayed by
+    :param connect_latency: seconds every new connection is delayed by before its first response
+    :param failures: number of requests answered with 503 before the server starts answering normally
+    :param fixtures: directory of recorded responses, see record_fixtures, served for every endpoint but /latest
+    Records requests answered, paths requested, client connections seen and the status of every payload sent.
+    """
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency: float = 0, failures: int = 0, item_count: int = 3000, fixtures=None,
+                 verbose=False, connect_latency: float = 0):
+        super().__init__(("127.0.0.1", port), FakePricesHandler)
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.failures = failures
+        self.verbose = verbose
+        self.requests = 0
+        self.connections = set()
+        self.statuses = []
+        self.paths = []
+        self.lock = threading.Lock()
+        self.set_latest(make_latest_prices(item_count=item_count))
+
+        self.fixtures = {}
+        if fixtures is not None:
+            for path in Path(fixtures).glob("*.json"):
+                self.fixtures[path.name] = make_payload(json.loads(path.read_text(encoding="utf-8")))
+
+    def set_latest(self, latest: dict):
+        """Replaces the /latest response, its ETag and Last-Modified change with it."""
+        self.latest_payload = make_payload(latest)
+
+    @property
+    def api_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}{API_PATH}"
+
+
+def start_fake_prices_server(**kwargs) -> FakePricesServer:
+    """Starts a FakePricesServer on a free port in a daemon thread, stop it with server.shutdown()."""
+    server = FakePricesServer(**kwargs)
+    threading.Thread(target=server.serve_forever, name="fake-prices-server", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the wiki prices api")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0, help="seconds every response is delayed by")
+    parser.add_argument("--connect-latency", type=float, default=0, help="seconds every new connection is delayed by")
+    parser.add_argument("--failures", type=int, default=0, help="requests answered with 503 first")
+    parser.add_argument("--fixtures", help="directory of recorded responses to replay")
+    args = parser.parse_args()
+
+    server = FakePricesServer(
+        port=args.port,
+        latency=args.latency,
+        failures=args.failures,
+        fixtures=args.fixtures,
+        verbose=True,
+        connect_latency=args.connect_latency,
+    )
+    print(f"Serving fake prices, OBVA_PRICES_API_URL={server.api_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark -> price history reads, ORM to_dataframe vs read_price_history. A bank's history comes from the memory
+mapped archive plus the rows since the last export, one item's history from an index range scan in SQLite.
+
+Runs in a temporary working directory so Bank_Data.db and archive/ of the app are left alone.
+Run from the repo root:
+    python -m benchmarks.price_history_archive
+"""
+import time
+from datetime import datetime, timedelta, timezone
+
+from app.database import SessionLocal, init_db
+from app.crud.database import create_bank, bulk_create_bank_items, read_single_item_snapshots, query_bank_price_history
+from app.utils.archive import export_price_history, read_price_history, read_archive
+from app.utils.snapshot import enter_price_run
+from app.utils.transformers import to_dataframe
+from benchmarks.workdir import temporary_workdir
+
+BANKS = 3
+ITEMS = 800
+REFRESHES = 365  # ~6 months of twice daily refreshes
+REPEATS = 5
+
+
+def fill_database():
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    bank_items = [{"item_id": i, "name": f"Item {i}", "quantity": (i % 20) + 1} for i in range(ITEMS)]
+
+    with SessionLocal() as db:
+        bank_ids = []
+        for bank_number in range(BANKS):
+            bank = create_bank(db, name=f"bank_{bank_number}", created_at=start)
+            bulk_create_bank_items(db=db, bank_id=bank.id, items=bank_items)
+            bank_ids.append(bank.id)
+
+        for refresh in range(REFRESHES):
+            snapshot_time = start + timedelta(hours=12 * refresh)
+            unit_prices = {i: (100 + refresh + i, 90 + refresh + i) for i in range(ITEMS)}
+            for bank_id in bank_ids:
+                enter_price_run(
+                    db=db,
+                    bank_id=bank_id,
+                    snapshot_time=snapshot_time + timedelta(seconds=bank_id),
+                    fetched_at=snapshot_time.timestamp(),
+                    unit_prices=unit_prices,
+                    bank_items=bank_items,
+                )
+        db.commit()
+
+
+def best_of(func):
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def orm_item_history():
+    with SessionLocal() as db:
+        return to_dataframe(read_single_item_snapshots(db=db, item_name="Item 7", bank_name="bank_0"))
+
+
+def orm_bank_history():
+    with SessionLocal() as db:
+        return to_dataframe(query_bank_price_history(db=db, bank_id=1).all())
+
+
+def main():
+    with temporary_workdir():
+        init_db()
+        fill_database()
+
+        start = time.perf_counter()
+        report = export_price_history()
+        print(f"export: {report['rows']:,} rows in {report['files']} files, {time.perf_counter() - start:.2f}s")
+
+        cases = {
+            "item history, ORM to_dataframe": orm_item_history,
+            "item history, read_price_history": lambda: read_price_history(bank_name="bank_0", item_name="Item 7"),
+            "item history, archive only": lambda: read_archive(bank_id=1, item_name="Item 7"),
+            "bank history, ORM to_dataframe": orm_bank_history,
+            "bank history, read_price_history": lambda: read_price_history(bank_name="bank_0"),
+        }
+        for name, func in cases.items():
+            print(f"{name:<34} {best_of(func) * 1000:>9.1f} ms  ({len(func())} rows)")
+
+
+if __name__ == '__main__':
+    main()
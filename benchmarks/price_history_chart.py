@@ -0,0 +1,199 @@
+"""
+Benchmark -> the item price chart of the item compare page. Snapshot history of an item is downsampled with LTTB and
+the wiki api buckets are averaged into slots in SQL, so a chart never draws more than CHART_POINTS points per series
+however long the history grows. Checks LTTB keeps the ends and spikes, that the SQL slots match a volume weighted
+pandas groupby and that windows only return their own rows, then times the chart against reading everything.
+
+Runs in a temporary working directory so Bank_Data.db and archive/ of the app are left alone.
+Run from the repo root:
+    python -m benchmarks.price_history_chart [--refreshes 1500] [--items 50]
+"""
+import argparse
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import insert
+
+from app import database
+from app.crud.database import create_bank, bulk_create_bank_items, read_item_price_buckets
+from app.crud.database import read_item_price_bucket_series
+from app.models.db_entry import ItemPriceBucket
+from app.utils.archive import export_price_history, read_price_history
+from app.utils.price_charts import CHART_POINTS, item_price_chart, lttb_indices, window_start
+from app.utils.snapshot import enter_price_run
+from app.utils.timeseries import TIMESTEPS
+from benchmarks.workdir import temporary_workdir
+
+START = datetime(2023, 1, 1, tzinfo=timezone.utc)
+CHART_ITEM = 7
+
+
+def check_lttb():
+    rng = np.random.default_rng(5)
+    y = np.cumsum(rng.normal(size=100_000))
+    y[61_234] += 500  # a single spike plain averaging would flatten
+    x = np.arange(len(y)) * 300
+
+    kept = lttb_indices(x=x, y=y, points=CHART_POINTS)
+    assert len(kept) == CHART_POINTS
+    assert kept[0] == 0 and kept[-1] == len(y) - 1
+    assert (np.diff(kept) > 0).all()
+    assert 61_234 in kept
+    assert (lttb_indices(x=x[:10], y=y[:10], points=CHART_POINTS) == np.arange(10)).all()
+    print(f"LTTB keeps {CHART_POINTS} of {len(y):,} samples, both ends and the spike")
+
+
+def fill_snapshots(refreshes: int, items: int):
+    """Twice daily snapshots of one bank, the older half exported to the archive. :return: last snapshot time"""
+    bank_items = [{"item_id": i, "name": f"Item {i}", "quantity": (i % 20) + 1} for i in range(items)]
+    rng = np.random.default_rng(3)
+    drift = np.cumsum(rng.integers(-5, 6, size=refreshes))
+
+    with database.SessionLocal() as db:
+        bank = create_bank(db, name="bank_0", created_at=START)
+        bulk_create_bank_items(db=db, bank_id=bank.id, items=bank_items)
+        for refresh in range(refreshes):
+            snapshot_time = START + timedelta(hours=12 * refresh)
+            unit_prices = {i: (1000 + int(drift[refresh]) + i, 900 + int(drift[refresh]) + i) for i in range(items)}
+            enter_price_run(
+                db=db,
+                bank_id=bank.id,
+                snapshot_time=snapshot_time,
+                fetched_at=snapshot_time.timestamp(),
+                unit_prices=unit_prices,
+                bank_items=bank_items,
+            )
+            if refresh == refreshes // 2:
+                db.commit()
+                export_price_history()
+        db.commit()
+
+    return (START + timedelta(hours=12 * (refreshes - 1))).replace(tzinfo=None)
+
+
+def fill_buckets(end: datetime, days: int, timestep: int):
+    """Buckets of CHART_ITEM up to end, some with no trades on one side"""
+    rng = np.random.default_rng(timestep)
+    last = int(end.replace(tzinfo=timezone.utc).timestamp()) // timestep * timestep
+    bucket_ts = np.arange(last - days * 86400, last + 1, timestep)
+    high_volume = rng.integers(0, 40, size=len(bucket_ts))
+    low_volume = rng.integers(0, 40, size=len(bucket_ts))
+    prices = 1000 + np.cumsum(rng.integers(-3, 4, size=len(bucket_ts)))
+
+    with database.SessionLocal() as db:
+        db.connection().execute(insert(ItemPriceBucket), [
+            {
+                "item_id": CHART_ITEM,
+                "timestep": timestep,
+                "bucket_ts": int(ts),
+                "avg_high": int(price + 10) if high else None,
+                "high_volume": int(high),
+                "avg_low": int(price) if low else None,
+                "low_volume": int(low),
+            }
+            for ts, price, high, low in zip(bucket_ts, prices, high_volume, low_volume)
+        ])
+        db.commit()
+    return len(bucket_ts)
+
+
+def pandas_bucket_series(timestep: int, points: int, since: int = None):
+    """Every bucket read into pandas, then grouped into the same slots as read_item_price_bucket_series"""
+    with database.SessionLocal() as db:
+        buckets = read_item_price_buckets(db=db, item_id=CHART_ITEM, timestep=timestep, since=since)
+    df = pd.DataFrame([(b.bucket_ts, b.avg_high, b.high_volume, b.avg_low, b.low_volume) for b in buckets],
+                      columns=["bucket_ts", "avg_high", "high_volume", "avg_low", "low_volume"])
+
+    first, last = df["bucket_ts"].min(), df["bucket_ts"].max()
+    width = timestep * max(1, -(-(last - first + timestep) // (timestep * points)))
+    df["slot"] = (df["bucket_ts"] - first) // width
+    for side in ("high", "low"):
+        traded = df[f"avg_{side}"].notna()
+        df[f"{side}_weight"] = df[f"{side}_volume"].where(traded, 0)
+        df[f"{side}_product"] = df[f"avg_{side}"] * df[f"{side}_volume"]
+
+    grouped = df.groupby("slot")
+    series = pd.DataFrame({
+        "timestamp": first + grouped["slot"].first() * width,
+        "avg_high": grouped["high_product"].sum() / grouped["high_weight"].sum().replace(0, np.nan),
+        "avg_low": grouped["low_product"].sum() / grouped["low_weight"].sum().replace(0, np.nan),
+    })
+    series["avg_high"] = series["avg_high"].fillna(grouped["avg_high"].mean())
+    series["avg_low"] = series["avg_low"].fillna(grouped["avg_low"].mean())
+    return series.reset_index(drop=True)
+
+
+def sql_bucket_series(timestep: int, points: int, since: int = None):
+    with database.SessionLocal() as db:
+        rows = read_item_price_bucket_series(db=db, item_id=CHART_ITEM, timestep=timestep, points=points, since=since)
+    return pd.DataFrame(rows, columns=["timestamp", "avg_high", "avg_low"])
+
+
+def best_of(func, repeat: int = 5):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return result, min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--refreshes", type=int, default=1500, help="12 hour snapshots, 1500 -> ~2 years")
+    parser.add_argument("--items", type=int, default=50)
+    args = parser.parse_args()
+
+    check_lttb()
+
+    with temporary_workdir():
+        database.init_db()
+        end = fill_snapshots(refreshes=args.refreshes, items=args.items)
+        hourly = fill_buckets(end=end, days=365, timestep=TIMESTEPS["1h"])
+        five_minute = fill_buckets(end=end, days=30, timestep=TIMESTEPS["5m"])
+
+        # SQL slots match pandas grouping every bucket, for the whole series and for a window
+        since = int((end - timedelta(days=7)).replace(tzinfo=timezone.utc).timestamp())
+        for timestep, window_since in [(3600, None), (300, None), (300, since)]:
+            expected = pandas_bucket_series(timestep=timestep, points=CHART_POINTS, since=window_since)
+            actual = sql_bucket_series(timestep=timestep, points=CHART_POINTS, since=window_since)
+            assert len(actual) <= CHART_POINTS
+            assert (actual["timestamp"].to_numpy() == expected["timestamp"].to_numpy()).all()
+            assert np.allclose(actual[["avg_high", "avg_low"]].astype(float), expected[["avg_high", "avg_low"]],
+                               equal_nan=True)
+        print(f"SQL slots of {hourly:,} 1h and {five_minute:,} 5m buckets match a volume weighted pandas groupby")
+
+        # Each window only holds its own snapshots and every series stays within the point budget
+        item_name = f"Item {CHART_ITEM}"
+        full_history = read_price_history(bank_name="bank_0", item_name=item_name)
+        for window in ["7 days", "30 days", "1 year", "All time"]:
+            chart = item_price_chart(bank_name="bank_0", item_name=item_name, window=window, now=end)
+            start = window_start(window=window, now=end)
+            in_window = full_history if start is None else full_history[full_history["timestamp"] > start]
+            snapshots = chart["mean_price"].dropna()
+            assert len(snapshots) == min(len(in_window), CHART_POINTS), (window, len(snapshots), len(in_window))
+            assert snapshots.index[0] == in_window["timestamp"].iloc[0]
+            assert snapshots.index[-1] == in_window["timestamp"].iloc[-1]
+            assert len(chart["market_avg_high"].dropna()) <= CHART_POINTS
+            expected_prices = (in_window["mean_value_estimate"] / in_window["quantity"]).set_axis(
+                in_window["timestamp"])
+            assert np.allclose(snapshots, expected_prices.loc[snapshots.index])
+            print(f"{window:<9} {len(in_window):>6,} snapshots -> {len(snapshots):>4} points, "
+                  f"{len(chart['market_avg_high'].dropna()):>4} market points")
+
+        _, buckets_seconds = best_of(lambda: pandas_bucket_series(timestep=3600, points=CHART_POINTS))
+        _, sql_seconds = best_of(lambda: sql_bucket_series(timestep=3600, points=CHART_POINTS))
+        _, history_seconds = best_of(lambda: read_price_history(bank_name="bank_0", item_name=item_name))
+        _, chart_seconds = best_of(lambda: item_price_chart(bank_name="bank_0", item_name=item_name, now=end))
+
+        print(f"\n1 year of 1h buckets, read all + pandas slots: {buckets_seconds * 1000:8.2f} ms")
+        print(f"1 year of 1h buckets, slots in SQL:            {sql_seconds * 1000:8.2f} ms "
+              f"({buckets_seconds / sql_seconds:.1f}x)")
+        print(f"{args.refreshes:,} snapshots, full price history read:   {history_seconds * 1000:8.2f} ms")
+        print(f"{args.refreshes:,} snapshots, whole chart:               {chart_seconds * 1000:8.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Check -> compacting price history keeps each bank's mean value. Months of twice daily refreshes are compacted, then
+compacted again once the daily buckets have aged into weekly ones, so the second pass merges runs that already stand
+for several fetches. Every BankValuation left must hold the mean of the original valuations it replaced, and the
+space freed must actually leave the file on a database created without auto_vacuum.
+
+Runs in a temporary working directory so Bank_Data.db of the app is left alone.
+Run from the repo root:
+    python -m benchmarks.price_history_compaction [--banks 3] [--items 300] [--days 120]
+"""
+import argparse
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from app import database
+from app.crud.database import create_bank, bulk_create_bank_items
+from app.models.db_entry import BankValuation, PriceRun
+from app.utils.compaction import compact_price_history
+from app.utils.snapshot import enter_price_run
+from benchmarks.workdir import temporary_workdir
+
+START = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def fill_database(banks: int, items: int, days: int):
+    """:return: naive UTC time of the last refresh"""
+    rng = np.random.default_rng(9)
+    bank_items = [{"item_id": i, "name": f"Item {i}", "quantity": int(rng.integers(1, 500))} for i in range(items)]
+    base_prices = rng.lognormal(mean=7, sigma=2, size=items)
+
+    with database.SessionLocal() as db:
+        bank_ids = []
+        for bank_number in range(banks):
+            bank = create_bank(db, name=f"bank_{bank_number}", created_at=START)
+            bulk_create_bank_items(db=db, bank_id=bank.id, items=bank_items[bank_number:])
+            bank_ids.append(bank.id)
+
+        refreshes = days * 2
+        for refresh in range(refreshes):
+            snapshot_time = START + timedelta(hours=12 * refresh)
+            # Prices drift by tens of percent over the period -> unweighted means of merged rows would be visibly off
+            low = (base_prices * (1 + 0.4 * np.sin(refresh / 15)) * rng.uniform(0.95, 1.05, size=items)).astype(int)
+            unit_prices = {i: (int(low[i] * 1.03) + 1, int(low[i]) + 1) for i in range(items)}
+            for bank_number, bank_id in enumerate(bank_ids):
+                enter_price_run(
+                    db=db,
+                    bank_id=bank_id,
+                    snapshot_time=snapshot_time + timedelta(seconds=bank_id),
+                    fetched_at=snapshot_time.timestamp(),
+                    unit_prices=unit_prices,
+                    bank_items=bank_items[bank_number:],
+                )
+        db.commit()
+
+    return (START + timedelta(hours=12 * (refreshes - 1))).replace(tzinfo=None)
+
+
+def read_valuations():
+    """:return: Dict -> {bank_id: [(timestamp, low, mean, high)] ordered by timestamp}"""
+    valuations = defaultdict(list)
+    with database.SessionLocal() as db:
+        for valuation in db.query(BankValuation).order_by(BankValuation.bank_id, BankValuation.timestamp):
+            valuations[valuation.bank_id].append((
+                valuation.timestamp, valuation.low_value_total, valuation.mean_value_total,
+                valuation.high_value_total,
+            ))
+    return valuations
+
+
+def check_means(original: dict, compacted: dict, passes: int):
+    """
+    Each compacted valuation is kept at the earliest timestamp of its bucket and buckets do not overlap, so the
+    originals it stands for are the ones up to the next compacted valuation.
+    :return: Float -> largest relative error of a mean_value_total
+    """
+    largest_error = 0.0
+    for bank_id, kept in compacted.items():
+        timestamps = np.array([row[0] for row in original[bank_id]], dtype="datetime64[us]")
+        totals = np.array([row[1:] for row in original[bank_id]], dtype=np.float64)
+        bounds = np.searchsorted(timestamps, np.array([row[0] for row in kept], dtype="datetime64[us]"))
+        bounds = np.append(bounds, len(timestamps))
+
+        assert bounds[0] == 0 and (np.diff(bounds) > 0).all()
+        for row, start, end in zip(kept, bounds[:-1], bounds[1:]):
+            expected = totals[start:end].mean(axis=0)
+            low, mean, high = row[1:]
+            # low and high totals are rounded once per pass
+            assert abs(low - expected[0]) <= passes and abs(high - expected[2]) <= passes, (row, expected)
+            assert np.isclose(mean, expected[1], rtol=1e-12), (row, expected)
+            largest_error = max(largest_error, abs(mean - expected[1]) / expected[1])
+
+    return largest_error
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--banks", type=int, default=3)
+    parser.add_argument("--items", type=int, default=300)
+    parser.add_argument("--days", type=int, default=120)
+    args = parser.parse_args()
+
+    with temporary_workdir():
+        database.init_db()
+        end = fill_database(banks=args.banks, items=args.items, days=args.days)
+        original = read_valuations()
+
+        # First pass -> daily buckets after 7 days, weekly after 30. Second pass 45 days later -> the daily buckets
+        # of the first pass are weekly now and merge runs of sample_count 2
+        for passes, now in enumerate([end, end + timedelta(days=45)], start=1):
+            start = time.perf_counter()
+            report = compact_price_history(now=now)
+            seconds = time.perf_counter() - start
+
+            with database.SessionLocal() as db:
+                runs = db.query(PriceRun).count()
+            with database.engine.connect() as connection:
+                auto_vacuum = connection.exec_driver_sql("PRAGMA auto_vacuum").scalar()
+
+            largest_error = check_means(original=original, compacted=read_valuations(), passes=passes)
+            assert report["bytes_freed"] > 0, report
+            assert auto_vacuum == 2, auto_vacuum
+            print(f"pass {passes}: {report['runs_removed']:,} runs merged in {report['buckets_compacted']} buckets, "
+                  f"{runs} runs left, {report['bytes_freed'] / 1024:,.0f} KB freed, {seconds:.2f}s, "
+                  f"largest mean error {largest_error:.1e}")
+
+        print("every compacted valuation holds the mean of the valuations it replaced")
+
+
+if __name__ == '__main__':
+    main()
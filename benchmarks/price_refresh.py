@@ -0,0 +1,196 @@
+"""
+Check -> price cache refresh against the local stand-in server: timeouts, retry with backoff, single flight,
+stale while revalidate for display reads and never expired prices for snapshot writers. Exits with an AssertionError
+if a case misbehaves.
+
+Runs in a temporary working directory so cache/ of the app is left alone.
+Run from the repo root:
+    python -m benchmarks.price_refresh
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+
+import requests
+
+from app.utils import prices
+from app.utils.price_providers import LIVE_PRICES
+from benchmarks.fake_prices_server import make_latest_prices, start_fake_prices_server
+
+
+def reset_cache():
+    if os.path.exists(prices.CACHE_FILE):
+        os.remove(prices.CACHE_FILE)
+    prices.PRICE_CACHE_MEMO.update({"mtime_ns": None, "cache": None, "price_table": None})
+
+
+def use_server(server):
+    prices.PRICES_API_URL = server.api_url
+
+
+def age_cache(seconds: float):
+    """Rewrites the cache file as if it was fetched seconds ago and not revalidated since."""
+    cache = dict(prices.load_price_cache())
+    cache["timestamp"] = time.time() - seconds
+    cache.pop("checked_at", None)
+    with open(file=prices.CACHE_FILE, mode="w", encoding="utf-8") as f:
+        json.dump(cache, f)
+
+
+def check_timeout():
+    server = start_fake_prices_server(latency=1.0)
+    use_server(server)
+    prices.REQUEST_TIMEOUT = (1, 0.2)
+    prices.REQUEST_RETRIES = 1
+
+    start = time.perf_counter()
+    try:
+        prices.request_latest_prices()
+        raise AssertionError("slow server did not time out")
+    except requests.Timeout:
+        pass
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    assert elapsed < 0.9, elapsed
+    print(f"timeout: gave up after {elapsed:.2f}s on a 1s response")
+
+
+def check_retry():
+    server = start_fake_prices_server(failures=2)
+    use_server(server)
+    prices.REQUEST_TIMEOUT = (1, 5)
+    prices.REQUEST_RETRIES = 3
+    prices.RETRY_BACKOFF = 0.05
+
+    start = time.perf_counter()
+    data, _, _ = prices.request_latest_prices()
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    assert "data" in data
+    assert server.requests == 3, server.requests
+    assert elapsed >= 0.05 + 0.1, elapsed  # backoff doubled between attempts
+    print(f"retry: succeeded on attempt {server.requests} after {elapsed:.2f}s of backoff")
+
+
+def check_single_flight():
+    reset_cache()
+    server = start_fake_prices_server(latency=0.3)
+    use_server(server)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(prices.fetch_price_cache())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    server.shutdown()
+
+    assert server.requests == 1, server.requests
+    assert len({result["timestamp"] for result in results}) == 1
+    print(f"single flight: {len(threads)} concurrent cold callers, {server.requests} api request")
+
+
+def check_stale_while_revalidate():
+    server = start_fake_prices_server(latency=0.5)
+    server.set_latest(make_latest_prices(seed=1))
+    use_server(server)
+    age_cache(prices.CACHE_DURATION + 60)
+    stale_timestamp = prices.load_price_cache()["timestamp"]
+
+    start = time.perf_counter()
+    cache = prices.fetch_price_cache()
+    elapsed = time.perf_counter() - start
+    assert cache["timestamp"] == stale_timestamp
+    assert elapsed < 0.1, elapsed
+
+    # Callers during the refresh keep getting the stale copy without starting a second request
+    for _ in range(5):
+        assert prices.fetch_price_cache()["timestamp"] == stale_timestamp
+
+    deadline = time.time() + 5
+    while prices.load_price_cache()["timestamp"] == stale_timestamp and time.time() < deadline:
+        time.sleep(0.05)
+    fresh = prices.fetch_price_cache()
+    server.shutdown()
+
+    assert fresh["timestamp"] > stale_timestamp
+    assert server.requests == 1, server.requests
+    assert prices.get_price_table().fetched_at == fresh["timestamp"]
+    print(f"stale while revalidate: stale cache served in {elapsed * 1000:.1f}ms, refreshed in the background")
+
+
+def check_snapshot_prices():
+    # Expired cache and no api -> a snapshot writer gets an error instead of the stale prices
+    age_cache(prices.CACHE_DURATION + 60)
+    stale_timestamp = prices.load_price_cache()["timestamp"]
+    prices.PRICES_API_URL = "http://127.0.0.1:9/api/v1/osrs"
+    prices.REQUEST_RETRIES = 1
+    try:
+        LIVE_PRICES.snapshot_price_table()
+        raise AssertionError("a snapshot must not be written from expired prices")
+    except requests.ConnectionError:
+        pass
+    prices.REQUEST_RETRIES = 3
+
+    server = start_fake_prices_server(latency=0.3)
+    server.set_latest(make_latest_prices(seed=3))
+    use_server(server)
+
+    # Display reads get the stale prices straight away, the snapshot writer waits for the refresh they started
+    assert LIVE_PRICES.price_table().fetched_at == stale_timestamp
+    start = time.perf_counter()
+    fresh_table = LIVE_PRICES.snapshot_price_table()
+    waited = time.perf_counter() - start
+    assert fresh_table.fetched_at > stale_timestamp
+    assert server.requests == 1, server.requests
+
+    # Due for a refresh but not expired yet -> served from the cache without waiting
+    age_cache(prices.CACHE_DURATION - prices.REFRESH_AHEAD + 60)
+    due_timestamp = prices.load_price_cache()["timestamp"]
+    start = time.perf_counter()
+    assert LIVE_PRICES.snapshot_price_table().fetched_at == due_timestamp
+    assert time.perf_counter() - start < 0.1
+    while prices.PRICE_REFRESH_LOCK.locked():
+        time.sleep(0.05)
+    server.shutdown()
+    print(f"snapshot prices: expired cache refreshed before writing ({waited:.2f}s), refused without the api")
+
+
+def check_refresher():
+    server = start_fake_prices_server()
+    server.set_latest(make_latest_prices(seed=2))
+    use_server(server)
+    age_cache(prices.CACHE_DURATION - prices.REFRESH_AHEAD + 60)
+    old_timestamp = prices.load_price_cache()["timestamp"]
+
+    thread = prices.start_price_refresher(interval=0.05)
+    assert prices.start_price_refresher(interval=0.05) is thread
+
+    deadline = time.time() + 5
+    while prices.load_price_cache()["timestamp"] == old_timestamp and time.time() < deadline:
+        time.sleep(0.05)
+    server.shutdown()
+
+    assert prices.load_price_cache()["timestamp"] > old_timestamp
+    print("refresher: cache refreshed ahead of expiry")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        os.makedirs("cache", exist_ok=True)
+
+        check_timeout()
+        check_retry()
+        check_single_flight()
+        check_stale_while_revalidate()
+        check_snapshot_prices()
+        check_refresher()
+
+
+if __name__ == '__main__':
+    main()
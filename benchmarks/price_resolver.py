@@ -0,0 +1,97 @@
+"""
+Benchmark -> resolving the unit prices of a bank, legacy json5 parsing + per-item if/elif rules vs the compiled
+PriceResolver. Also checks both give the same prices for every item.
+
+Run from the repo root:
+    python -m benchmarks.price_resolver
+"""
+import time
+
+import numpy as np
+
+from app.utils.prices import PriceTable, read_tradeable_if_uncharged, read_item_plus_ornament_kit
+from app.utils.price_resolver import PRICE_RESOLVER_MEMO, RESOLVER_CACHE_FILE, get_price_resolver
+
+ITEM_IDS = range(30000)
+BANK_SIZES = [100, 1000, 5000]
+REPEATS = 5
+
+
+def make_price_table(seed: int = 0):
+    rng = np.random.default_rng(seed)
+    all_prices = {
+        str(item_id): {"high": int(rng.integers(2, 10 ** 6)), "low": 1 + int(rng.integers(1, 10 ** 6)),
+                       "highTime": 0, "lowTime": 0}
+        for item_id in ITEM_IDS
+        if rng.random() < 0.6 and item_id != 995
+    }
+    # Components of every mapping rule have prices
+    for component_id in list(read_tradeable_if_uncharged().values()) + list(read_item_plus_ornament_kit().values()):
+        all_prices[component_id] = {"high": 500, "low": 400, "highTime": 0, "lowTime": 0}
+    return PriceTable(all_prices=all_prices, fetched_at=0)
+
+
+def legacy_unit_prices(price_table, item_ids):
+    all_tradeable_if_uncharged = read_tradeable_if_uncharged()
+    all_item_plus_ornament_kit = read_item_plus_ornament_kit()
+
+    unit_prices = {}
+    for item_id in item_ids:
+        key = str(item_id)
+        if key in price_table:
+            price_data = price_table.get(key)
+            high, low = price_data["high"], price_data["low"]
+        elif key in all_tradeable_if_uncharged:
+            price_data = price_table.get(all_tradeable_if_uncharged[key])
+            high, low = price_data["high"], price_data["low"]
+        elif key in all_item_plus_ornament_kit:
+            base_item = price_table.get(all_item_plus_ornament_kit[key])
+            ornament_kit = price_table.get(all_item_plus_ornament_kit[f"kit_{key}"])
+            high, low = base_item["high"] + ornament_kit["high"], base_item["low"] + ornament_kit["low"]
+        elif item_id == 995:
+            high, low = 1, 1
+        else:
+            continue
+        unit_prices[item_id] = (high, low)
+
+    return unit_prices
+
+
+def compiled_unit_prices(price_table, item_ids):
+    return get_price_resolver().unit_prices(price_table=price_table, item_ids=item_ids)
+
+
+def best_of(func, *args):
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def main():
+    price_table = make_price_table()
+    resolver = get_price_resolver()
+    mapped_ids = resolver.rule_items.tolist()
+
+    all_ids = list(ITEM_IDS) + mapped_ids
+    assert compiled_unit_prices(price_table, all_ids) == legacy_unit_prices(price_table, all_ids)
+    print(f"compiled rules match the legacy rules for {len(all_ids):,} items")
+
+    PRICE_RESOLVER_MEMO.update({"source_key": None, "resolver": None})
+    start = time.perf_counter()
+    get_price_resolver()
+    print(f"resolver load from {RESOLVER_CACHE_FILE}: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    rng = np.random.default_rng(1)
+    print(f"{'items':>6} {'legacy (ms)':>12} {'compiled (ms)':>14} {'speedup':>8}")
+    for size in BANK_SIZES:
+        bank_ids = rng.choice(all_ids, size=size, replace=False).tolist()
+        legacy = best_of(legacy_unit_prices, price_table, bank_ids)
+        compiled = best_of(compiled_unit_prices, price_table, bank_ids)
+        print(f"{size:>6} {legacy:>12.2f} {compiled:>14.2f} {legacy / compiled:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Check -> /5m, /1h and /timeseries ingestion against the stand-in server replaying a fixture directory. Verifies that
+only tracked items are stored, that runs only fetch the buckets missing since the watermark and that new items are
+backfilled from /timeseries. Exits with an AssertionError if a case misbehaves.
+
+The fixtures are written in the api's response format by write_fixtures, record_fixtures of
+benchmarks.fake_prices_server can replace them with real recorded responses.
+Runs in a temporary working directory so Bank_Data.db of the app is left alone.
+Run from the repo root:
+    python -m benchmarks.price_timeseries
+"""
+import json
+import os
+from datetime import datetime, timezone
+
+from app.database import SessionLocal, init_db
+from app.crud.database import create_bank, bulk_create_bank_items, read_item_price_buckets
+from app.models.db_entry import ItemPriceBucket
+from app.utils import prices
+from app.utils.timeseries import TIMESTEPS, INITIAL_BUCKETS, latest_settled_bucket, ingest_price_history
+from benchmarks.fake_prices_server import fixture_name, start_fake_prices_server
+from benchmarks.workdir import temporary_workdir
+
+NOW = 1_760_000_000
+FIXTURE_HOURS = 48  # hours of buckets recorded before and after NOW
+BANK_ITEM_IDS = [2, 4151, 11802]
+UNTRACKED_ITEM_IDS = [563, 12934]  # in every api response but in no bank
+NEW_ITEM_ID = 13652
+
+
+def price_point(item_id: int, bucket_ts: int) -> dict:
+    price = 1000 + item_id + bucket_ts // 300 % 100
+    return {"avgHighPrice": price + 10, "highPriceVolume": 5, "avgLowPrice": price, "lowPriceVolume": 7}
+
+
+def write_fixtures(directory: str):
+    os.makedirs(directory)
+    all_item_ids = BANK_ITEM_IDS + UNTRACKED_ITEM_IDS + [NEW_ITEM_ID]
+
+    def write(endpoint, params, response):
+        with open(file=os.path.join(directory, fixture_name(endpoint, params)), mode="w", encoding="utf-8") as f:
+            json.dump(response, f)
+
+    for timestep in ("5m", "1h"):
+        step = TIMESTEPS[timestep]
+        buckets = range((NOW - FIXTURE_HOURS * 3600) // step * step, NOW + FIXTURE_HOURS * 3600, step)
+        for bucket_ts in buckets:
+            data = {str(item_id): price_point(item_id, bucket_ts) for item_id in all_item_ids}
+            write(f"/{timestep}", {"timestamp": bucket_ts}, {"data": data, "timestamp": bucket_ts})
+
+        for item_id in all_item_ids:
+            # /timeseries returns the 365 newest buckets, including the one still open
+            newest = NOW // step * step
+            points = [
+                {"timestamp": bucket_ts, **price_point(item_id, bucket_ts)}
+                for bucket_ts in range(newest - 364 * step, newest + step, step)
+            ]
+            write("/timeseries", {"id": item_id, "timestep": timestep}, {"data": points, "itemId": item_id})
+
+
+def add_bank(name: str, item_ids: list):
+    with SessionLocal() as db:
+        bank = create_bank(db, name=name, created_at=datetime.now(timezone.utc))
+        bulk_create_bank_items(db=db, bank_id=bank.id, items=[
+            {"item_id": item_id, "name": f"Item {item_id}", "quantity": 1, "is_tradeable": True}
+            for item_id in item_ids
+        ])
+        # Untradeable items and coins are never fetched
+        bulk_create_bank_items(db=db, bank_id=bank.id, items=[
+            {"item_id": 995, "name": "Coins", "quantity": 1000, "is_tradeable": True},
+            {"item_id": 9999, "name": "Quest item", "quantity": 1, "is_tradeable": False},
+        ])
+        db.commit()
+
+
+def requested(server, endpoint: str):
+    return [path for path in server.paths if path.startswith(f"/api/v1/osrs{endpoint}?")]
+
+
+def check_first_run(server):
+    report = ingest_price_history(now=NOW)
+
+    for timestep in ("5m", "1h"):
+        assert report[timestep]["items_backfilled"] == len(BANK_ITEM_IDS), report
+        assert report[timestep]["buckets"] == INITIAL_BUCKETS[timestep], report
+        assert report[timestep]["watermark"] == latest_settled_bucket(TIMESTEPS[timestep], NOW)
+    assert len(requested(server, "/timeseries")) == 2 * len(BANK_ITEM_IDS)
+
+    with SessionLocal() as db:
+        stored_ids = {item_id for item_id, in db.query(ItemPriceBucket.item_id).distinct()}
+        assert stored_ids == set(BANK_ITEM_IDS), stored_ids
+
+        # The open bucket /timeseries returned is not stored
+        newest = read_item_price_buckets(db=db, item_id=4151, timestep=300)[-1]
+        assert newest.bucket_ts == latest_settled_bucket(300, NOW), newest.bucket_ts
+        assert len(read_item_price_buckets(db=db, item_id=4151, timestep=3600)) == 364
+
+    print(f"first run: {report}")
+
+
+def check_no_refetch(server):
+    paths_before = len(server.paths)
+    report = ingest_price_history(now=NOW + 60)
+    assert len(server.paths) == paths_before, server.paths[paths_before:]
+    assert all(report[timestep]["rows"] == 0 for timestep in report), report
+    print("second run: nothing missing, no requests")
+
+
+def check_incremental(server):
+    paths_before = len(server.paths)
+    report = ingest_price_history(now=NOW + 3 * 3600)
+    new_paths = server.paths[paths_before:]
+
+    assert report["5m"]["buckets"] == 36 and report["1h"]["buckets"] == 3, report
+    assert report["5m"]["rows"] == 36 * len(BANK_ITEM_IDS), report
+    assert len(new_paths) == 39 and not any("/timeseries" in path for path in new_paths)
+    print(f"three hours later: {report['5m']['buckets']} /5m and {report['1h']['buckets']} /1h buckets fetched")
+
+
+def check_new_item_backfill(server):
+    add_bank("second_bank", BANK_ITEM_IDS[:1] + [NEW_ITEM_ID])
+    timeseries_before = len(requested(server, "/timeseries"))
+
+    report = ingest_price_history(now=NOW + 3 * 3600)
+    new_timeseries = requested(server, "/timeseries")[timeseries_before:]
+
+    assert report["5m"]["items_backfilled"] == 1 and report["1h"]["items_backfilled"] == 1, report
+    assert all(f"id={NEW_ITEM_ID}" in path for path in new_timeseries), new_timeseries
+    print(f"new bank: only item {NEW_ITEM_ID} backfilled from /timeseries")
+
+
+def main():
+    with temporary_workdir():
+        write_fixtures("fixtures")
+        init_db()
+        add_bank("first_bank", BANK_ITEM_IDS)
+
+        server = start_fake_prices_server(fixtures="fixtures")
+        prices.PRICES_API_URL = server.api_url
+
+        check_first_run(server)
+        check_no_refetch(server)
+        check_incremental(server)
+        check_new_item_backfill(server)
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
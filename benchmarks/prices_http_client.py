@@ -0,0 +1,149 @@
+"""
+Check -> prices api client against the local stand-in server: pooled connections, gzip, conditional requests with
+304 revalidation, the retry policy and request metrics. Exits with an AssertionError if a case misbehaves.
+
+Runs in a temporary working directory so cache/ of the app is left alone.
+Run from the repo root:
+    python -m benchmarks.prices_http_client
+"""
+import os
+import tempfile
+import time
+
+import requests
+
+from app.utils import prices
+from benchmarks.fake_prices_server import make_latest_prices, start_fake_prices_server
+
+REFRESHES = 20
+# Handshake cost of a new connection to the real api -> a few round trips at a typical 10-20 ms RTT
+CONNECT_LATENCY = 0.03
+
+
+def timed_requests(url: str, keep_alive: bool) -> float:
+    """:return: Float -> seconds per request of REFRESHES gets over one session, or a new session per get"""
+    session = prices.create_prices_session()
+    start = time.perf_counter()
+    for _ in range(REFRESHES):
+        if not keep_alive:
+            session.close()
+            session = prices.create_prices_session()
+        session.get(url).raise_for_status()
+    elapsed = time.perf_counter() - start
+    session.close()
+    return elapsed / REFRESHES
+
+
+def check_connection_pool(server):
+    # The app's client -> every refresh reuses the connection its shared session keeps alive
+    connections_before = len(server.connections)
+    for _ in range(REFRESHES):
+        prices.request_prices_api("/latest")
+    assert len(server.connections) - connections_before == 1, len(server.connections) - connections_before
+
+    # Same server, session and headers both ways, only whether the connection is kept alive differs
+    slow_server = start_fake_prices_server(connect_latency=CONNECT_LATENCY)
+    url = f"{slow_server.api_url}/latest"
+    pooled = timed_requests(url, keep_alive=True)
+    unpooled = timed_requests(url, keep_alive=False)
+    slow_server.shutdown()
+
+    assert len(slow_server.connections) == REFRESHES + 1, len(slow_server.connections)
+    assert pooled < unpooled - CONNECT_LATENCY / 2, (pooled, unpooled)
+    print(f"pool: {REFRESHES} refreshes over 1 connection, {pooled * 1000:.1f} ms/request vs "
+          f"{unpooled * 1000:.1f} ms with a new connection each ({CONNECT_LATENCY * 1000:.0f} ms handshake)")
+
+
+def check_gzip():
+    metrics = prices.PRICE_REQUEST_METRICS[-1]
+    assert metrics["wire_bytes"] < metrics["body_bytes"] / 3, metrics
+    print(f"gzip: {metrics['body_bytes']:,} bytes sent as {metrics['wire_bytes']:,}")
+
+
+def check_conditional_requests(server):
+    cache = prices.refresh_price_cache()
+    assert cache["etag"] and cache["last_modified"]
+
+    revalidated = prices.refresh_price_cache()
+    assert server.statuses[-1] == 304
+    assert revalidated["timestamp"] == cache["timestamp"], "a 304 must keep the fetch time of the prices"
+    assert revalidated["checked_at"] > cache["timestamp"]
+    assert revalidated["data"] == cache["data"]
+    assert prices.PRICE_REQUEST_METRICS[-1]["body_bytes"] == 0
+
+    # A 304 extends the cache -> no refresh is due again
+    prices.PRICE_CACHE_MEMO["cache"] = None
+    prices.PRICE_CACHE_MEMO["mtime_ns"] = None
+    assert not prices.price_cache_needs_refresh(prices.load_price_cache())
+
+    # Prices changed -> full response and new validators
+    server.set_latest(make_latest_prices(seed=1))
+    changed = prices.refresh_price_cache()
+    assert server.statuses[-1] == 200
+    assert changed["timestamp"] > cache["timestamp"] and changed["etag"] != cache["etag"]
+
+    # If-Modified-Since alone also revalidates
+    del changed["etag"]
+    assert prices.request_latest_prices(cache=changed)[0] is None
+    assert server.statuses[-1] == 304
+    print("conditional requests: unchanged prices revalidated with 304, changed prices downloaded")
+
+
+def check_retries(server):
+    # 503 -> retried until the server answers
+    server.failures = 2
+    requests_before = server.requests
+    assert prices.request_prices_api("/latest", backoff=0).status_code == 200
+    assert server.requests - requests_before == 3, server.requests - requests_before
+
+    # 404 -> a client error, raised on the first attempt
+    requests_before = server.requests
+    try:
+        prices.request_prices_api("/no-such-endpoint", backoff=0)
+        raise AssertionError("a 404 must be raised")
+    except requests.HTTPError as error:
+        assert error.response.status_code == 404
+    assert server.requests - requests_before == 1, server.requests - requests_before
+
+    # Connection refused -> retried, then raised
+    closed_url = prices.PRICES_API_URL
+    prices.PRICES_API_URL = "http://127.0.0.1:9/api/v1/osrs"
+    metrics_before = len(prices.PRICE_REQUEST_METRICS)
+    try:
+        prices.request_prices_api("/latest", retries=2, backoff=0)
+        raise AssertionError("a refused connection must be raised")
+    except requests.ConnectionError:
+        pass
+    finally:
+        prices.PRICES_API_URL = closed_url
+    assert len(prices.PRICE_REQUEST_METRICS) - metrics_before == 2
+    print("retries: 503s and refused connections retried, 404 raised on the first attempt")
+
+
+def check_metrics():
+    assert all(
+        {"url", "status", "wire_bytes", "body_bytes", "seconds", "at"} <= metrics.keys()
+        for metrics in prices.PRICE_REQUEST_METRICS
+    )
+    statuses = [metrics["status"] for metrics in prices.PRICE_REQUEST_METRICS]
+    print(f"metrics: {len(statuses)} requests recorded, {statuses.count(304)} were 304")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        os.makedirs("cache", exist_ok=True)
+
+        server = start_fake_prices_server()
+        prices.PRICES_API_URL = server.api_url
+
+        check_connection_pool(server)
+        check_gzip()
+        check_conditional_requests(server)
+        check_retries(server)
+        check_metrics()
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
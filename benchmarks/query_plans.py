@@ -0,0 +1,119 @@
+"""
+Check -> EXPLAIN QUERY PLAN of the hot price history queries on a migrated legacy database.
+Fails with an AssertionError if any of them falls back to a full scan of a price history table.
+
+Run from the repo root:
+    python -m benchmarks.query_plans
+"""
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine, event, insert, text
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.migrations import get_schema_version, run_migrations
+from app.crud.database import create_bank, bulk_create_bank_items
+from app.models.db_entry import PriceSnapshot
+from app.crud.database import read_latest_item_snapshot, read_single_item_snapshots, get_latest_snapshot_time
+from app.crud.database import read_latest_bank_snapshots
+
+PRICE_HISTORY_TABLES = ["price_snapshots", "item_prices", "bank_price_runs"]
+
+HOT_QUERIES = {
+    "read_latest_item_snapshot": lambda db: read_latest_item_snapshot(db=db, item_name="Item 7", bank_name="bank_1"),
+    "read_single_item_snapshots": lambda db: read_single_item_snapshots(db=db, item_name="Item 7", bank_name="bank_1"),
+    "get_latest_snapshot_time": lambda db: get_latest_snapshot_time(db=db, passed_bank_id=1),
+    "read_latest_bank_snapshots": lambda db: read_latest_bank_snapshots(db=db, bank_name="bank_1"),
+}
+
+
+def create_legacy_database(engine, banks: int = 3, items: int = 200, refreshes: int = 10):
+    """Builds the schema as it was before migration 1 -> no price_snapshots indexes, user_version 0."""
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        connection.execute(text("DROP INDEX ix_price_snapshots_bank_item_id_timestamp"))
+        connection.execute(text("DROP INDEX ix_price_snapshots_item_name_timestamp"))
+
+    start = datetime.now(timezone.utc)
+    with sessionmaker(bind=engine)() as db:
+        for bank_number in range(1, banks + 1):
+            bank = create_bank(db, name=f"bank_{bank_number}", created_at=start)
+            bank_items = [{"item_id": i, "name": f"Item {i}", "quantity": 1} for i in range(items)]
+            bank_item_ids = bulk_create_bank_items(db=db, bank_id=bank.id, items=bank_items)
+            db.execute(insert(PriceSnapshot), [
+                {
+                    "bank_item_id": bank_item_id,
+                    "item_name": bank_item["name"],
+                    "timestamp": start + timedelta(hours=12 * refresh),
+                    "high_value_estimate": 100,
+                    "low_value_estimate": 90,
+                    "mean_value_estimate": 95,
+                }
+                for refresh in range(refreshes)
+                for bank_item_id, bank_item in zip(bank_item_ids, bank_items)
+            ])
+        db.commit()
+
+
+def capture_statements(engine, query):
+    """Runs query and returns every (statement, parameters) it sent to SQLite."""
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        with sessionmaker(bind=engine)() as db:
+            query(db)
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+
+    return statements
+
+
+def explain_query_plan(engine, statement: str, parameters) -> list[str]:
+    with engine.connect() as connection:
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+    return [row[-1] for row in rows]
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp_dir, 'legacy.db')}")
+        create_legacy_database(engine)
+
+        with engine.connect() as connection:
+            assert get_schema_version(connection) == 0
+
+        run_migrations(engine)
+
+        for name, query in HOT_QUERIES.items():
+            touches_history = False
+            # Bank names are resolved to an id by their own lookup first -> only the history reads are checked
+            for statement, parameters in capture_statements(engine, query):
+                plan = explain_query_plan(engine, statement, parameters)
+                history_steps = [step for step in plan if any(table in step for table in PRICE_HISTORY_TABLES)]
+                if not history_steps:
+                    continue
+
+                touches_history = True
+                print(f"{name}:")
+                for step in plan:
+                    print(f"    {step}")
+
+                for table in PRICE_HISTORY_TABLES:
+                    assert not any(step.startswith(f"SCAN {table}") for step in history_steps), (
+                        f"{name} scans {table} without an index"
+                    )
+            assert touches_history, f"{name} does not touch the price history tables"
+
+        engine.dispose()
+
+    print("All hot queries use the price history indexes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+Benchmark -> replays months of generated price history into a fresh database as fast as the snapshot pipeline can
+write it, then times the history queries against the result. A recorded slice is replayed into a second database to
+check that replay and synthetic providers write identical valuations.
+
+Runs in a temporary working directory so Bank_Data.db of the app is left alone.
+Run from the repo root:
+    python -m benchmarks.replay_history [--banks 3] [--items 1000] [--ticks 360]
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timezone
+
+from app import database
+from app.crud.database import read_latest_bank_valuation, read_single_item_snapshots
+from app.models.db_entry import BankValuation
+from app.utils.archive import read_price_history
+from app.utils.compaction import database_size
+from app.utils.price_providers import SyntheticPriceProvider, ReplayPriceProvider, record_ticks
+from app.utils.snapshot import initial_enter_all_items_current_price, enter_all_banks_current_price
+from benchmarks.workdir import temporary_workdir
+
+MAPPING_FILES = ["items/tradeable_if_uncharged.json", "items/item_plus_ornament_kit.json"]
+RECORDED_TICKS = 20
+START = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def write_bank_files(banks: int, items: int):
+    for bank_number in range(banks):
+        bank_items = [
+            {"item_id": item_id, "item_name": f"Item {item_id}", "quantity": (item_id * (bank_number + 3)) % 97 + 1}
+            for item_id in range(1, items + 1)
+        ]
+        with open(file=f"items/bank_{bank_number}.json", mode="w", encoding="utf-8") as f:
+            json.dump(bank_items, f)
+
+
+def replay(provider, banks: int):
+    """Imports the banks at the provider's first tick, then refreshes them at every following tick."""
+    with database.SessionLocal() as db:
+        for bank_number in range(banks):
+            initial_enter_all_items_current_price(
+                db=db,
+                file_name=f"bank_{bank_number}",
+                bank_name=f"bank_{bank_number}",
+                provider=provider,
+            )
+
+    ticks = 1
+    while provider.advance():
+        enter_all_banks_current_price(provider=provider)
+        ticks += 1
+    return ticks
+
+
+def valuations():
+    with database.SessionLocal() as db:
+        return [
+            (v.bank_id, v.timestamp, v.low_value_total, v.mean_value_total, v.high_value_total)
+            for v in db.query(BankValuation).order_by(BankValuation.bank_id, BankValuation.timestamp)
+        ]
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--banks", type=int, default=3)
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--ticks", type=int, default=360, help="12 hour ticks, 360 -> 6 months")
+    args = parser.parse_args()
+
+    repo_dir = os.getcwd()
+    with temporary_workdir():
+        os.makedirs("items")
+        for mapping_file in MAPPING_FILES:
+            shutil.copy(os.path.join(repo_dir, mapping_file), mapping_file)
+        write_bank_files(banks=args.banks, items=args.items)
+
+        # Synthetic replay of the full history
+        database.init_db()
+        provider = SyntheticPriceProvider(item_ids=range(1, args.items + 1), ticks=args.ticks, start=START, seed=1)
+        start = time.perf_counter()
+        ticks = replay(provider=provider, banks=args.banks)
+        elapsed = time.perf_counter() - start
+        with database.engine.connect() as connection:
+            size, _ = database_size(connection)
+
+        print(f"replayed {ticks} ticks x {args.banks} banks x {args.items} items in {elapsed:.2f}s "
+              f"({ticks / elapsed:.1f} ticks/s), database {size / 1024 / 1024:.1f} MB")
+
+        with database.SessionLocal() as db:
+            cases = {
+                "latest bank valuation": lambda: read_latest_bank_valuation(db=db, bank_name="bank_0"),
+                "item history, ORM": lambda: read_single_item_snapshots(db=db, item_name="Item 7", bank_name="bank_0"),
+                "item history, read_price_history": lambda: read_price_history(bank_name="bank_0", item_name="Item 7"),
+                "bank history, read_price_history": lambda: read_price_history(bank_name="bank_0"),
+            }
+            for name, func in cases.items():
+                rows, ms = timed(func)
+                count = len(rows) if hasattr(rows, "__len__") else 1
+                print(f"{name:<36} {ms:>9.1f} ms  ({count} rows)")
+
+        # Record the first ticks, replay the recording into a fresh database and compare
+        record_ticks(
+            SyntheticPriceProvider(item_ids=range(1, args.items + 1), ticks=RECORDED_TICKS, start=START, seed=2),
+            path="recording.jsonl",
+        )
+        database.engine.dispose()
+        os.remove("Bank_Data.db")
+        database.init_db()
+        replay(provider=SyntheticPriceProvider(item_ids=range(1, args.items + 1), ticks=RECORDED_TICKS, start=START, seed=2),
+               banks=args.banks)
+        synthetic = valuations()
+
+        database.engine.dispose()
+        os.remove("Bank_Data.db")
+        database.init_db()
+        replay(provider=ReplayPriceProvider("recording.jsonl"), banks=args.banks)
+        replayed = valuations()
+
+        assert replayed == synthetic and len(replayed) == RECORDED_TICKS * args.banks, (len(replayed), len(synthetic))
+        print(f"recording replay: {RECORDED_TICKS} ticks match the synthetic run")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Benchmark -> comparing N banks against a baseline. The old page valued each bank on its own, built frames of its items
+and outer merged every bank with the baseline by name before np.select labelled the rows. compare_banks values every
+bank in one batched pass and pivots the items into (items, banks) matrices once. Checks both give the same quantity
+and value differences.
+
+Runs in a temporary working directory so Bank_Data.db of the app is left alone.
+Run from the repo root:
+    python -m benchmarks.snapshot_compare [--banks 8] [--items 1500]
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from app import database
+from app.crud.database import get_bank_id_by_name
+from app.utils.comparison import compare_banks
+from app.utils.price_providers import SyntheticPriceProvider
+from app.utils.snapshot import enter_new_bank
+from app.utils.transformers import reorder_df
+from app.utils.valuation import value_latest_snapshots
+from benchmarks.workdir import temporary_workdir
+
+ITEM_IDS = np.arange(1, 4001)
+
+
+def populate(args):
+    rng = np.random.default_rng(11)
+    provider = SyntheticPriceProvider(item_ids=ITEM_IDS, ticks=1, seed=12)
+    bank_names = [f"bank_{bank_number}" for bank_number in range(args.banks)]
+    for bank_name in bank_names:
+        items = [{"item_id": int(item_id), "item_name": f"Item {item_id}", "quantity": int(rng.integers(1, 10 ** 4))}
+                 for item_id in rng.choice(ITEM_IDS, size=args.items, replace=False)]
+        with database.SessionLocal() as db:
+            enter_new_bank(db=db, items=items, bank_name=bank_name, provider=provider)
+
+    return bank_names
+
+
+def merge_each_bank(bank_names: list, valuation_type: str = "mean_value"):
+    """The old page -> every bank merged with the baseline by name, repeated for each bank"""
+    with database.SessionLocal() as db:
+        bank_ids = [get_bank_id_by_name(db=db, bank_name=bank_name) for bank_name in bank_names]
+
+    baseline_name, baseline_id = bank_names[0], bank_ids[0]
+    merged = {}
+    for bank_name, bank_id in zip(bank_names[1:], bank_ids[1:]):
+        valuations = value_latest_snapshots(bank_ids=[baseline_id, bank_id])
+        column_order = ["name", "quantity", valuation_type]
+        df_baseline = reorder_df(df=valuations.items(bank_id=baseline_id), order=column_order)
+        df_bank = reorder_df(df=valuations.items(bank_id=bank_id), order=column_order)
+
+        merged_df = pd.merge(df_baseline, df_bank, on="name", how="outer", suffixes=(f"_{baseline_name}",
+                                                                                       f"_{bank_name}"))
+        merged_df["quantity_diff"] = (
+            merged_df[f"quantity_{bank_name}"].fillna(0) - merged_df[f"quantity_{baseline_name}"].fillna(0)
+        )
+        merged_df[f"{valuation_type}_diff"] = (
+            merged_df[f"{valuation_type}_{bank_name}"].fillna(0) - merged_df[f"{valuation_type}_{baseline_name}"].fillna(0)
+        )
+        merged_df["quantity_direction"] = np.select(
+            [
+                merged_df[f"quantity_{baseline_name}"].isna() & ~merged_df[f"quantity_{bank_name}"].isna(),
+                merged_df[f"quantity_{bank_name}"].isna() & ~merged_df[f"quantity_{baseline_name}"].isna(),
+                merged_df[f"quantity_{baseline_name}"] > merged_df[f"quantity_{bank_name}"],
+                merged_df[f"quantity_{baseline_name}"] < merged_df[f"quantity_{bank_name}"],
+            ],
+            ["not in baseline", "only in baseline", "fewer", "more"],
+            default="same",
+        )
+        merged[bank_name] = merged_df.set_index("name").sort_index()
+
+    return merged
+
+
+def timed(func, repeat: int = 3):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return result, (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--banks", type=int, default=8)
+    parser.add_argument("--items", type=int, default=1500)
+    args = parser.parse_args()
+
+    with temporary_workdir():
+        database.init_db()
+        bank_names = populate(args)
+
+        merged, merge_seconds = timed(lambda: merge_each_bank(bank_names=bank_names))
+        frame, engine_seconds = timed(
+            lambda: compare_banks(bank_names=bank_names).items_frame(baseline=bank_names[0])
+        )
+        frame = frame.set_index("name").sort_index()
+
+        for bank_name, merged_df in merged.items():
+            compared = frame.loc[merged_df.index]
+            assert (compared[f"quantity_diff_{bank_name}"].to_numpy() == merged_df["quantity_diff"].to_numpy()).all()
+            assert np.allclose(compared[f"mean_value_diff_{bank_name}"], merged_df["mean_value_diff"])
+            assert (compared[f"change_{bank_name}"].to_numpy() == merged_df["quantity_direction"].to_numpy()).all()
+        # Items held by none of the compared pairs' banks only show in the N-way frame, with no difference
+        assert len(frame) >= max(len(merged_df) for merged_df in merged.values())
+
+        comparison = compare_banks(bank_names=bank_names)
+        pairwise = comparison.pairwise_totals()
+        totals = comparison.totals()
+        assert np.allclose(pairwise.loc[bank_names[0], bank_names[1]], totals[1] - totals[0])
+
+        print(f"{args.banks} banks x {args.items} items against {bank_names[0]}")
+        print(f"merge each bank with the baseline: {merge_seconds * 1000:8.1f} ms")
+        print(f"compare_banks + items_frame:       {engine_seconds * 1000:8.1f} ms "
+              f"({merge_seconds / engine_seconds:.1f}x)")
+        print("quantity, value differences and change labels match the merged frames")
+
+
+if __name__ == '__main__':
+    main()
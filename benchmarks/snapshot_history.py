@@ -0,0 +1,139 @@
+"""
+Check -> a price snapshot keeps the value it was written with. Snapshots are read back as BankItem.quantity x the
+ItemPrice of the run, so they stay correct only if every run reads the holdings the bank had when it was taken. Banks
+sharing price runs are refreshed, the holdings of one are changed at a new version, and every snapshot written before
+is compared with what it read right after it was written and with the BankValuation totals of its run. Finally every
+run is compacted into one bucket, runs valued against different holdings must stay apart.
+
+Runs in a temporary working directory so Bank_Data.db of the app is left alone.
+Run from the repo root:
+    python -m benchmarks.snapshot_history [--refreshes 10]
+"""
+import argparse
+from collections import defaultdict
+from datetime import timedelta
+
+import numpy as np
+
+from app import database
+from app.crud.database import query_price_snapshots, bulk_create_bank_items, retire_bank_items, get_bank_id_by_name
+from app.models.db_entry import Bank, BankPriceRun, BankValuation
+from app.utils.compaction import compact_price_history
+from app.utils.price_providers import SyntheticPriceProvider
+from app.utils.price_resolver import get_price_resolver
+from app.utils.snapshot import enter_new_bank, enter_all_banks_current_price, enter_price_run
+from benchmarks.workdir import temporary_workdir
+
+ITEM_IDS = np.arange(1, 6)
+BANKS = {
+    "bank_a": {1: 10, 2: 5},
+    # Holds item 3 -> its price is in every run bank_a shares, bank_a's snapshots must still leave it out
+    "bank_b": {2: 1, 3: 7},
+}
+
+
+def as_items(holdings: dict):
+    return [{"item_id": item_id, "item_name": f"Item {item_id}", "quantity": quantity}
+            for item_id, quantity in holdings.items()]
+
+
+def read_snapshots():
+    """:return: Dict -> {(bank name, timestamp): {item name: (low, mean, high)}}"""
+    snapshots = defaultdict(dict)
+    with database.SessionLocal() as db:
+        rows = query_price_snapshots(db).add_columns(Bank.name).join(Bank, Bank.id == BankPriceRun.bank_id)
+        for row in rows:
+            snapshots[(row.name, row.timestamp)][row.item_name] = (
+                row.low_value_estimate, row.mean_value_estimate, row.high_value_estimate,
+            )
+    return dict(snapshots)
+
+
+def read_valuations():
+    """:return: Dict -> {(bank name, timestamp): (low, mean, high) totals}"""
+    with database.SessionLocal() as db:
+        rows = db.query(Bank.name, BankValuation).join(BankValuation.bank)
+        return {
+            (name, valuation.timestamp): (valuation.low_value_total, valuation.mean_value_total,
+                                          valuation.high_value_total)
+            for name, valuation in rows
+        }
+
+
+def check_totals(snapshots: dict, valuations: dict):
+    """Every run's item snapshots add up to the BankValuation written with it"""
+    assert set(snapshots) == set(valuations), set(snapshots) ^ set(valuations)
+    for key, items in snapshots.items():
+        totals = tuple(sum(values[column] for values in items.values()) for column in range(3))
+        assert np.allclose(totals, valuations[key]), (key, totals, valuations[key])
+
+
+def change_holdings(provider, bank_name: str, holdings: dict, version: int):
+    """Retires every item of the bank and holds holdings from version on, valued at the provider's next tick"""
+    provider.advance()
+    price_table = provider.price_table()
+    with database.SessionLocal() as db:
+        bank_id = get_bank_id_by_name(db=db, bank_name=bank_name)
+        retire_bank_items(db=db, bank_id=bank_id, item_ids=ITEM_IDS.tolist(), version=version)
+        bulk_create_bank_items(db=db, bank_id=bank_id, items=[
+            {"item_id": item_id, "name": f"Item {item_id}", "quantity": quantity, "since_version": version}
+            for item_id, quantity in holdings.items()
+        ])
+        enter_price_run(
+            db=db,
+            bank_id=bank_id,
+            version=version,
+            snapshot_time=provider.now(),
+            fetched_at=price_table.fetched_at,
+            unit_prices=get_price_resolver().unit_prices(price_table=price_table, item_ids=list(holdings)),
+            bank_items=[{"item_id": item_id, "quantity": quantity} for item_id, quantity in holdings.items()],
+        )
+        db.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--refreshes", type=int, default=10)
+    args = parser.parse_args()
+
+    with temporary_workdir():
+        database.init_db()
+        provider = SyntheticPriceProvider(item_ids=ITEM_IDS, ticks=args.refreshes + 3, seed=4)
+        for bank_name, holdings in BANKS.items():
+            with database.SessionLocal() as db:
+                enter_new_bank(db=db, items=as_items(holdings), bank_name=bank_name, provider=provider)
+        for _ in range(args.refreshes):
+            provider.advance()
+            enter_all_banks_current_price(provider=provider)
+
+        written = read_snapshots()
+        check_totals(snapshots=written, valuations=read_valuations())
+        assert all("Item 3" not in items for (bank_name, _), items in written.items() if bank_name == "bank_a")
+        print(f"{len(written)} snapshots of {len(BANKS)} banks sharing price runs add up to their valuations")
+
+        # bank_a changes item 1 from 10 to 1000, drops item 2 and takes item 3, which bank_b's runs already priced
+        change_holdings(provider=provider, bank_name="bank_a", holdings={1: 1000, 3: 4}, version=2)
+        with database.SessionLocal() as db:
+            enter_new_bank(db=db, items=as_items({1: 2, 4: 3}), bank_name="bank_c", provider=provider)
+
+        after = read_snapshots()
+        check_totals(snapshots=after, valuations=read_valuations())
+        for key, items in written.items():
+            assert after[key] == items, (key, items, after[key])
+
+        latest = max(key for key in after if key[0] == "bank_a")
+        assert set(after[latest]) == {"Item 1", "Item 3"}, after[latest]
+        print(f"{len(written)} snapshots unchanged after new holdings and a new bank, "
+              f"{len(after) - len(written)} new snapshots add up to their valuations")
+
+        # One bucket for every run -> one snapshot per bank and holdings version is left
+        compact_price_history(tiers=[(timedelta(0), timedelta(weeks=52 * 100))], vacuum=None)
+        compacted = read_snapshots()
+        assert set(compacted) == set(read_valuations())
+        bank_a = sorted(set(items) for (bank_name, _), items in compacted.items() if bank_name == "bank_a")
+        assert bank_a == [{"Item 1", "Item 2"}, {"Item 1", "Item 3"}], bank_a
+        print(f"compacted to {len(compacted)} snapshots, one per bank and holdings version")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+"""
+Benchmark -> values 10 banks x 1,000 items against 1,000 stored price runs with the batched valuation engine, vs the
+per-item dict loop of enter_price_run and a SQL GROUP BY over the price snapshots. Checks the engine reproduces the
+materialized BankValuations, the latest snapshot values and the current price path.
+
+Runs in a temporary working directory so Bank_Data.db of the app is left alone.
+Run from the repo root:
+    python -m benchmarks.valuation_engine [--banks 10] [--items 1000] [--runs 1000]
+"""
+import argparse
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+from sqlalchemy import insert, func
+
+from app import database
+from app.crud.database import create_bank, bulk_create_bank_items, query_price_snapshots, read_all_items_by_bank_ids
+from app.models.db_entry import PriceRun, ItemPrice, BankPriceRun, BankValuation
+from app.utils.price_providers import SyntheticPriceProvider
+from app.utils.price_resolver import get_price_resolver
+from app.utils.snapshot import resolve_bank_item_prices
+from app.utils.valuation import BankHoldings, PriceMatrix, value_banks, value_all_banks, value_price_history
+from app.utils.valuation import value_latest_snapshots
+from benchmarks.workdir import temporary_workdir
+
+START = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def make_provider(args):
+    # Banks draw their items from twice as many ids, so they partly overlap like real banks do
+    return SyntheticPriceProvider(item_ids=range(1, 2 * args.items + 1), ticks=args.runs, start=START, seed=3)
+
+
+def populate(args):
+    """
+    Writes the banks, one PriceRun per tick and every bank valued at every run. Valuation totals are the per-item
+    dict loop of enter_price_run, written in bulk since the write path is not what is measured here.
+    :return: Tuple -> (bank items {bank_id: [dict]}, unit prices of every run [{item_id: (high, low)}])
+    """
+    rng = np.random.default_rng(4)
+    provider = make_provider(args)
+    bank_items = {}
+    all_unit_prices = []
+
+    with database.SessionLocal() as db:
+        for bank_number in range(args.banks):
+            bank = create_bank(db=db, name=f"bank_{bank_number}", created_at=START)
+            item_ids = rng.choice(np.arange(1, 2 * args.items + 1), size=args.items, replace=False)
+            items = [
+                {"item_id": int(item_id), "name": f"Item {item_id}", "quantity": int(rng.integers(1, 10 ** 4)),
+                 "is_tradeable": True}
+                for item_id in item_ids
+            ]
+            bulk_create_bank_items(db=db, bank_id=bank.id, items=items)
+            bank_items[bank.id] = items
+
+        while True:
+            price_table = provider.price_table()
+            timestamp = provider.now()
+            run_id = db.execute(insert(PriceRun).returning(PriceRun.id), {"fetched_at": timestamp}).scalar_one()
+            item_ids = np.flatnonzero(price_table.found)
+            unit_prices = dict(zip(item_ids.tolist(), map(tuple, price_table.prices[item_ids, :2].tolist())))
+            all_unit_prices.append(unit_prices)
+
+            db.connection().execute(insert(ItemPrice), [
+                {"run_id": run_id, "item_id": item_id, "high": high, "low": low}
+                for item_id, (high, low) in unit_prices.items()
+            ])
+            db.connection().execute(insert(BankPriceRun), [
+                {"bank_id": bank_id, "run_id": run_id, "timestamp": timestamp} for bank_id in bank_items
+            ])
+            db.connection().execute(insert(BankValuation), [
+                {"bank_id": bank_id, "timestamp": timestamp, **dict(zip(
+                    ["low_value_total", "mean_value_total", "high_value_total", "item_count"],
+                    loop_totals(unit_prices=unit_prices, items=items),
+                ))}
+                for bank_id, items in bank_items.items()
+            ])
+
+            if not provider.advance():
+                break
+
+        db.commit()
+
+    return bank_items, all_unit_prices
+
+
+def loop_totals(unit_prices: dict, items: list):
+    """Totals the way enter_price_run adds them up -> one dict lookup per item."""
+    low_value = 0
+    high_value = 0
+    item_count = 0
+    for bank_item in items:
+        if bank_item["item_id"] not in unit_prices:
+            continue
+
+        high, low = unit_prices[bank_item["item_id"]]
+        high_value += high * bank_item["quantity"]
+        low_value += low * bank_item["quantity"]
+        item_count += 1
+
+    return low_value, (high_value + low_value) / 2, high_value, item_count
+
+
+def sql_totals():
+    with database.SessionLocal() as db:
+        snapshots = query_price_snapshots(db).add_columns(BankPriceRun.bank_id).subquery()
+        return (
+            db.query(
+                snapshots.c.bank_id,
+                snapshots.c.timestamp,
+                func.sum(snapshots.c.low_value_estimate),
+                func.sum(snapshots.c.high_value_estimate),
+            )
+            .group_by(snapshots.c.bank_id, snapshots.c.timestamp)
+            .all()
+        )
+
+
+def stored_valuations():
+    with database.SessionLocal() as db:
+        return db.query(
+            BankValuation.bank_id, BankValuation.low_value_total, BankValuation.mean_value_total,
+            BankValuation.high_value_total, BankValuation.item_count,
+        ).order_by(BankValuation.bank_id, BankValuation.timestamp).all()
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--banks", type=int, default=10)
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--runs", type=int, default=1000)
+    args = parser.parse_args()
+
+    with temporary_workdir():
+        database.init_db()
+        (bank_items, all_unit_prices), elapsed = timed(lambda: populate(args))
+        print(f"populated {args.banks} banks x {args.items} items x {args.runs} runs in {elapsed:.1f}s")
+
+        # Every bank at every run
+        valuations, engine_seconds = timed(lambda: value_price_history())
+        with database.SessionLocal() as db:
+            holdings, load_holdings_seconds = timed(lambda: BankHoldings.load(db=db))
+            runs = db.query(PriceRun.id, PriceRun.fetched_at).order_by(PriceRun.fetched_at).all()
+            prices, load_prices_seconds = timed(lambda: PriceMatrix.from_runs(db=db, runs=runs))
+        _, compute_seconds = timed(lambda: value_banks(holdings=holdings, prices=prices))
+        _, loop_seconds = timed(lambda: [
+            loop_totals(unit_prices=unit_prices, items=items)
+            for unit_prices in all_unit_prices for items in bank_items.values()
+        ])
+        sql_rows, sql_seconds = timed(sql_totals)
+
+        engine_rows = [
+            (int(bank_id), int(low), float(mean), int(high), int(count))
+            for bank, bank_id in enumerate(valuations.holdings.bank_ids)
+            for low, mean, high, count in zip(valuations.low_total[:, bank], valuations.mean_total[:, bank],
+                                              valuations.high_total[:, bank], valuations.item_count[:, bank])
+        ]
+        assert engine_rows == [tuple(row) for row in stored_valuations()]
+        assert len(sql_rows) == len(engine_rows)
+        print(f"engine totals match {len(engine_rows):,} materialized BankValuations")
+
+        valued_items = args.banks * args.items * args.runs
+        print(f"{'path':<40} {'seconds':>8} {'item values/s':>14}")
+        for name, seconds in [
+            ("per-item dict loop (prices in memory)", loop_seconds),
+            ("SQL GROUP BY over price snapshots", sql_seconds),
+            ("engine, value_price_history", engine_seconds),
+            ("  load holdings", load_holdings_seconds),
+            ("  load + pivot price runs", load_prices_seconds),
+            ("  value_banks (NumPy only)", compute_seconds),
+        ]:
+            print(f"{name:<40} {seconds:>8.3f} {valued_items / seconds:>14,.0f}")
+
+        # Each bank at its own latest snapshot -> the compare page
+        bank_ids = list(bank_items)
+        latest = value_latest_snapshots(bank_ids=bank_ids)
+        last_unit_prices = all_unit_prices[-1]
+        for bank_id in bank_ids:
+            low, mean, high, _ = loop_totals(unit_prices=last_unit_prices, items=bank_items[bank_id])
+            assert latest.bank_totals(bank_id=bank_id) == (low, mean, high)
+            items = latest.items(bank_id=bank_id)
+            assert int(items["low_value"].sum()) == low and int(items["high_value"].sum()) == high
+        print("latest snapshot valuations match")
+
+        # Historical revaluation at a timestamp -> the run at or before it
+        middle = runs[len(runs) // 2]
+        at_run = value_all_banks(at=middle.fetched_at.replace(tzinfo=timezone.utc))
+        assert (at_run.low_total[0] == valuations.low_total[len(runs) // 2]).all()
+        print(f"revaluation at {middle.fetched_at} matches run {middle.id}")
+
+        # Current prices -> the same path the snapshot functions price a bank with
+        provider = make_provider(args)
+        current = value_all_banks(provider=provider)
+        resolver = get_price_resolver()
+        with database.SessionLocal() as db:
+            items_by_bank = read_all_items_by_bank_ids(db=db, bank_ids=bank_ids)
+        for bank_id, items in items_by_bank.items():
+            unit_prices = resolve_bank_item_prices(items=items, price_table=provider.price_table(), resolver=resolver)
+            low, mean, high, count = loop_totals(
+                unit_prices=unit_prices,
+                items=[{"item_id": item.item_id, "quantity": item.quantity} for item in items],
+            )
+            assert current.bank_totals(bank_id=bank_id) == (low, mean, high)
+        print("current price valuations match the snapshot pricing path")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+"""Shared setup of the benchmarks and checks that run the app in a throwaway working directory."""
+import os
+import tempfile
+from contextlib import contextmanager
+
+from app import database
+
+
+@contextmanager
+def temporary_workdir():
+    """
+    chdir into a temporary directory and point the app's engine and SessionLocal at a Bank_Data.db inside it.
+    SQLAlchemy resolves the relative DATABASE_URL when the engine is created at import, so chdir alone would keep
+    writing to the app's own database.
+    """
+    cwd = os.getcwd()
+    app_engine = database.engine
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        database.engine = database.create_db_engine()
+        database.SessionLocal.configure(bind=database.engine)
+        try:
+            yield tmp_dir
+        finally:
+            database.engine.dispose()
+            database.engine = app_engine
+            database.SessionLocal.configure(bind=app_engine)
+            os.chdir(cwd)
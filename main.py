@@ -3,6 +3,10 @@ from app.crud.database import get_all_tradeable_if_uncharged_items, get_all_bank
 from app.database import init_db, SessionLocal
 from app.utils.file_io import convert_all_items_to_json
 from app.utils.snapshot import initial_enter_all_items_current_price, enter_all_items_current_price
+from app.utils.snapshot import enter_all_banks_current_price
+from app.utils.timeseries import ingest_price_history
+from app.utils.batch_import import import_bank_directory
+from app.utils.price_providers import SyntheticPriceProvider
 
 # Notice -> Snapshot len will be less than total bank spots used because bank spots used counts place-holders
 
@@ -44,9 +48,23 @@ if __name__ == '__main__':
     #         print(snapshot.low_value_estimate, snapshot.high_value_estimate, snapshot.mean_value_estimate)
     #         print("---")
 
+    # or import a directory of saved Bank Memory exports, one bank per .txt named after the file
+    # import_bank_directory(directory="items/exports")
+
     # step 3 -> In the future, get current pricing of items from file_requested and add snapshot data to each entry
     # enter_all_items_current_price(bank_name=bank_name)
 
+    # or refresh every bank off one price fetch in one transaction
+    # print(enter_all_banks_current_price())
+
+    # or write generated price history for every bank, one refresh per 12 hour tick
+    # provider = SyntheticPriceProvider(item_count=30000, ticks=360)
+    # while provider.advance():
+    #     enter_all_banks_current_price(provider=provider)
+
+    # fetch the /5m and /1h price buckets of every banked item missing since the last run
+    # print(ingest_price_history())
+
     # step 4 -> look at two snapshots
     # item_to_query = "Confliction gauntlets"
     # with SessionLocal() as db:
@@ -1,6 +1,7 @@
 import streamlit as st
 
-from app.database import init_db
+from app.database import init_db, read_db_generation
+from app.utils.prices import start_price_refresher
 from ui.bank_browser import display_bank_browser
 from ui.item_compare import display_item_compare
 from ui.snapshot_compare import display_snapshot_compare
@@ -13,6 +14,12 @@ def main():
         init_db()
         st.session_state.db_initialized = True
 
+    # Once per rerun -> cached reads see writes committed by other processes since the last one
+    read_db_generation()
+
+    # One refresher per process, later calls from other sessions are no-ops
+    start_price_refresher()
+
     # Header Creation
     st.markdown(
         "<h1 style='color:#FFA500; text-align: center; '>ORANGELIQUID</h1>",
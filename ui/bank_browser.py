@@ -1,19 +1,43 @@
+import os
+
+import pandas as pd
 import streamlit as st
 
 from app.database import SessionLocal
-from app.crud.database import get_all_banks, get_bank_id_by_name, read_all_items_by_bank_id, delete_bank
-from app.crud.database import read_latest_item_snapshot, bank_name_is_unique
-from app.utils.transformers import to_dataframe, add_style_to_df
-from app.utils.file_io import enter_tsv_into_db, convert_all_items_to_json
-from app.utils.snapshot import initial_enter_all_items_current_price
+from app.crud.database import delete_bank, bank_name_is_unique, BANK_ITEM_SORT_COLUMNS
+from app.utils.transformers import reorder_df, add_style_to_df
+from app.utils.file_io import parse_bank_tsv
+from app.utils.snapshot import enter_bank_tsv, find_duplicate_bank, link_bank_name
+from app.utils.batch_import import import_bank_directory
+from app.utils.versions import enter_bank_version
+from app.utils.compaction import compact_price_history
+from app.utils.archive import export_price_history
 from ui.utils.clipboard import verify_tsv
-from app.utils.file_io import delete_file
-from ui.utils.valuation import calculate_valuation
+from ui.utils.cache import cached_banks, cached_bank_id, cached_alias_names, cached_valuation, cached_bank_items_page
+
+# Filter choices of the bank item browser -> None shows both
+FILTER_OPTIONS = {"Any": None, "Yes": True, "No": False}
+
+
+def show_version_report(bank_name: str, version_report):
+    """
+    :param bank_name: Name of the bank the export was entered for
+    :param version_report: enter_bank_version result
+    """
+    if not version_report:
+        st.info(f"No changes in '{bank_name}' since its latest version")
+        return
+
+    st.success(
+        f"Stored '{bank_name}' version {version_report['version']}: {version_report['added']} added, "
+        f"{version_report['removed']} removed, {version_report['changed']} changed"
+    )
+    if version_report["remaining_cooldown"]:
+        st.info(f"Version valued by the next refresh. Remaining cooldown: {version_report['remaining_cooldown']}")
 
 
 def display_bank_browser():
-    with SessionLocal() as db:
-        all_banks = get_all_banks(db=db)
+    all_banks = cached_banks()
 
     if not all_banks:
         st.warning("Please select 'Import New Bank' and follow instructions to start")
@@ -30,12 +54,21 @@ def display_bank_browser():
         st.info("9. Right click the new saved snapshot and click 'Copy item data to clipboard'")
         st.info("10. Enter your desired name for this bank below(Example: Original Bank)")
 
-        bank_name_input = st.text_input("Bank Name")
+        # A new export of a bank already in the db is stored as its next version -> only the changed items are kept
+        as_new_version = bool(all_banks) and st.checkbox(label="Add as a new version of an existing bank")
+        if as_new_version:
+            bank_name_input = st.selectbox(label="Bank", options=[bank.name for bank in all_banks])
+        else:
+            bank_name_input = st.text_input("Bank Name")
 
         # Initialize session state flags
         if "bank_submitted" not in st.session_state:
             st.session_state.bank_submitted = False
 
+        # Set before the rerun of the last version import -> shown once on the page drawn after it
+        if "version_report" in st.session_state:
+            show_version_report(*st.session_state.pop("version_report"))
+
         if st.button(label="Submit Bank Data", type="primary"):
             if not bank_name_input:
                 st.error("Please enter a bank name for this snapshot")
@@ -44,15 +77,26 @@ def display_bank_browser():
                 with SessionLocal() as db:
                     is_name_unique = bank_name_is_unique(db=db, bank_name=bank_name_input)
 
-                if not is_name_unique:
-                    st.error(f"{bank_name_input} already exist. Delete existing Bank or choose new name")
+                if not is_name_unique and not as_new_version:
+                    st.error(f"{bank_name_input} already exists. Delete existing Bank or choose new name")
                 else:
                     is_tsv, bank_data = verify_tsv()
                     if is_tsv:
-                        enter_tsv_into_db(tsv_data=bank_data, file_name=bank_name_input)
-                        total_bank_items = convert_all_items_to_json(file_name=bank_name_input)
+                        # Parsed again on confirm, the pasted data is only held in session state
+                        items = list(parse_bank_tsv(bank_data.splitlines()))
+                        total_bank_items = len(items)
+
+                        # Hash lookup for an earlier import of the same export, before anything is written
+                        match, duplicate_bank = None, None
+                        if not as_new_version:
+                            with SessionLocal() as db:
+                                match, duplicate_bank = find_duplicate_bank(db=db, items=items)
+
+                        st.session_state.duplicate = (match, duplicate_bank.id, duplicate_bank.name) if match else None
                         st.session_state.bank_submitted = True
                         st.session_state.bank_name_input = bank_name_input
+                        st.session_state.as_new_version = as_new_version
+                        st.session_state.bank_data = bank_data
                         st.session_state.total_bank_items = total_bank_items
                         st.success(f"Bank data loaded. Total items: {total_bank_items}")
                     else:
@@ -62,78 +106,133 @@ def display_bank_browser():
             bank_name_input = st.session_state.bank_name_input
             st.warning(f"Is this the correct number of items in '{bank_name_input}'? ({st.session_state.total_bank_items})")
 
+            if st.session_state.duplicate:
+                match, duplicate_bank_id, duplicate_bank_name = st.session_state.duplicate
+                if match == "exact":
+                    st.info(
+                        f"This export is identical to '{duplicate_bank_name}'. Link '{bank_name_input}' to it to "
+                        f"share its items and price history instead of storing a copy."
+                    )
+                    if st.button(f"Link '{bank_name_input}' to '{duplicate_bank_name}'"):
+                        with SessionLocal() as db:
+                            link_bank_name(db=db, bank_name=bank_name_input, bank_id=duplicate_bank_id)
+
+                        st.session_state.bank_submitted = False
+                        st.session_state.bank_data = None
+                        st.rerun()
+                else:
+                    st.info(f"Same items as '{duplicate_bank_name}' with different quantities")
+
             col1, col2 = st.columns(2)
             with col1:
                 if st.button("Bank item count is CORRECT"):
                     with SessionLocal() as db:
-                        initial_enter_all_items_current_price(
-                            db=db,
-                            file_name=bank_name_input,
-                            bank_name=bank_name_input
-                        )
-
-                    # Clean up temp files and rerun
-                    for file_type in ["txt", "json"]:
-                        delete_file(file_name=bank_name_input, file_type=file_type)
+                        if st.session_state.as_new_version:
+                            version_report = enter_bank_version(
+                                db=db,
+                                bank_name=bank_name_input,
+                                items=parse_bank_tsv(st.session_state.bank_data.splitlines())
+                            )
+                            st.session_state.version_report = (bank_name_input, version_report)
+                        else:
+                            enter_bank_tsv(
+                                db=db,
+                                tsv_data=st.session_state.bank_data,
+                                bank_name=bank_name_input
+                            )
 
                     st.session_state.bank_submitted = False
+                    st.session_state.bank_data = None
                     st.rerun()
 
             with col2:
                 if st.button("INCORRECT bank item count"):
                     st.error("Bank not added to database")
-                    for file_type in ["txt", "json"]:
-                        delete_file(file_name=bank_name_input, file_type=file_type)
-
                     st.session_state.bank_submitted = False
+                    st.session_state.bank_data = None
                     st.rerun()
 
+    with st.expander(label="Import Bank Directory"):
+        st.info("Imports every saved Bank Memory export (.txt) in a directory, each file becomes a bank named after it")
+        import_directory = st.text_input(label="Export Directory", value="items/exports")
+
+        if st.button(label="Import Directory"):
+            if not os.path.isdir(import_directory):
+                st.error(f"Directory '{import_directory}' not found")
+            else:
+                import_results = import_bank_directory(directory=import_directory)
+                if not import_results:
+                    st.warning(f"No .txt exports found in '{import_directory}'")
+                else:
+                    imported = sum(1 for result in import_results if not result["error"])
+                    st.success(f"Imported {imported} of {len(import_results)} banks")
+                    st.dataframe(data=pd.DataFrame(import_results), hide_index=True)
+
     if all_banks:
         all_bank_options = [bank.name for bank in all_banks]
         # Logic for bank snapshot deletion
         with st.expander(label="Delete Bank Snapshot"):
             st.warning("Warning! This will delete everything in the database entered related to your selected bank.")
             bank_to_delete = st.selectbox(label="Select Bank to Delete", options=all_bank_options)
+            reclaim_disk_space = st.checkbox(label="Reclaim disk space after deletion")
+            # Set before the rerun below -> shown once on the page drawn without the deleted bank
+            if "deletion_report" in st.session_state:
+                st.success(st.session_state.pop("deletion_report"))
+
             if st.button(f"Submit deletion of '{bank_to_delete}'"):
                 with SessionLocal() as db:
-                    deletion_status = delete_bank(db=db, bank_name=bank_to_delete)
+                    deletion_status = delete_bank(
+                        db=db,
+                        bank_name=bank_to_delete,
+                        vacuum="incremental" if reclaim_disk_space else None,
+                    )
 
                 if deletion_status:
-                    st.success(f"Successfully deleted: {bank_to_delete}")
+                    bytes_reclaimed = deletion_status.pop("bytes_reclaimed", None)
+                    rows_removed = ", ".join(f"{rows:,} {table}" for table, rows in deletion_status.items() if rows)
+                    deletion_report = f"Successfully deleted: {bank_to_delete} -> removed {rows_removed}"
+                    if bytes_reclaimed is not None:
+                        deletion_report += f", reclaimed {bytes_reclaimed:,} bytes"
+
+                    st.session_state.deletion_report = deletion_report
                     st.rerun()
                 else:
                     st.warning(f"Failed to delete: {bank_to_delete}, may not exist.")
                     st.rerun()
 
-        # Logic for DF creation
-        selected_bank = st.selectbox(label="Select a bank", options=all_bank_options)
+        with st.expander(label="Compact Price History"):
+            st.info(
+                "Price history older than 7 days is merged to one entry per day, "
+                "older than 30 days to one entry per week. Min, max and mean prices are kept. "
+                "Full history is exported to the archive directory first."
+            )
+            if st.button("Compact Price History"):
+                export_report = export_price_history()
+                st.success(f"Archived {export_report['rows']:,} price snapshots")
 
-        with SessionLocal() as db:
-            bank_id = get_bank_id_by_name(db=db, bank_name=selected_bank)
-            all_bank_items = read_all_items_by_bank_id(db=db, bank_id=bank_id)
+                report = compact_price_history()
+                st.success(
+                    f"Merged {report['runs_removed']} price runs in {report['buckets_compacted']} buckets, "
+                    f"freed {report['bytes_freed'] / 1024:,.0f} KB"
+                )
 
-        column_order = [
-            "name", "quantity", "is_tradeable", "uncharged_id", "has_ornament_kit_equipped", "item_id"
-        ]
-        df = to_dataframe(entries=all_bank_items, column_order=column_order)
+        # Logic for DF creation
+        selected_bank = st.selectbox(label="Select a bank", options=all_bank_options)
 
-        # Pandas changed uncharged_id from int to float if not Null -> reverting back to int for UI, id is not float
-        df["uncharged_id"] = df["uncharged_id"].astype("Int64")
+        bank_id = cached_bank_id(bank_name=selected_bank)
+        alias_names = cached_alias_names(bank_id=bank_id)
 
-        styled_df = add_style_to_df(df=df)
+        if alias_names:
+            st.caption(f"Also imported as: {', '.join(alias_names)}")
 
         if st.checkbox(label="Show All Bank Items", value=False, width="content"):
             st.markdown(
                 f"<h4 style='text-align: center;'>Items In '{selected_bank}'</h4>",
                 unsafe_allow_html=True
             )
-            st.dataframe(data=styled_df, hide_index=True)
+            display_bank_items_page(bank_id=bank_id)
 
-            total_low_value, total_mean_value, total_high_value = calculate_valuation(
-                all_bank_items=all_bank_items,
-                db=db,
-                selected_bank=selected_bank
-            )
+            total_low_value, total_mean_value, total_high_value = cached_valuation(bank_name=selected_bank)
 
             st.write("**GP Valuation**")
 
@@ -147,3 +246,72 @@ def display_bank_browser():
 
             with right:
                 st.write(f"High: {total_high_value:,}")
+
+
+def display_bank_items_page(bank_id: int):
+    """
+    Bank items one page at a time, filtered, sorted and paged in SQL so rendering costs the same for any bank size.
+    Pages are keyset paginated -> the after key of every visited page is kept so Previous can step back.
+    """
+    sort_col, order_col, size_col = st.columns(3)
+    with sort_col:
+        sort = st.selectbox(label="Sort by", options=list(BANK_ITEM_SORT_COLUMNS), key="bank_items_sort")
+    with order_col:
+        descending = st.selectbox(label="Order", options=["Ascending", "Descending"], key="bank_items_order")
+        descending = descending == "Descending"
+    with size_col:
+        page_size = st.selectbox(label="Items per page", options=[25, 50, 100, 250], index=1, key="bank_items_size")
+
+    name_col, tradeable_col, uncharged_col, ornament_col = st.columns(4)
+    with name_col:
+        name_prefix = st.text_input(label="Name starts with", key="bank_items_name")
+    with tradeable_col:
+        is_tradeable = st.selectbox(label="is_tradeable", options=list(FILTER_OPTIONS), key="bank_items_tradeable")
+    with uncharged_col:
+        has_uncharged_id = st.selectbox(label="uncharged_id", options=list(FILTER_OPTIONS), key="bank_items_uncharged")
+    with ornament_col:
+        has_ornament_kit_equipped = st.selectbox(
+            label="has_ornament_kit_equipped", options=list(FILTER_OPTIONS), key="bank_items_ornament_kit"
+        )
+
+    query = {
+        "bank_id": bank_id,
+        "sort": sort,
+        "descending": descending,
+        "page_size": page_size,
+        "is_tradeable": FILTER_OPTIONS[is_tradeable],
+        "has_uncharged_id": FILTER_OPTIONS[has_uncharged_id],
+        "has_ornament_kit_equipped": FILTER_OPTIONS[has_ornament_kit_equipped],
+        "name_prefix": name_prefix.strip() or None,
+    }
+
+    # Another bank, sort or filter starts again at the first page
+    if st.session_state.get("bank_items_query") != query:
+        st.session_state.bank_items_query = query
+        st.session_state.bank_items_pages = [None]
+
+    pages = st.session_state.bank_items_pages
+    df, total, next_after = cached_bank_items_page(after=pages[-1], **query)
+
+    column_order = [
+        "name", "quantity", "is_tradeable", "uncharged_id", "has_ornament_kit_equipped", "item_id"
+    ]
+    df = reorder_df(df=df, order=column_order)
+
+    # Pandas changed uncharged_id from int to float if not Null -> reverting back to int for UI, id is not float
+    df["uncharged_id"] = df["uncharged_id"].astype("Int64")
+
+    st.dataframe(data=add_style_to_df(df=df), hide_index=True)
+
+    first_item = (len(pages) - 1) * page_size
+    previous_col, position_col, next_col = st.columns([1, 2, 1])
+    with previous_col:
+        if st.button(label="Previous", disabled=len(pages) == 1, width="stretch"):
+            pages.pop()
+            st.rerun()
+    with position_col:
+        st.caption(f"Items {min(first_item + 1, total):,}-{first_item + len(df):,} of {total:,}")
+    with next_col:
+        if st.button(label="Next", disabled=next_after is None, width="stretch"):
+            pages.append(next_after)
+            st.rerun()
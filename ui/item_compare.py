@@ -1,16 +1,16 @@
 import pandas as pd
 import streamlit as st
 
-from app.crud.database import get_all_banks, read_item_quantity_by_bank_item_id
 from app.database import SessionLocal
-from app.crud.database import read_single_item_snapshots, get_similar_item_snapshots
-from app.utils.transformers import to_dataframe, reorder_df, add_style_to_df
-from app.utils.snapshot import enter_all_items_current_price
+from app.crud.database import get_similar_item_snapshots
+from app.utils.transformers import reorder_df, add_style_to_df
+from app.utils.price_charts import PRICE_HISTORY_WINDOWS
+from app.utils.snapshot import enter_all_items_current_price, enter_all_banks_current_price
+from ui.utils.cache import cached_banks, cached_price_history, cached_item_price_chart
 
 
 def display_item_compare():
-    with SessionLocal() as db:
-        all_banks = get_all_banks(db=db)
+    all_banks = cached_banks()
 
     if not all_banks:
         st.warning("Please import a bank snapshot by clicking 'View Bank Snapshots' button")
@@ -18,7 +18,13 @@ def display_item_compare():
         all_bank_options = [bank.name for bank in all_banks]
         selected_bank = st.selectbox(label="Select a bank", options=all_bank_options)
 
-        if st.button(label="Get Current Prices"):
+        current_prices_col, all_banks_col = st.columns(2)
+        with current_prices_col:
+            get_current_prices = st.button(label="Get Current Prices", width="stretch")
+        with all_banks_col:
+            get_all_banks_current_prices = st.button(label="Get Current Prices For All Banks", width="stretch")
+
+        if get_current_prices:
             can_create_snapshot, remaining_cooldown = enter_all_items_current_price(bank_name=selected_bank)
             if can_create_snapshot:
                 st.success("New prices fetched - new snapshots created")
@@ -28,27 +34,32 @@ def display_item_compare():
                     f"Remaining cooldown: {remaining_cooldown}"
                 )
 
+        if get_all_banks_current_prices:
+            refresh_results = enter_all_banks_current_price()
+            refreshed_banks = [name for name, (refreshed, _) in refresh_results.items() if refreshed]
+            if refreshed_banks:
+                st.success(f"New prices fetched - new snapshots created for: {', '.join(refreshed_banks)}")
+
+            for name, (refreshed, remaining_cooldown) in refresh_results.items():
+                if not refreshed:
+                    st.warning(f"'{name}' skipped. Remaining cooldown: {remaining_cooldown}")
+
         requested_item = st.text_input(label="Search an item")
+        windows = list(PRICE_HISTORY_WINDOWS)
+        selected_window = st.selectbox(label="Price history window", options=windows,
+                                       index=windows.index("All time"))
 
         if not requested_item:
             st.info("Enter an item name to search.")
             return
 
         with SessionLocal() as db:
-            item_snapshots = read_single_item_snapshots(
-                db=db,
-                item_name=requested_item.capitalize(),
-                bank_name=selected_bank,
-            )
+            df = cached_price_history(bank_name=selected_bank, item_name=requested_item.capitalize(),
+                                      window=selected_window)
 
-            if item_snapshots:
-                df = to_dataframe(entries=item_snapshots)
-
-                item_quantity = read_item_quantity_by_bank_item_id(db=db, bank_item_id=item_snapshots[0].bank_item_id)
-
-                # add quantity and single_item_price to df
-                df["quantity"] = item_quantity
-                df["single_item_price"] = df["mean_value_estimate"] / item_quantity
+            if not df.empty:
+                # add single_item_price to df
+                df["single_item_price"] = df["mean_value_estimate"] / df["quantity"]
 
                 # add commas to numbers for readability
                 for col in ["low_value_estimate", "mean_value_estimate", "high_value_estimate", "single_item_price"]:
@@ -70,10 +81,21 @@ def display_item_compare():
 
                 st.markdown(f"<h4 style='text-align: center;'>{requested_item.capitalize()}</h4>", unsafe_allow_html=True)
 
+                # unit prices at each snapshot plus wiki api averages, downsampled to a fixed number of points
+                chart = cached_item_price_chart(bank_name=selected_bank, item_name=requested_item.capitalize(),
+                                                window=selected_window)
+                st.line_chart(data=chart)
+
                 st.dataframe(data=styled_df, hide_index=True)
 
                 return
 
+            if PRICE_HISTORY_WINDOWS[selected_window] is not None and not cached_price_history(
+                bank_name=selected_bank, item_name=requested_item.capitalize()
+            ).empty:
+                st.info(f"No snapshots of '{requested_item.capitalize()}' in the last {selected_window}.")
+                return
+
             similar_items = get_similar_item_snapshots(
                 db=db,
                 user_entry=requested_item.capitalize(),
@@ -86,22 +108,11 @@ def display_item_compare():
                 st.warning(f"No exact match found for '{requested_item}'. Did you mean?: ")
                 for item in similar_items:
                     with st.expander(f"- **{item.name}**"):
-                        snapshots = read_single_item_snapshots(
-                            db=db,
-                            item_name=item.name,
-                            bank_name=selected_bank,
-                        )
-                        if snapshots:
-                            df = to_dataframe(entries=snapshots)
-
-                            item_quantity = read_item_quantity_by_bank_item_id(
-                                db=db,
-                                bank_item_id=snapshots[0].bank_item_id,
-                            )
-
-                            # add quantity and single_item_price to df
-                            df["quantity"] = item_quantity
-                            df["single_item_price"] = df["mean_value_estimate"] / item_quantity
+                        df = cached_price_history(bank_name=selected_bank, item_name=item.name,
+                                                  window=selected_window)
+                        if not df.empty:
+                            # add single_item_price to df
+                            df["single_item_price"] = df["mean_value_estimate"] / df["quantity"]
 
                             # add commas to numbers for readability
                             for col in ["low_value_estimate", "mean_value_estimate", "high_value_estimate", "single_item_price"]:
@@ -2,33 +2,40 @@ import pandas as pd
 import numpy as np
 import streamlit as st
 
-from app.crud.database import get_all_banks, get_bank_id_by_name, read_all_items_by_bank_id
-from app.database import SessionLocal
-from app.utils.transformers import to_dataframe, reorder_df, add_style_to_df
-from ui.utils.valuation import calculate_valuation, create_item_valuation_list
+from app.utils.comparison import VALUATION_TYPES
+from app.utils.transformers import reorder_df, add_style_to_df
+from ui.utils.cache import cached_banks, cached_bank_id, cached_bank_items, cached_comparison
+from ui.utils.cache import cached_price_history, cached_versioned_banks, cached_bank_versions, cached_version_diff
 
 
 def display_snapshot_compare():
-    with SessionLocal() as db:
-        all_banks = get_all_banks(db=db)
+    all_banks = cached_banks()
 
     if not all_banks:
         st.warning("Please select 'Import New Bank' and follow instructions to start")
 
     elif len(all_banks) < 2:
         st.warning("Only one bank snapshot found, please add another snapshot in 'View Bank Snapshots' for comparison")
+        display_version_compare()
 
     else:
+        display_version_compare()
+
         all_bank_options = [bank.name for bank in all_banks]
 
-        bank_1, bank_2 = st.columns(2)
+        # Selection of the banks to compare, the others are compared against the baseline
+        selected_banks = st.multiselect(
+            label="Select banks to compare",
+            options=all_bank_options,
+            default=all_bank_options[:2],
+            key="compared_banks",
+        )
 
-        # Selection of 2 banks
-        with bank_1:
-            selected_bank_1 = st.selectbox(label="Select a bank", options=all_bank_options, key="bank_1", index=0)
+        if len(selected_banks) < 2:
+            st.info("Select at least two banks to compare")
+            return
 
-        with bank_2:
-            selected_bank_2 = st.selectbox(label="Select a bank", options=all_bank_options, key="bank_2", index=1)
+        baseline_bank = st.selectbox(label="Baseline bank", options=selected_banks, key="baseline_bank", index=0)
 
         st.write("**Data Frame Filters**")
 
@@ -60,161 +67,128 @@ def display_snapshot_compare():
             if selected:
                 column_order.append(key)
 
-        # DF creation broken into 2 cols
-        df_1, df_2 = st.columns(2)
-
-        with df_1:
-            with SessionLocal() as db:
-                df_1_bank_id = get_bank_id_by_name(db=db, bank_name=selected_bank_1)
-                df_1_all_bank_items = read_all_items_by_bank_id(db=db, bank_id=df_1_bank_id)
-
-            df = to_dataframe(entries=df_1_all_bank_items, column_order=column_order)
-
-            # Pandas changed uncharged_id from int to float if not Null -> reverting back to int for UI, id is not float
-            if options_1["uncharged_id"]:
-                df["uncharged_id"] = df["uncharged_id"].astype("Int64")
-
-            styled_df = add_style_to_df(df=df)
-
-            st.markdown(
-                f"<h4 style='text-align: center;'>{selected_bank_1}</h4>",
-                unsafe_allow_html=True
-            )
-            st.dataframe(data=styled_df, hide_index=True)
-
-        with df_2:
-            with SessionLocal() as db:
-                df_2_bank_id = get_bank_id_by_name(db=db, bank_name=selected_bank_2)
-                df_2_all_bank_items = read_all_items_by_bank_id(db=db, bank_id=df_2_bank_id)
+        # One DF per selected bank side by side
+        for bank_col, selected_bank in zip(st.columns(len(selected_banks)), selected_banks):
+            with bank_col:
+                bank_id = cached_bank_id(bank_name=selected_bank)
+                df = reorder_df(df=cached_bank_items(bank_id=bank_id), order=column_order)
 
-            df = to_dataframe(entries=df_2_all_bank_items, column_order=column_order)
+                # Pandas changed uncharged_id from int to float if not Null -> reverting back to int for UI, id is not float
+                if options_1["uncharged_id"]:
+                    df["uncharged_id"] = df["uncharged_id"].astype("Int64")
 
-            # Pandas changed uncharged_id from int to float if not Null -> reverting back to int for UI, id is not float
-            if options_1["uncharged_id"]:
-                df["uncharged_id"] = df["uncharged_id"].astype("Int64")
+                styled_df = add_style_to_df(df=df)
 
-            styled_df = add_style_to_df(df=df)
+                st.markdown(
+                    f"<h4 style='text-align: center;'>{selected_bank}</h4>",
+                    unsafe_allow_html=True
+                )
+                st.dataframe(data=styled_df, hide_index=True)
 
-            st.markdown(
-                f"<h4 style='text-align: center;'>{selected_bank_2}</h4>",
-                unsafe_allow_html=True
-            )
-            st.dataframe(data=styled_df, hide_index=True)
+        # Every selected bank valued at its latest snapshot and pivoted item by item in one pass
+        comparison = cached_comparison(bank_names=selected_banks)
 
         # Gp Valuation expander
         with st.expander(label="GP Valuations"):
-            bank_1_val, bank_2_val = st.columns(2)
-
-            with bank_1_val:
-                st.write(f"**{selected_bank_1}**")
-                total_low_value, total_mean_value, total_high_value = calculate_valuation(
-                    all_bank_items=df_1_all_bank_items,
-                    db=db,
-                    selected_bank=selected_bank_1
-                )
-
-                st.write(f"Low: {total_low_value:,}")
-                st.write(f"Mean: {int(total_mean_value):,}")
-                st.write(f"High: {total_high_value:,}")
+            low_totals, mean_totals, high_totals = (
+                comparison.totals(valuation_type=valuation_type) for valuation_type in VALUATION_TYPES
+            )
 
-            with bank_2_val:
-                st.write(f"**{selected_bank_2}**")
-                total_low_value, total_mean_value, total_high_value = calculate_valuation(
-                    all_bank_items=df_2_all_bank_items,
-                    db=db,
-                    selected_bank=selected_bank_2
+            for bank_col, bank_name, low, mean, high in zip(
+                    st.columns(len(comparison.bank_names)), comparison.bank_names, low_totals, mean_totals, high_totals
+            ):
+                with bank_col:
+                    st.write(f"**{bank_name}**")
+                    st.write(f"Low: {int(low):,}")
+                    st.write(f"Mean: {int(mean):,}")
+                    st.write(f"High: {int(high):,}")
+
+            if len(comparison.bank_names) > 2:
+                st.write("**Mean value difference (column - row)**")
+                st.dataframe(data=add_style_to_df(df=comparison.pairwise_totals()))
+
+        # Value history expander -> archived + live price history summed per snapshot
+        with st.expander(label="Value History"):
+            value_history = pd.DataFrame({
+                selected_bank: (
+                    cached_price_history(bank_name=selected_bank)
+                    .groupby("timestamp")["mean_value_estimate"]
+                    .sum()
                 )
+                for selected_bank in selected_banks
+            })
 
-                st.write(f"Low: {total_low_value:,}")
-                st.write(f"Mean: {int(total_mean_value):,}")
-                st.write(f"High: {total_high_value:,}")
+            if value_history.empty:
+                st.info("No price history found for the selected banks")
+            else:
+                st.line_chart(data=value_history)
 
         # Comparisons expander
-        with (st.expander(label="Comparisons")):
-            bank_1_valuation_data = create_item_valuation_list(
-                all_bank_items=df_1_all_bank_items,
-                db=db,
-                selected_bank=selected_bank_1
-            )
+        with st.expander(label="Comparisons"):
+            valuation_type_selected = st.selectbox(label="**Valuation Options**", index=1, options=VALUATION_TYPES)
 
-            bank_2_valuation_data = create_item_valuation_list(
-                all_bank_items=df_2_all_bank_items,
-                db=db,
-                selected_bank=selected_bank_2
-            )
+            merged_df = comparison.items_frame(baseline=baseline_bank, valuation_type=valuation_type_selected)
+            st.caption(f"Differences are each bank minus '{baseline_bank}'")
+            st.dataframe(data=add_style_to_df(df=merged_df), hide_index=True)
 
-            valuation_options = ["low_value", "mean_value", "high_value"]
-            valuation_type_selected = st.selectbox(label="**Valuation Options**", index=1, options=valuation_options)
+            # display top 10 most valuable items in bank
+            st.write("**Top 10 Highest Value by Mean**")
+            for bank_name in comparison.bank_names:
+                st.write(bank_name)
+                st.dataframe(data=add_style_to_df(df=comparison.top_items(bank_name=bank_name)), hide_index=True)
 
-            column_order = ["name", "quantity", valuation_type_selected]
+            # Display top 10 highest quantity items in bank
+            st.write("**Top 10 Highest Quantity of Items**")
+            for bank_name in comparison.bank_names:
+                st.write(bank_name)
+                st.dataframe(
+                    data=add_style_to_df(df=comparison.top_items(bank_name=bank_name, by="quantity")),
+                    hide_index=True,
+                )
 
-            df_bank_1 = reorder_df(df=pd.DataFrame(bank_1_valuation_data), order=column_order)
-            df_bank_2 = reorder_df(df=pd.DataFrame(bank_2_valuation_data), order=column_order)
 
-            merged_df = pd.merge(
-                df_bank_1,
-                df_bank_2,
-                on="name",
-                how="outer",
-                suffixes=(f"_{selected_bank_1}", f"_{selected_bank_2}")
-            )
+def display_version_compare():
+    """Two versions of one bank diffed from the stored deltas, only shown once a bank has been re-imported."""
+    versioned_banks = cached_versioned_banks()
 
-            # Create quantity_diff col
-            merged_df["quantity_diff"] = (
-                (
-                    merged_df[f"quantity_{selected_bank_1}"].fillna(0) -
-                    merged_df[f"quantity_{selected_bank_2}"].fillna(0)
-                )
-                .abs()
-            )
+    if not versioned_banks:
+        return
 
-            # Create valuation diff col depending on valuation_type_selected
-            merged_df[f"{valuation_type_selected}_diff"] = (
-                (
-                    merged_df[f"{valuation_type_selected}_{selected_bank_1}"].fillna(0) -
-                    merged_df[f"{valuation_type_selected}_{selected_bank_2}"].fillna(0)
-                )
-                .abs()
-            )
+    with st.expander(label="Compare Bank Versions"):
+        bank_options = {bank.name: bank.id for bank in versioned_banks}
+        selected_bank = st.selectbox(label="Select a bank", options=list(bank_options), key="version_bank")
+        bank_id = bank_options[selected_bank]
 
-            merged_df["quantity_direction"] = np.select(
-                [
-                    merged_df[f"quantity_{selected_bank_1}"].isna() & ~merged_df[f"quantity_{selected_bank_2}"].isna(),
-                    merged_df[f"quantity_{selected_bank_2}"].isna() & ~merged_df[f"quantity_{selected_bank_1}"].isna(),
-                    merged_df[f"quantity_{selected_bank_1}"] > merged_df[f"quantity_{selected_bank_2}"],
-                    merged_df[f"quantity_{selected_bank_1}"] < merged_df[f"quantity_{selected_bank_2}"],
-                ],
-                [
-                    f"'{selected_bank_1}' missing",
-                    f"'{selected_bank_2}' missing",
-                    f"'{selected_bank_1}' higher",
-                    f"'{selected_bank_2}' higher",
-                ],
-                default="No Difference",
-            )
+        versions = cached_bank_versions(bank_id=bank_id)
 
-            styled_df = add_style_to_df(df=merged_df)
+        version_labels = {
+            f"v{version.version} ({version.created_at:%Y-%m-%d %H:%M}, {version.item_count} items)": version.version
+            for version in versions
+        }
+        labels = list(version_labels)
 
-            st.dataframe(data=styled_df, hide_index=True)
+        version_col_1, version_col_2 = st.columns(2)
 
-            # display top 10 most valuable items in bank
-            st.write("**Top 10 Highest Value by Mean**")
+        with version_col_1:
+            label_a = st.selectbox(label="Version A", options=labels, index=len(labels) - 2, key="version_a")
 
-            st.write(selected_bank_1)
-            bank_1_top_10_mean = add_style_to_df(df=df_bank_1.nlargest(10, 'mean_value'))
-            st.dataframe(data=bank_1_top_10_mean, hide_index=True)
+        with version_col_2:
+            label_b = st.selectbox(label="Version B", options=labels, index=len(labels) - 1, key="version_b")
 
-            st.write(selected_bank_2)
-            bank_2_top_10_mean = add_style_to_df(df=df_bank_2.nlargest(10, 'mean_value'))
-            st.dataframe(data=bank_2_top_10_mean, hide_index=True)
+        version_a, version_b = version_labels[label_a], version_labels[label_b]
+        diff_df = cached_version_diff(bank_id=bank_id, version_a=version_a, version_b=version_b)
 
-            # Display top 10 highest quantity items in bank
-            st.write("**Top 10 Highest Quantity of Items**")
-            st.write(selected_bank_1)
-            bank_1_top_10_q = add_style_to_df(df=df_bank_1.nlargest(10, 'quantity'))
-            st.dataframe(data=bank_1_top_10_q, hide_index=True)
+        if diff_df.empty:
+            st.info(f"No differences between v{version_a} and v{version_b}")
+            return
 
-            st.write(selected_bank_2)
-            bank_2_top_10_q = add_style_to_df(df=df_bank_2.nlargest(10, 'quantity'))
-            st.dataframe(data=bank_2_top_10_q, hide_index=True)
+        diff_df["change"] = np.select(
+            [diff_df["quantity_a"] == 0, diff_df["quantity_b"] == 0, diff_df["quantity_diff"] > 0],
+            [f"added in v{version_b}", f"removed in v{version_b}", "higher"],
+            default="lower",
+        )
+        diff_df = diff_df.rename(columns={"quantity_a": f"quantity_v{version_a}", "quantity_b": f"quantity_v{version_b}"})
 
+        st.write(f"**{len(diff_df)} items changed**, mean value change at latest prices: "
+                 f"{int(diff_df['mean_value_diff'].sum()):,}")
+        st.dataframe(data=add_style_to_df(df=diff_df), hide_index=True)
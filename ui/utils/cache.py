@@ -0,0 +1,173 @@
+from collections import namedtuple
+
+import streamlit as st
+
+from app.crud.database import get_all_banks, get_bank_id_by_name, read_all_items_by_bank_id, read_bank_alias_names
+from app.crud.database import get_versioned_banks, read_bank_versions, read_bank_items_page, count_bank_items
+from app.database import SessionLocal, get_db_generation
+from app.utils.archive import read_price_history
+from app.utils.price_charts import item_price_chart, window_start
+from app.utils.transformers import to_dataframe
+from app.utils.comparison import compare_banks
+from app.utils.versions import value_version_diff
+from ui.utils.valuation import calculate_valuation
+
+# Streamlit reruns every page on each widget interaction. Reads below are cached per bank and DB generation, so a
+# rerun only touches SQLite after a write bumped the generation. The generation is read from the database once per
+# rerun in streamlit_app.main, writes of this process are seen right away. Entries of older generations are never hit
+# again and age out through max_entries.
+MAX_ENTRIES = 128
+
+CachedBank = namedtuple("CachedBank", ["id", "name", "created_at"])
+CachedBankVersion = namedtuple("CachedBankVersion", ["version", "created_at", "item_count", "change_count"])
+
+
+@st.cache_data(max_entries=MAX_ENTRIES, show_spinner=False)
+def _load_banks(generation: int):
+    with SessionLocal() as db:
+        return [CachedBank(bank.id, bank.name, bank.created_at) for bank in get_all_banks(db=db)]
+
+
+@st.cache_data(max_entries=MAX_ENTRIES, show_spinner=False)
+def _load_bank_id(bank_name: str, generation: int):
+    with SessionLocal() as db:
+        return get_bank_id_by_name(db=db, bank_name=bank_name)
+
+
+@st.cache_data(max_entries=MAX_ENTRIES, show_spinner=False)
+def _load_bank_items(bank_id: int, generation: int):
+    with SessionLocal() as db:
+        return to_dataframe(entries=read_all_items_by_bank_id(db=db, bank_id=bank_id))
+
+
+@st.cache_data(max_entries=MAX_ENTRIES, show_spinner=False)
+def _load_bank_items_total(bank_id: int, generation: int, **filters):
+    with SessionLocal() as db:
+        return count_bank_items(db=db, bank_id=bank_id, **filters)
+
+
+@st.cache_data(max_entries=MAX_ENTRIES, show_spinner=False)
+def _load_bank_items_page(generation: int, **query):
+    with SessionLocal() as db:
+        items, total, next_after = read_bank_items_page(db=db, **query)
+        return to_dataframe(entries=items), total, next_after
+
+
+@st.cache_data(max_entries=MAX_ENTRIES, show_spinner=False)
+def _load_alias_names(bank_id: int, generation: int):
+    with SessionLocal() as db:
+        return read_bank_alias_names(db=db, bank_id=bank_id)
+
+
+@st.cache_data(max_entries=MAX_ENTRIES, show_spinner=False)
+def _load_valuation(bank_name: str, generation: int):
+    with SessionLocal() as db:
+        return calculate_valuation(db=db, selected_bank=bank_name)
+
+
+@st.cache_data(max_entries=MAX_ENTRIES, show_spinner=False)
+def _load_comparison(bank_names: tuple, generation: int):
+    return compare_banks(bank_names=list(bank_names))
+
+
+@st.cache_data(max_entries=MAX_ENTRIES, show_spinner=False)
+def _load_price_history(bank_name: str, item_name, window, generation: int):
+    since = window_start(window=window) if window is not None else None
+    return read_price_history(bank_name=bank_name, item_name=item_name, since=since)
+
+
+@st.cache_data(max_entries=MAX_ENTRIES, show_spinner=False)
+def _load_item_price_chart(bank_name: str, item_name: str, window: str, generation: int):
+    return item_price_chart(bank_name=bank_name, item_name=item_name, window=window)
+
+
+@st.cache_data(max_entries=MAX_ENTRIES, show_spinner=False)
+def _load_versioned_banks(generation: int):
+    with SessionLocal() as db:
+        return [CachedBank(bank_id, name, None) for bank_id, name, _ in get_versioned_banks(db=db)]
+
+
+@st.cache_data(max_entries=MAX_ENTRIES, show_spinner=False)
+def _load_bank_versions(bank_id: int, generation: int):
+    with SessionLocal() as db:
+        return [
+            CachedBankVersion(version.version, version.created_at, version.item_count, version.change_count)
+            for version in read_bank_versions(db=db, bank_id=bank_id)
+        ]
+
+
+@st.cache_data(max_entries=MAX_ENTRIES, show_spinner=False)
+def _load_version_diff(bank_id: int, version_a: int, version_b: int, generation: int):
+    return value_version_diff(bank_id=bank_id, version_a=version_a, version_b=version_b)
+
+
+def cached_banks():
+    """:return: List of CachedBank -> id, name and created_at of every bank"""
+    return _load_banks(generation=get_db_generation())
+
+
+def cached_bank_id(bank_name: str):
+    return _load_bank_id(bank_name=bank_name, generation=get_db_generation())
+
+
+def cached_bank_items(bank_id: int):
+    """:return: pd.DataFrame -> one row per BankItem, callers get their own copy to modify"""
+    return _load_bank_items(bank_id=bank_id, generation=get_db_generation())
+
+
+def cached_bank_items_page(bank_id: int, sort: str, descending: bool, page_size: int, after, **filters):
+    """
+    Items matching the filters are counted once per bank, filters and generation -> paging, sorting or resizing pages
+    of the same filters only seeks.
+    :return: Tuple -> (pd.DataFrame of one page of BankItems, total, next page key), see read_bank_items_page
+    """
+    generation = get_db_generation()
+    total = _load_bank_items_total(bank_id=bank_id, generation=generation, **filters)
+    return _load_bank_items_page(generation=generation, bank_id=bank_id, sort=sort, descending=descending,
+                                 page_size=page_size, after=after, total=total, **filters)
+
+
+def cached_alias_names(bank_id: int):
+    return _load_alias_names(bank_id=bank_id, generation=get_db_generation())
+
+
+def cached_valuation(bank_name: str):
+    """:return: Tuple -> (low, mean, high) totals of the bank's latest snapshot, see calculate_valuation"""
+    return _load_valuation(bank_name=bank_name, generation=get_db_generation())
+
+
+def cached_comparison(bank_names: list):
+    """:return: BankComparison -> see compare_banks"""
+    return _load_comparison(bank_names=tuple(bank_names), generation=get_db_generation())
+
+
+def cached_price_history(bank_name: str, item_name: str = None, window: str = None):
+    """
+    :param window: key of PRICE_HISTORY_WINDOWS -> default the whole history. The window is placed when first read
+                   and kept until the next write, like every other entry
+    :return: pd.DataFrame -> see read_price_history
+    """
+    return _load_price_history(bank_name=bank_name, item_name=item_name, window=window,
+                               generation=get_db_generation())
+
+
+def cached_item_price_chart(bank_name: str, item_name: str, window: str):
+    """:return: pd.DataFrame -> downsampled price series of one item, see item_price_chart"""
+    return _load_item_price_chart(bank_name=bank_name, item_name=item_name, window=window,
+                                  generation=get_db_generation())
+
+
+def cached_versioned_banks():
+    """:return: List of CachedBank -> banks with at least two versions"""
+    return _load_versioned_banks(generation=get_db_generation())
+
+
+def cached_bank_versions(bank_id: int):
+    """:return: List of CachedBankVersion ordered by version"""
+    return _load_bank_versions(bank_id=bank_id, generation=get_db_generation())
+
+
+def cached_version_diff(bank_id: int, version_a: int, version_b: int):
+    """:return: pd.DataFrame -> see value_version_diff"""
+    return _load_version_diff(bank_id=bank_id, version_a=version_a, version_b=version_b,
+                              generation=get_db_generation())